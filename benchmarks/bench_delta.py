@@ -0,0 +1,108 @@
+#!/usr/bin/python2
+""" Compares full reports with delta reports in a steady state.
+
+A synthetic neighbourhood of networks and clients is scanned over and over,
+with a small fraction of clients coming and going between scans. Each scan
+is encoded both as a full report and as the tracker's uplink would with
+delta reporting (a delta, or a full snapshot every so often), and both are
+decoded and applied the way the correlator does. The rebuilt states are
+compared before any numbers are reported.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "server"))
+
+import protocol
+
+
+def neighbourhood(rnd, networks, clients):
+    return dict([("00:11:22:33:%02x:%02x" % (n // 256, n % 256),
+        set([random_mac(rnd) for _ in xrange(clients)]))
+        for n in xrange(networks)])
+
+def random_mac(rnd):
+    return ':'.join(["%02x" % rnd.randrange(256) for _ in xrange(6)])
+
+def churn(rnd, state, fraction):
+    """ Replaces a fraction of all clients with new ones, in place. """
+    macs = [(bssid, mac) for bssid in state for mac in state[bssid]]
+    for bssid, mac in rnd.sample(macs, int(len(macs) * fraction)):
+        state[bssid].discard(mac)
+        state[rnd.choice(state.keys())].add(random_mac(rnd))
+
+def scans(args):
+    rnd = random.Random(args.seed)
+    state = neighbourhood(rnd, args.networks, args.clients)
+    for _ in xrange(args.scans):
+        churn(rnd, state, args.churn)
+        yield dict([(bssid, set(macs)) for bssid, macs in state.iteritems()])
+
+def full_reports(args):
+    sent, elapsed, state = 0, 0.0, None
+    for report in scans(args):
+        frame = protocol.encode(report.items())
+        sent += len(frame)
+
+        start = time.time()
+        state = dict([(bssid, set(macs))
+            for bssid, macs in protocol.decode(frame)])
+        elapsed += time.time() - start
+    return sent, elapsed, state
+
+def delta_reports(args):
+    sent, elapsed, state = 0, 0.0, None
+    previous, deltas = None, 0
+    for report in scans(args):
+        if previous is None or deltas + 1 >= args.snapshot_every:
+            frame, deltas = protocol.encode(report.items()), 0
+        else:
+            frame, deltas = protocol.encode_delta(
+                *protocol.diff(previous, report)), deltas + 1
+        previous = report
+        sent += len(frame)
+
+        start = time.time()
+        if protocol.kind(frame) == protocol.DELTA:
+            protocol.apply_delta(state, *protocol.decode_delta(frame))
+        else:
+            state = dict([(bssid, set(macs))
+                for bssid, macs in protocol.decode(frame)])
+        elapsed += time.time() - start
+    return sent, elapsed, state
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Compares uplink bytes and server work of full and delta reports.")
+    parser.add_argument("-n", "--networks", type=int, default=200,
+        help="networks in range of the tracker")
+    parser.add_argument("-c", "--clients", type=int, default=10,
+        help="clients per network")
+    parser.add_argument("-s", "--scans", type=int, default=100,
+        help="number of scans to report")
+    parser.add_argument("--churn", type=float, default=0.02,
+        help="fraction of clients replaced between scans")
+    parser.add_argument("-S", "--snapshot-every", type=int, default=30,
+        help="every how many scans a full snapshot is sent")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    full_sent, full_time, full_state = full_reports(args)
+    delta_sent, delta_time, delta_state = delta_reports(args)
+    if full_state != delta_state:
+        print "delta reports rebuilt a different state!"
+        sys.exit(1)
+
+    print "%d networks x %d clients, %.1f%% churn, %d scans" % (
+        args.networks, args.clients, args.churn * 100, args.scans)
+    print "%-8s %14s %16s" % ("reports", "bytes/scan", "server us/scan")
+    for name, sent, elapsed in (("full", full_sent, full_time),
+                                ("delta", delta_sent, delta_time)):
+        print "%-8s %14.0f %16.0f" % (name, float(sent) / args.scans,
+            elapsed / args.scans * 1e6)
+    print "reduction: %.1fx bytes, %.1fx server time" % (
+        float(full_sent) / delta_sent, full_time / max(delta_time, 1e-9))
@@ -0,0 +1,96 @@
+#!/usr/bin/python2
+""" Benchmarks the single-pass `filter_networks` pipeline against the chain of
+filters that `tracker.scan` used to apply, on synthetic captures.
+
+For every capture size, both produce their results from the same parsed
+networks and must agree exactly (same networks, same order) before timings
+are reported. The original duplicate-name filter is quadratic in the number of
+distinct names, so it's skipped beyond `--legacy-max` rows.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "tracker"))
+
+import synth
+import networkparser
+
+
+def legacy_filter_duplicate_names(network_list, max_dupes=1):
+    """ `filter_duplicate_names` as it was originally written. """
+    filtered = collections.defaultdict(list)
+    for nw in network_list:
+        results = filtered[nw.name]
+
+        if len(results) < max_dupes:
+            results.append(nw)
+
+        elif nw.signal > max([n.signal for n in filtered[nw.name]]):
+            results[-1] = nw
+
+        filtered[nw.name] = sorted(results, key=lambda x: x.signal, reverse=True)
+
+    return sum(filtered.values(), [])
+
+def legacy_chain(networks):
+    networks = filter(lambda x: x.security == "OPN", networks)
+    return legacy_filter_duplicate_names(networks)
+
+def pipeline(networks):
+    return networkparser.filter_networks(networks, open_only=True)
+
+def load(rows):
+    """ Parses a synthetic capture with `rows` networks. """
+    fd, filename = tempfile.mkstemp(suffix=".csv")
+    try:
+        with os.fdopen(fd, "w") as f:
+            synth.write_capture(f, rows, 0)
+        with open(filename, "r") as f:
+            return list(networkparser.iter_networks(f))
+    finally:
+        os.remove(filename)
+
+def timed(fn, arg, repeat):
+    best, result = None, None
+    for _ in xrange(repeat):
+        start = time.time()
+        result = fn(arg)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Compares the network filter pipeline with the original filter chain.")
+    parser.add_argument("-s", "--sizes", default="10000,100000,1000000",
+        help="comma-separated capture sizes, in network rows")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+        help="number of runs per size, the best is reported")
+    parser.add_argument("--legacy-max", type=int, default=100000,
+        help="largest capture to run the original filters on")
+    args = parser.parse_args()
+
+    print "%10s %8s %12s %12s %8s" % ("rows", "kept", "legacy", "pipeline",
+        "speedup")
+
+    for rows in [int(x) for x in args.sizes.split(',')]:
+        networks = load(rows)
+        pipeline_t, result = timed(pipeline, networks, args.repeat)
+
+        if rows > args.legacy_max:
+            print "%10d %8d %12s %10.2fms %8s" % (rows, len(result), "-",
+                pipeline_t * 1000, "-")
+            continue
+
+        legacy_t, expected = timed(legacy_chain, networks, args.repeat)
+        if [id(nw) for nw in expected] != [id(nw) for nw in result]:
+            print "%d rows: the pipeline's output differs!" % rows
+            sys.exit(1)
+
+        print "%10d %8d %10.2fms %10.2fms %7.1fx" % (rows, len(result),
+            legacy_t * 1000, pipeline_t * 1000, legacy_t / max(pipeline_t, 1e-9))
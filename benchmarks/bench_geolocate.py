@@ -0,0 +1,150 @@
+#!/usr/bin/python2
+""" Benchmarks network geolocation against a local stand-in for the Google
+and backup geolocation APIs that adds a fixed latency to every request.
+
+Networks are resolved one at a time with `Network.get_location` (as the CLI
+used to), then in bulk with `resolve_locations`, and then in bulk again
+through a `LocationCache` (cold, then warm). All runs must agree on every
+network's location before timings are reported.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import urlparse
+import argparse
+import threading
+import SocketServer
+import BaseHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "tracker"))
+
+import geocache
+import geolocate
+import networkparser
+
+
+class StandIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), StandInHandler)
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Knows two thirds of networks on the primary API, and half of the rest
+    on the backup API, based on a checksum of the BSSID. """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        mac = body["wifiAccessPoints"][0]["macAddress"]
+        self._wait()
+
+        key = zlib.crc32(mac.lower()) & 0xFFFF
+        if key % 3 == 0:
+            self._reply(404, { "error": { "code": 404, "message": "Not Found" } })
+        else:
+            self._reply(200, { "location": { "lat": key / 1000.0, "lng": -key / 1000.0 },
+                "accuracy": 25.0 })
+
+    def do_GET(self):
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        mac = query["bssid"][0]
+        self._wait()
+
+        key = zlib.crc32(mac.lower()) & 0xFFFF
+        if key % 2 == 0:
+            self._reply(200, { "result": 404 })
+        else:
+            self._reply(200, { "result": 200,
+                "data": { "lat": key / 100.0, "lon": key / 100.0, "range": 150.0 } })
+
+    def _wait(self):
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+
+    def _reply(self, status, body):
+        body = json.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_networks(count):
+    return [networkparser.Network("02:00:00:%02X:%02X:%02X" % (
+        i >> 16 & 0xFF, i >> 8 & 0xFF, i & 0xFF), "Network %d" % i, "OPN", "-50")
+        for i in xrange(count)]
+
+def serial(networks, **kwargs):
+    return [(nw, nw.get_location()) for nw in networks]
+
+def bulk(networks, **kwargs):
+    return geolocate.resolve_locations(networks, **kwargs)
+
+def run(label, server, fn, networks, **kwargs):
+    before = server.requests
+    start = time.time()
+    results = fn(networks, **kwargs)
+    elapsed = time.time() - start
+    print "%-28s %8.2fs %9d %10.1f/s" % (label, elapsed, server.requests - before,
+        len(networks) / elapsed)
+    return [result for _, result in results]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Compares serial and bulk geolocation against a local stand-in API.")
+    parser.add_argument("-n", "--networks", type=int, default=100,
+        help="number of networks to resolve")
+    parser.add_argument("-l", "--latency", type=float, default=0.05,
+        help="seconds of latency the stand-in adds to every request")
+    parser.add_argument("-j", "--jobs", type=int, default=8,
+        help="concurrent requests for the bulk resolver")
+    parser.add_argument("--rate", type=float, default=None,
+        help="requests per second for the bulk resolver, unlimited by default")
+    args = parser.parse_args()
+
+    server = StandIn(args.latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+
+    geolocate.API_KEY = "stand-in"
+    geolocate.API_URL = server.url + "/geolocate?key=%s"
+    geolocate.BKP_URL = server.url + "/backup?bssid=%s"
+
+    networks = make_networks(args.networks)
+    cache = geocache.LocationCache(":memory:")
+    options = { "workers": args.jobs, "rate": args.rate }
+
+    print "%-28s %9s %9s %12s" % ("run", "time", "requests", "throughput")
+    expected = run("serial get_location", server, serial, networks)
+    runs = [
+        run("bulk", server, bulk, networks, **options),
+        run("bulk, cold cache", server, bulk, networks, cache=cache, **options),
+        run("bulk, warm cache", server, bulk, networks, cache=cache, **options),
+    ]
+    print "cache: %s" % cache.stats()
+
+    for results in runs:
+        if results != expected:
+            print "Bulk resolution disagrees with serial resolution!"
+            sys.exit(1)
+
+    server.shutdown()
@@ -0,0 +1,83 @@
+#!/usr/bin/python2
+""" Measures how much the correlator's logging costs its ingest path.
+
+The same stream of tracker payloads is framed by a `ReadQueue` and handed to
+`_on_message`, exactly as the server does, once per output level. Output is
+sent to /dev/null, so what's measured is the cost of building and emitting
+messages rather than the speed of a terminal.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "server"))
+
+import log
+import protocol
+import correlator
+
+
+def make_stream(count, networks, macs, version):
+    """ Builds `count` tracker payloads, each reporting a few networks. """
+    payload = protocol.encode([("00:11:22:33:44:%02x" % n,
+        ["aa:bb:cc:dd:%02x:%02x" % (n, i % 256) for i in xrange(macs)])
+        for n in xrange(networks)], version=version, compress=False)
+    return payload * count
+
+def ingest(server, chunks):
+    queue = correlator.ReadQueue(max_frame=1 << 30)
+    frames = 0
+    for chunk in chunks:
+        frames += queue.read(chunk)
+        for message in queue.drain():
+            server._on_message(message)
+    return frames
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in xrange(repeat):
+        start = time.time()
+        result = fn()
+        timings.append(time.time() - start)
+    return min(timings), result
+
+LEVELS = [
+    # name,         verbosity,  buffered
+    ("-q",          log.QUIET,  False),
+    ("-v",          1,          False),
+    ("-v, -B",      1,          True),
+    ("-vvv",        3,          False),
+    ("-vvv, -B",    3,          True),
+]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Compares correlator ingest throughput across output levels.")
+    parser.add_argument("-n", "--count", type=int, default=5000,
+        help="number of payloads to ingest per run")
+    parser.add_argument("-P", "--protocol", type=int, default=protocol.VERSION_BINARY,
+        choices=[protocol.VERSION_TEXT, protocol.VERSION_BINARY],
+        help="wire protocol version of the payloads")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+        help="number of runs per level, the best is reported")
+    args = parser.parse_args()
+
+    stream = make_stream(args.count, 4, 8, args.protocol)
+    chunks = [stream[i:i + 4096] for i in xrange(0, len(stream), 4096)]
+    server = correlator.CorrelationServer("localhost", 0)
+    devnull = open(os.devnull, "w")
+
+    print "%-10s %8s %10s %14s %8s" % (
+        "level", "frames", "time", "frames/s", "vs -q")
+
+    baseline = None
+    for name, verbosity, buffered in LEVELS:
+        log.configure(verbosity, buffered=buffered, stream=devnull)
+        elapsed, frames = best_of(lambda: ingest(server, chunks), args.repeat)
+        log.configure(log.QUIET)   # wait for a buffered writer to finish
+
+        baseline = baseline or elapsed
+        print "%-10s %8d %8.2fms %14.0f %7.1fx" % (name, frames,
+            elapsed * 1000, frames / max(elapsed, 1e-9), elapsed / baseline)
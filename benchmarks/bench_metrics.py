@@ -0,0 +1,81 @@
+#!/usr/bin/python2
+""" Measures what the correlator's metrics cost its ingest path.
+
+The same stream of tracker payloads is fed through `_receive` (framing, frame
+handling and all of its instrumentation) twice: once with the server's real
+metrics, and once with every metric replaced by one that does nothing. The
+difference is the price of leaving metrics on.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "server"))
+
+import log
+import protocol
+import correlator
+
+
+class NullMetric(object):
+    def inc(self, amount=1): pass
+    def observe(self, value): pass
+
+class NullMetrics(object):
+    def __getattr__(self, name):
+        setattr(self, name, NullMetric())   # only looked up the first time
+        return getattr(self, name)
+
+
+def make_stream(count, networks, macs):
+    payload = protocol.encode([("00:11:22:33:44:%02x" % n,
+        ["aa:bb:cc:dd:%02x:%02x" % (n, i % 256) for i in xrange(macs)])
+        for n in xrange(networks)], compress=False)
+    return payload * count
+
+def ingest(server, chunks):
+    server.trackers = { None: correlator.ReadQueue(max_frame=1 << 30) }
+    for chunk in chunks:
+        server._receive(None, chunk)
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in xrange(repeat):
+        start = time.time()
+        fn()
+        timings.append(time.time() - start)
+    return min(timings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Compares correlator ingest throughput with and without metrics.")
+    parser.add_argument("-n", "--count", type=int, default=20000,
+        help="number of payloads to ingest per run")
+    parser.add_argument("-s", "--recv-size", type=int, default=4096,
+        help="bytes handed over per simulated recv")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+        help="number of runs per variant, the best is reported")
+    args = parser.parse_args()
+
+    log.configure(log.QUIET)
+    stream = make_stream(args.count, 1, 4)
+    chunks = [stream[i:i + args.recv_size]
+        for i in xrange(0, len(stream), args.recv_size)]
+
+    server = correlator.CorrelationServer("localhost", 0)
+    real = server.metrics
+    with_metrics = best_of(lambda: ingest(server, chunks), args.repeat)
+    server.metrics = NullMetrics()
+    without = best_of(lambda: ingest(server, chunks), args.repeat)
+
+    print "%-16s %10s %14s" % ("variant", "time", "frames/s")
+    for name, elapsed in (("no metrics", without), ("metrics", with_metrics)):
+        print "%-16s %8.2fms %14.0f" % (name, elapsed * 1000,
+            args.count / max(elapsed, 1e-9))
+
+    print "overhead: %.2fus per frame (%.1f%%)" % (
+        (with_metrics - without) / args.count * 1e6,
+        (with_metrics - without) / without * 100)
+    print "frames counted by the real metrics: %d" % real.frames.value
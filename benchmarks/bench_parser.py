@@ -0,0 +1,236 @@
+#!/usr/bin/python2
+""" Benchmarks the capture parser and the network filters on synthetic
+captures of growing size, and keeps the results to compare across commits.
+
+For every capture size, each benchmark runs in a process of its own, so its
+peak resident set size isn't inflated by whatever ran before it:
+
+    parse_csv                   parsing the whole capture, networks and clients
+    filter_open_networks        on the parsed networks
+    filter_signal_threshold     likewise, keeping 30-70
+    filter_duplicate_names      likewise, keeping the strongest of each name
+
+Throughput is in rows per second (capture rows for `parse_csv`, network rows
+for the filters), from the best of `--repeat` runs. Peak RSS is the highest
+the process got while the benchmark ran, parsed capture included.
+
+Results are appended to `results/parser.jsonl` as JSON lines, tagged with the
+commit they were measured on, and `--compare` shows how the latest results of
+another commit measure up:
+
+    ./bench_parser.py --sizes 1000,100000
+    git checkout HEAD~1 && ./bench_parser.py --sizes 1000,100000
+    git checkout - && ./bench_parser.py --sizes 1000,100000 --compare HEAD~1
+"""
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "tracker"))
+
+import synth
+import networkparser
+
+RESULTS = os.path.join(HERE, "results", "parser.jsonl")
+
+SIGNAL_RANGE = (30, 70)
+
+
+def parse(filename):
+    with open(filename, "r") as csvf:
+        return networkparser.parse_csv(csvf)
+
+def bench_parse_csv(filename):
+    """ Returns a function to time, and the number of rows it goes through. """
+    def run():
+        parse(filename).release()
+    with parse(filename) as (networks, clients):
+        rows = len(networks) + len(clients)
+    return run, rows
+
+def bench_filter(filter_fn, *args):
+    def bench(filename):
+        networks, _ = parse(filename)
+        return lambda: filter_fn(networks, *args), len(networks)
+    return bench
+
+BENCHMARKS = [
+    ("parse_csv", bench_parse_csv),
+    ("filter_open_networks", bench_filter(networkparser.filter_open_networks)),
+    ("filter_signal_threshold", bench_filter(
+        networkparser.filter_signal_threshold, *SIGNAL_RANGE)),
+    ("filter_duplicate_names", bench_filter(
+        networkparser.filter_duplicate_names, 1)),
+]
+
+
+def reset_peak_rss():
+    """ Restarts the peak RSS count from the current RSS, if Linux lets us. """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except IOError:
+        pass
+
+def peak_rss():
+    """ Returns the peak resident set size in KiB. """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_child(name, filename, repeat):
+    """ Runs a single benchmark in this process, returning its result. """
+    run, rows = dict(BENCHMARKS)[name](filename)
+
+    gc.collect()
+    reset_peak_rss()
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        run()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return { "rows": rows, "seconds": round(best, 6),
+        "rows_per_s": round(rows / max(best, 1e-9), 1),
+        "peak_rss_kib": peak_rss() }
+
+def run_benchmark(name, filename, repeat):
+    """ Runs a benchmark in a fresh process. """
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+        "--child", name, filename, "--repeat", str(repeat)])
+    return json.loads(output)
+
+
+def git(*args):
+    try:
+        with open(os.devnull, "w") as devnull:
+            return subprocess.check_output(("git", "-C", HERE) + args,
+                stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def revision(rev="HEAD"):
+    """ Returns the short hash of a commit, or None outside of git. """
+    return git("rev-parse", "--short", rev)
+
+def load_results(path, commit):
+    """ Returns the latest results measured on a commit, keyed by
+    (benchmark, capture). """
+    latest = {}
+    if not os.path.exists(path):
+        return latest
+
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            if result["commit"] == commit:
+                latest[key(result)] = result
+    return latest
+
+def key(result):
+    return (result["benchmark"], json.dumps(result["capture"], sort_keys=True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Benchmarks parsing and filtering synthetic captures.")
+    parser.add_argument("-s", "--sizes", default="1000,10000,100000,1000000",
+        help="comma-separated capture sizes, in rows (half of them networks)")
+    parser.add_argument("-b", "--bench", action="append",
+        choices=[name for name, _ in BENCHMARKS],
+        help="only run this benchmark (repeatable)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+        help="number of runs per benchmark, the best is reported")
+    parser.add_argument("--open-ratio", type=float, default=0.25,
+        help="fraction of networks without security")
+    parser.add_argument("--dupe-ratio", type=float, default=0.75,
+        help="names are drawn from (1 - this) times as many ESSIDs as there "
+        "are networks; the higher, the more duplicates")
+    parser.add_argument("--hidden-ratio", type=float, default=0.05,
+        help="fraction of networks with a hidden SSID")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--results", metavar="FILE", default=RESULTS,
+        help="where to append the results")
+    parser.add_argument("--no-save", action="store_true",
+        help="don't store the results")
+    parser.add_argument("--compare", metavar="REV",
+        help="compare with the latest stored results of this commit")
+    parser.add_argument("--child", nargs=2, metavar=("BENCH", "FILE"),
+        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print json.dumps(run_child(args.child[0], args.child[1], args.repeat))
+        sys.exit(0)
+
+    commit = revision()
+    dirty = bool(git("status", "--porcelain", "--untracked-files=no"))
+    baseline = {}
+    if args.compare:
+        baseline = load_results(args.results, revision(args.compare) or
+            args.compare)
+        if not baseline:
+            print "No stored results for %s in %s." % (args.compare, args.results)
+            sys.exit(1)
+
+    names = args.bench or [name for name, _ in BENCHMARKS]
+    print "%-24s %8s %10s %12s %10s %8s" % ("benchmark", "rows", "seconds",
+        "rows/s", "peak RSS", "change")
+
+    saved = []
+    for size in [int(x) for x in args.sizes.split(',')]:
+        networks = size // 2
+        capture = { "networks": networks, "clients": size - networks,
+            "open_ratio": args.open_ratio, "hidden_ratio": args.hidden_ratio,
+            "names": max(1, int(networks * (1 - args.dupe_ratio))),
+            "seed": args.seed }
+
+        fd, filename = tempfile.mkstemp(suffix=".csv")
+        try:
+            with os.fdopen(fd, "w") as f:
+                synth.write_capture(f, capture["networks"], capture["clients"],
+                    args.open_ratio, args.seed, capture["names"],
+                    args.hidden_ratio)
+
+            for name in names:
+                result = run_benchmark(name, filename, args.repeat)
+                result.update({ "benchmark": name, "capture": capture,
+                    "commit": commit, "dirty": dirty, "time": time.time(),
+                    "python": sys.version.split()[0] })
+                saved.append(result)
+
+                change = ""
+                before = baseline.get(key(result))
+                if before:
+                    change = "%.2fx" % (result["rows_per_s"] /
+                        max(before["rows_per_s"], 1e-9))
+                print "%-24s %8d %9.4fs %12.0f %7.1fMiB %8s" % (name,
+                    result["rows"], result["seconds"], result["rows_per_s"],
+                    result["peak_rss_kib"] / 1024.0, change)
+        finally:
+            os.remove(filename)
+
+    if not args.no_save:
+        directory = os.path.dirname(args.results)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(args.results, "a") as f:
+            for result in saved:
+                f.write(json.dumps(result, sort_keys=True) + "\n")
+        print "Results for %s%s appended to %s." % (commit or "an unknown commit",
+            " (with local changes)" if dirty else "", args.results)
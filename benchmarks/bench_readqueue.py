@@ -0,0 +1,114 @@
+#!/usr/bin/python2
+""" Microbenchmarks comparing the correlator's `ReadQueue` framing buffer with
+the original string-based implementation.
+
+Each scenario feeds the same byte stream through both queues, chunked the way
+`recv` would hand it over, and drains every packet. The packets produced by
+both implementations are compared before any timings are reported.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "server"))
+
+import correlator
+
+
+class LegacyReadQueue(object):
+    """ The original `ReadQueue`: one packet per read, `list.pop(0)`. """
+    EOB = '\x00'
+
+    def __init__(self):
+        self.queue = []
+        self.pending = ""
+
+    def read(self, data):
+        self.pending += data
+        index = self.pending.find(self.EOB)
+        if index == -1: return
+
+        self.queue.append(self.pending[:index])
+        self.pending = self.pending[index + len(LegacyReadQueue.EOB):]
+
+    @property
+    def ready(self):
+        return bool(self.queue)
+
+    def pop(self):
+        return self.queue.pop(0)
+
+
+def make_stream(count, macs):
+    """ Builds `count` tracker payloads in the text wire format. """
+    payload = "0123456789ab|%s\x00" % ";".join(
+        ["aa:bb:cc:dd:ee:%02x" % (i % 256) for i in xrange(macs)])
+    return payload * count
+
+def chunked(stream, size):
+    return [stream[i:i + size] for i in xrange(0, len(stream), size)]
+
+def run_legacy(chunks):
+    queue, packets = LegacyReadQueue(), []
+    for chunk in chunks:
+        queue.read(chunk)
+        while queue.ready:
+            packets.append(queue.pop())
+
+    # Whatever piled up behind the last read is only released by more reads.
+    while queue.pending.find(queue.EOB) != -1:
+        queue.read("")
+        while queue.ready:
+            packets.append(queue.pop())
+    return packets
+
+def run_current(chunks):
+    queue, packets = correlator.ReadQueue(max_frame=1 << 30), []
+    for chunk in chunks:
+        queue.read(chunk)
+        packets.extend(queue.drain())
+    return packets
+
+def best_of(fn, arg, repeat):
+    timings = []
+    for _ in xrange(repeat):
+        start = time.time()
+        result = fn(arg)
+        timings.append(time.time() - start)
+    return min(timings), result
+
+SCENARIOS = [
+    # name,                        packets, macs/packet, recv size
+    ("trickle (64B reads)",          2000,    8,           64),
+    ("steady (4KiB reads)",          5000,    8,           4096),
+    ("backlog (64KiB reads)",        5000,    8,           65536),
+    ("backlog, large packets",       500,     200,         65536),
+    ("single burst",                 5000,    8,           1 << 30),
+]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Compares ReadQueue framing throughput against the original class.")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+        help="number of runs per scenario, the best is reported")
+    parser.add_argument("-s", "--scale", type=float, default=1.0,
+        help="multiplies the number of packets in every scenario")
+    args = parser.parse_args()
+
+    print "%-26s %8s %12s %12s %8s" % (
+        "scenario", "packets", "legacy", "current", "speedup")
+
+    for name, count, macs, size in SCENARIOS:
+        count = max(1, int(count * args.scale))
+        chunks = chunked(make_stream(count, macs), size)
+
+        legacy_t, legacy = best_of(run_legacy, chunks, args.repeat)
+        current_t, current = best_of(run_current, chunks, args.repeat)
+        if legacy != current:
+            print "%s: implementations disagree!" % name
+            sys.exit(1)
+
+        print "%-26s %8d %10.2fms %10.2fms %7.1fx" % (name, len(current),
+            legacy_t * 1000, current_t * 1000, legacy_t / max(current_t, 1e-9))
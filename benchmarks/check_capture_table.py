@@ -0,0 +1,77 @@
+#!/usr/bin/python2
+""" Checks that `parse_table` reads back the same networks as `parse_csv`,
+on captures that stress the CaptureTable's string tables:
+
+    names       more than 256 distinct names, then a security level that
+                hasn't been seen yet
+    levels      more than 256 distinct security levels, as only a malformed
+                capture would have
+
+Exits non-zero if any check fails.
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "tracker"))
+
+import synth
+import networkparser
+
+
+def write_capture(f, rows):
+    """ Writes a capture of the given (name, privacy) networks, no clients. """
+    rng = random.Random(0)
+    f.write("\r\n%s\r\n" % synth.NETWORK_COLUMNS)
+    for name, privacy in rows:
+        f.write("%s, %s, 6, 54, %s, CCMP, PSK, %d, 10, 0, 0.  0.  0.  0, %d, "
+            "%s, \r\n" % (synth.random_mac(rng), synth.SEEN, privacy,
+            -rng.randint(20, 95), len(name), name))
+    f.write("\r\n%s\r\n\r\n" % synth.CLIENT_COLUMNS)
+
+def check(name, rows):
+    fd, filename = tempfile.mkstemp(suffix=".csv")
+    try:
+        with os.fdopen(fd, "w") as f:
+            write_capture(f, rows)
+
+        failures = []
+        try:
+            with open(filename, "r") as csvf:
+                table = networkparser.parse_table(csvf)
+            with open(filename, "r") as csvf:
+                networks, _ = networkparser.parse_csv(csvf)
+
+            got = [(nw.mac, nw.name, nw.security, nw.signal)
+                for nw in table.networks]
+            expected = [(nw.mac, nw.name, nw.security, nw.signal)
+                for nw in networks]
+            if got != expected:
+                failures.append("parse_table and parse_csv disagree")
+        except Exception, e:
+            failures.append("parse_table raised %s: %s" % (type(e).__name__, e))
+    finally:
+        os.remove(filename)
+
+    print "%-10s %s" % (name, "ok" if not failures else "FAILED")
+    for failure in failures:
+        print "  %s" % failure
+    return not failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Checks CaptureTable against parse_csv on many distinct strings.")
+    parser.add_argument("-n", "--networks", type=int, default=300,
+        help="number of distinct names (or levels) before the last network")
+    args = parser.parse_args()
+
+    results = [
+        check("names", [("Network %d" % i, "WPA2")
+            for i in xrange(args.networks)] + [("Late", "WEP")]),
+        check("levels", [("Network", "WPA%d" % i)
+            for i in xrange(args.networks)] + [("Late", "WEP")]),
+    ]
+    sys.exit(0 if all(results) else 1)
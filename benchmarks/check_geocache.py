@@ -0,0 +1,183 @@
+#!/usr/bin/python2
+""" Checks the location cache against a local stand-in for the geolocation
+APIs (the one from `bench_geolocate`), without touching the network.
+
+    expiry      found locations are asked for again after the TTL, and
+                missing ones after the negative TTL, but not before
+    eviction    past the size limit, the least recently used entries go
+    counters    hits, misses, evictions and entries add up along the way
+    cli         `networkparser.py --address` and `-f ... -l` answer from
+                the cache on a second run, without asking the APIs
+
+Time is faked wherever expiry and recency matter. Exits non-zero if any
+check fails.
+"""
+import os
+import sys
+import zlib
+import runpy
+import shutil
+import tempfile
+import argparse
+import threading
+import StringIO
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TRACKER = os.path.join(HERE, "..", "tracker")
+sys.path.insert(0, TRACKER)
+
+import synth
+import geocache
+import geolocate
+import networkparser
+
+from bench_geolocate import StandIn, make_networks
+
+
+class Clock(object):
+    """ Stands in for the `time` module in `geocache`. """
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+
+def known(nw):
+    """ Whether the stand-in knows a network, on either API. """
+    key = zlib.crc32(nw.mac.lower()) & 0xFFFF
+    return key % 3 != 0 or key % 2 != 0
+
+def asks(server, fn, *args):
+    """ Returns how many requests the stand-in got while calling fn. """
+    before = server.requests
+    fn(*args)
+    return server.requests - before
+
+def report(name, failures):
+    print "%-10s %s" % (name, "ok" if not failures else "FAILED")
+    for failure in failures:
+        print "  %s" % failure
+    return not failures
+
+def check_expiry(server, clock):
+    networks = make_networks(50)
+    found = [nw for nw in networks if known(nw)][0]
+    missing = [nw for nw in networks if not known(nw)][0]
+    cache = geocache.LocationCache(":memory:", ttl=100, negative_ttl=10)
+
+    failures = []
+    def expect(when, nw, asked):
+        clock.now = 1000000.0 + when
+        requests = asks(server, nw.get_location, False, 0, cache)
+        if bool(requests) != asked:
+            failures.append("at +%ds, %s network was %sasked for" % (when,
+                "a found" if nw is found else "a missing",
+                "" if requests else "not "))
+
+    expect(0, found, True)
+    expect(0, missing, True)
+    expect(0, found, False)
+    expect(0, missing, False)
+    expect(11, found, False)
+    expect(11, missing, True)   # past the negative TTL
+    expect(101, found, True)    # past the TTL
+
+    if missing.location is not None:
+        failures.append("the missing network got a location")
+    expected = { "hits": 3, "misses": 4, "evictions": 0, "entries": 2 }
+    if cache.stats() != expected:
+        failures.append("counters are %s, expected %s" % (cache.stats(), expected))
+    cache.close()
+    return report("expiry", failures)
+
+def check_eviction(clock):
+    cache = geocache.LocationCache(":memory:", max_entries=3)
+    result = { "location": { "lat": 1.0, "lng": 2.0 }, "accuracy": 5.0 }
+
+    failures = []
+    for when, bssid in enumerate(["a", "b", "c"]):
+        clock.now = 1000000.0 + when
+        cache.put(bssid, result)
+    clock.now += 1
+    cache.get("a")              # b is now the least recently used
+    clock.now += 1
+    cache.put("d", result)
+
+    present = dict([(bssid, cache.get(bssid) is not None)
+        for bssid in ["a", "b", "c", "d"]])
+    if present != { "a": True, "b": False, "c": True, "d": True }:
+        failures.append("kept %s after evicting one of a, b, c for d" % (
+            ", ".join(sorted([b for b, kept in present.items() if kept]))))
+
+    expected = { "hits": 4, "misses": 1, "evictions": 1, "entries": 3 }
+    if cache.stats() != expected:
+        failures.append("counters are %s, expected %s" % (cache.stats(), expected))
+    cache.close()
+    return report("eviction", failures)
+
+def run_cli(*argv):
+    """ Runs networkparser.py's command line in this process, returning its
+    output (and so with `geolocate` still pointed at the stand-in). """
+    stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+    argv, sys.argv = sys.argv, ["networkparser.py"] + list(argv)
+    try:
+        runpy.run_path(os.path.join(TRACKER, "networkparser.py"),
+            run_name="__main__")
+    except SystemExit:
+        pass
+    finally:
+        output = sys.stdout.getvalue()
+        sys.stdout, sys.argv = stdout, argv
+    return output
+
+def check_cli(server, directory):
+    db = os.path.join(directory, "locations.db")
+    capture = os.path.join(directory, "capture.csv")
+    with open(capture, "w") as f:
+        synth.write_capture(f, 5, 0)
+    address = make_networks(1)[0].mac
+
+    failures = []
+    for label, args in [("--address", ["--address", address]),
+                        ("-f ... -l", ["-f", capture, "-l"])]:
+        first = asks(server, run_cli, "--cache", db, *args)
+        second = asks(server, run_cli, "--cache", db, *args)
+        if not first:
+            failures.append("%s never asked the stand-in" % label)
+        if second:
+            failures.append("%s asked the stand-in %d times with a warm "
+                "cache" % (label, second))
+
+    if run_cli("--cache", db, "-f", capture, "-l") != \
+            run_cli("--no-cache", "-f", capture, "-l"):
+        failures.append("cached and uncached locations differ")
+    return report("cli", failures)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Checks the location cache against a local stand-in API.")
+    args = parser.parse_args()
+
+    server = StandIn(0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+
+    geolocate.API_KEY = "stand-in"
+    geolocate.API_URL = server.url + "/geolocate?key=%s"
+    geolocate.BKP_URL = server.url + "/backup?bssid=%s"
+
+    clock, real_time = Clock(), geocache.time
+    directory = tempfile.mkdtemp()
+    try:
+        geocache.time = clock
+        results = [check_expiry(server, clock), check_eviction(clock)]
+        geocache.time = real_time
+        results.append(check_cli(server, directory))
+    finally:
+        geocache.time = real_time
+        shutil.rmtree(directory)
+        server.shutdown()
+
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,108 @@
+#!/usr/bin/python2
+""" Checks that the correlator goes back to idling once trackers leave.
+
+A correlator is started for each engine, and many trackers connect to it,
+send a payload and disconnect (some cleanly, some by resetting the
+connection). The server's CPU time is then sampled over a quiet period:
+if closed connections weren't cleaned up, the loop would keep finding them
+readable and spin. Finally, one tracker connects and goes silent, and must
+be disconnected by the idle timeout.
+
+Exits non-zero if any check fails. Linux only (CPU time is read from /proc).
+"""
+import os
+import sys
+import time
+import socket
+import struct
+import argparse
+import subprocess
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")
+sys.path.insert(0, SERVER)
+
+import protocol
+
+
+def cpu_seconds(pid):
+    """ Returns the user and system CPU time a process has used so far. """
+    with open("/proc/%d/stat" % pid) as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / float(os.sysconf("SC_CLK_TCK"))
+
+def connect(port, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return socket.create_connection(("localhost", port))
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+def churn(port, cycles, payload):
+    for i in xrange(cycles):
+        sock = connect(port)
+        sock.sendall(payload)
+        if i % 2:
+            # Reset instead of closing cleanly, so the server sees an error.
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                struct.pack("ii", 1, 0))
+        sock.close()
+
+def check(engine, args, payload):
+    server = subprocess.Popen([sys.executable, "correlator.py", "-q",
+        "-e", engine, "-p", str(args.port), "-H", "0",
+        "--idle-timeout", str(args.idle_timeout)], cwd=SERVER)
+
+    try:
+        connect(args.port).close()
+        churn(args.port, args.cycles, payload)
+        time.sleep(1)   # let the server catch up with the last disconnects
+
+        before = cpu_seconds(server.pid)
+        time.sleep(args.window)
+        usage = (cpu_seconds(server.pid) - before) / args.window
+        idle_ok = usage <= args.max_cpu
+        print "%-7s CPU after %d connect/disconnect cycles: %5.1f%% %s" % (
+            engine, args.cycles, usage * 100, "ok" if idle_ok else "FAILED")
+
+        sock = connect(args.port)
+        sock.settimeout(args.idle_timeout + 5)
+        start = time.time()
+        try:
+            reaped = sock.recv(1) == ""
+        except socket.timeout:
+            reaped = False
+        except socket.error:
+            reaped = True   # reset by the server
+        sock.close()
+        print "%-7s silent tracker disconnected after %.1fs: %s" % (
+            engine, time.time() - start, "ok" if reaped else "FAILED")
+        return idle_ok and reaped
+
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Checks that the correlator idles after tracker churn.")
+    parser.add_argument("-e", "--engine", action="append",
+        help="engine to check (repeatable), defaults to all of them")
+    parser.add_argument("-n", "--cycles", type=int, default=500,
+        help="number of connect/disconnect cycles")
+    parser.add_argument("-w", "--window", type=float, default=3,
+        help="seconds to sample CPU usage over afterwards")
+    parser.add_argument("--max-cpu", type=float, default=0.05,
+        help="highest acceptable idle CPU usage, as a fraction of a core")
+    parser.add_argument("--idle-timeout", type=float, default=2,
+        help="idle timeout to run the server with")
+    parser.add_argument("-p", "--port", type=int, default=0xC1C,
+        help="port for the correlator to listen on")
+    args = parser.parse_args()
+
+    payload = protocol.encode([("00:11:22:33:44:55", ["aa:bb:cc:dd:ee:ff"])])
+    results = [check(engine, args, payload)
+        for engine in args.engine or ["poll", "select"]]
+    sys.exit(0 if all(results) else 1)
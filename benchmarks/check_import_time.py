@@ -0,0 +1,94 @@
+#!/usr/bin/python2
+""" Checks that parsing captures doesn't pay for the geolocation stack.
+
+Each module is imported in a fresh interpreter, from an empty directory (so
+without a `.keys` file), several times over. The check fails if the import
+raises, or pulls in any of the modules that only geolocation needs. The
+median import time is reported, and can optionally be held to a budget.
+
+Python 2 has no `-X importtime`, so the import is timed from inside the
+child interpreter, and `sys.modules` is inspected afterwards instead.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+TRACKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tracker")
+
+# What `geolocate` and `geocache` need, and no parsing-only user should have
+# to load.
+FORBIDDEN = ["requests", "urllib3", "json", "pprint", "geolocate", "geocache",
+    "sqlite3"]
+
+# json is only imported once the module's imports are known, so that it can
+# be caught among them.
+CHILD = """
+import sys, time
+sys.path.insert(0, %r)
+before = set(sys.modules)
+start = time.time()
+import %s
+elapsed = time.time() - start
+loaded = sorted(set(sys.modules) - before)
+import json
+sys.stdout.write(json.dumps({ "elapsed": elapsed, "loaded": loaded }))
+"""
+
+def measure(module, runs, cwd):
+    timings, loaded = [], set()
+    for _ in xrange(runs):
+        child = subprocess.Popen([sys.executable, "-c",
+            CHILD % (os.path.abspath(TRACKER), module)], cwd=cwd,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = child.communicate()
+        if child.returncode:
+            return None, err.strip().splitlines()[-1:]
+
+        result = json.loads(out)
+        timings.append(result["elapsed"])
+        loaded.update(result["loaded"])
+
+    timings.sort()
+    return timings[len(timings) // 2], loaded
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Checks that importing the capture parser stays cheap.")
+    parser.add_argument("-m", "--module", action="append",
+        help="module to check (repeatable), defaults to networkparser and tracker")
+    parser.add_argument("-n", "--runs", type=int, default=5,
+        help="fresh interpreters to import each module in")
+    parser.add_argument("--max-ms", type=float, default=None,
+        help="fail if the median import takes longer than this")
+    args = parser.parse_args()
+
+    cwd = tempfile.mkdtemp()
+    ok = True
+    try:
+        for module in args.module or ["networkparser", "tracker"]:
+            median, loaded = measure(module, args.runs, cwd)
+            if median is None:
+                print "%-14s import FAILED: %s" % (module, " ".join(loaded))
+                ok = False
+                continue
+
+            # Submodules count too, e.g. requests.adapters.
+            heavy = sorted([name for name in loaded
+                if name.split(".")[0] in FORBIDDEN])
+            slow = args.max_ms is not None and median * 1000 > args.max_ms
+            ok = ok and not heavy and not slow
+
+            print "%-14s %7.1fms %4d modules  %s" % (module, median * 1000,
+                len(loaded), "ok" if not heavy and not slow else "FAILED")
+            if heavy:
+                print "  loads %s" % ", ".join(heavy[:10])
+            if slow:
+                print "  over the %.1fms budget" % args.max_ms
+    finally:
+        shutil.rmtree(cwd)
+
+    sys.exit(0 if ok else 1)
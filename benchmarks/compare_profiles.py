@@ -0,0 +1,76 @@
+#!/usr/bin/python2
+""" Compares two `--profile` reports, such as from two builds, stage by stage.
+
+Both the tracker and the correlator append a JSON object per cycle (a scan,
+or an interval of serving) with the wall-clock and CPU time spent in each
+stage. This averages each stage over the cycles of each report, prints them
+side by side, and exits non-zero if any stage got slower than allowed.
+
+Cycles in which nothing was recorded (like a correlator's idle intervals)
+are left out of the averages.
+"""
+import sys
+import json
+import argparse
+
+
+def load(path, skip):
+    """ Returns { stage: (wall, cpu, calls) } averaged per cycle, and the
+    number of cycles that went into it. """
+    with open(path) as f:
+        cycles = [json.loads(line) for line in f if line.strip()]
+    cycles = [cycle for cycle in cycles if cycle["stages"]][skip:]
+
+    totals = {}
+    for cycle in cycles:
+        for name, stage in cycle["stages"].iteritems():
+            total = totals.setdefault(name, [0.0, 0.0, 0])
+            total[0] += stage["wall"]
+            total[1] += stage["cpu"]
+            total[2] += stage["calls"]
+
+    count = float(max(len(cycles), 1))
+    return dict([(name, (wall / count, cpu / count, calls / count))
+        for name, (wall, cpu, calls) in totals.iteritems()]), len(cycles)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Compares per-stage timings between two profiling reports.")
+    parser.add_argument("baseline", help="the report to compare against")
+    parser.add_argument("candidate", help="the report to check")
+    parser.add_argument("-m", "--metric", choices=["wall", "cpu"], default="cpu",
+        help="which time to hold the candidate to")
+    parser.add_argument("-t", "--threshold", type=float, default=1.2,
+        help="fail if a stage takes more than this many times as long")
+    parser.add_argument("--min-seconds", type=float, default=0.001,
+        help="ignore stages faster than this per cycle in both reports")
+    parser.add_argument("--skip", type=int, default=0,
+        help="leave out this many cycles at the start of each report")
+    args = parser.parse_args()
+
+    base, base_cycles = load(args.baseline, args.skip)
+    cand, cand_cycles = load(args.candidate, args.skip)
+    index = 0 if args.metric == "wall" else 1
+
+    print "%d baseline and %d candidate cycles, %s seconds per cycle" % (
+        base_cycles, cand_cycles, args.metric)
+    print "%-16s %12s %12s %9s" % ("stage", "baseline", "candidate", "change")
+
+    slower = []
+    for name in sorted(set(base) | set(cand)):
+        before = base.get(name, (0.0, 0.0, 0))[index]
+        after = cand.get(name, (0.0, 0.0, 0))[index]
+        if max(before, after) < args.min_seconds:
+            continue
+
+        ratio = after / before if before else float("inf")
+        regressed = ratio > args.threshold
+        if regressed:
+            slower.append(name)
+        print "%-16s %12.6f %12.6f %8.2fx%s" % (name, before, after, ratio,
+            "  SLOWER" if regressed else "")
+
+    if slower:
+        print "%d stage(s) over the %.2fx threshold: %s" % (len(slower),
+            args.threshold, ", ".join(slower))
+    sys.exit(1 if slower else 0)
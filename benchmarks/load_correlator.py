@@ -0,0 +1,134 @@
+#!/usr/bin/python2
+""" A local load test of the correlator's multi-process mode.
+
+For each worker count, a correlator is started with `--workers N`, and a
+number of client processes connect to it and send tracker payloads as fast
+as they can. The ingest rate is measured by the server itself: every
+worker's metrics endpoint is scraped until the frames counted across all of
+them add up to the frames sent. The server is stopped with SIGTERM between
+runs, which also exercises the workers' coordinated shutdown.
+
+On a machine with C cores, throughput should scale roughly linearly up to
+`-w C` (provided there are enough clients to keep every worker busy).
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import urllib2
+import argparse
+import subprocess
+import multiprocessing
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")
+sys.path.insert(0, SERVER)
+
+import protocol
+
+
+def client(port, frames, payload, ready, go):
+    """ Connects to the server and sends `frames` copies of a payload. """
+    sock = socket.create_connection(("localhost", port))
+    ready.release()
+    go.wait()
+
+    burst = payload * 64
+    for _ in xrange(frames // 64):
+        sock.sendall(burst)
+    sock.sendall(payload * (frames % 64))
+    sock.close()
+
+def scrape(port):
+    """ Returns the frames counted by the worker serving metrics on a port. """
+    body = urllib2.urlopen("http://localhost:%d/metrics" % port, timeout=5).read()
+    for line in body.splitlines():
+        if line.startswith("correlator_received_frames_total "):
+            return int(line.split()[1])
+    return 0
+
+def wait_for(fn, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return fn()
+        except (socket.error, urllib2.URLError):
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+def run(workers, args, payload):
+    server = subprocess.Popen([sys.executable, "correlator.py", "-q",
+        "-e", args.engine, "-w", str(workers), "-p", str(args.port),
+        "--metrics-port", str(args.metrics_port)], cwd=SERVER)
+
+    metrics_ports = [args.metrics_port + i for i in xrange(workers)]
+    try:
+        for port in metrics_ports:
+            wait_for(lambda: scrape(port))
+
+        ready, go = multiprocessing.Semaphore(0), multiprocessing.Event()
+        per_client = args.frames // args.clients
+        clients = [multiprocessing.Process(target=client,
+            args=(args.port, per_client, payload, ready, go))
+            for _ in xrange(args.clients)]
+        for proc in clients:
+            proc.start()
+        for proc in clients:
+            ready.acquire()
+
+        expected = per_client * args.clients
+        start = time.time()
+        go.set()
+
+        received = 0
+        while received < expected and time.time() - start < args.timeout:
+            time.sleep(0.05)
+            received = sum([scrape(port) for port in metrics_ports])
+        elapsed = time.time() - start
+
+        for proc in clients:
+            proc.join()
+        return received, expected, elapsed
+
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Measures correlator ingest throughput across worker counts.")
+    parser.add_argument("-w", "--workers", default="1,%d" % multiprocessing.cpu_count(),
+        help="comma-separated worker counts to try")
+    parser.add_argument("-c", "--clients", type=int, default=16,
+        help="number of concurrent tracker connections")
+    parser.add_argument("-n", "--frames", type=int, default=200000,
+        help="total number of frames to send per run")
+    parser.add_argument("-m", "--macs", type=int, default=8,
+        help="client MACs per payload")
+    parser.add_argument("-e", "--engine", default="poll",
+        help="server engine to run the workers with")
+    parser.add_argument("-p", "--port", type=int, default=0xC1B,
+        help="port for the correlator to listen on")
+    parser.add_argument("--metrics-port", type=int, default=9400,
+        help="first port of the workers' metrics endpoints")
+    parser.add_argument("-t", "--timeout", type=float, default=120,
+        help="give up on a run after this many seconds")
+    args = parser.parse_args()
+
+    payload = protocol.encode([("00:11:22:33:44:55",
+        ["aa:bb:cc:dd:ee:%02x" % i for i in xrange(args.macs)])], compress=False)
+
+    print "%d CPUs, %d clients, %d frames of %d bytes per run" % (
+        multiprocessing.cpu_count(), args.clients, args.frames, len(payload))
+    print "%-8s %10s %10s %14s %8s" % (
+        "workers", "frames", "time", "frames/s", "scaling")
+
+    baseline = None
+    for workers in [int(w) for w in args.workers.split(",")]:
+        received, expected, elapsed = run(workers, args, payload)
+        rate = received / elapsed
+        baseline = baseline or rate
+        print "%-8d %10d %8.2fs %14.0f %7.2fx%s" % (workers, received, elapsed,
+            rate, rate / baseline,
+            "" if received == expected else "  (timed out, %d sent)" % expected)
@@ -0,0 +1,371 @@
+#!/usr/bin/python2
+""" Simulates a swarm of trackers against a running correlator.
+
+Each simulated tracker connects, identifies itself as a node and sends
+reports at a steady rate, just like `tracker.py` given a node id: a full
+snapshot first (and on every new connection), then deltas, with another
+snapshot every `--snapshot-every` reports. Every report is followed by an
+echo frame (see `protocol.echo`). The server handles each connection's
+frames in order, so the echo comes back once the report has been ingested:
+the time from the report being made to its echo arriving is its latency.
+
+Parts of the swarm can be made to misbehave:
+
+    --churn SEC         trackers reconnect after SEC seconds on average
+    --partial FRACTION  these trackers write their frames a few bytes at a
+                        time, so the server only ever receives fragments
+    --slow FRACTION     these trackers only read their echoes every few
+                        seconds, so replies back up on the server's side
+
+Trackers are spread over `--processes`, each running an event loop over its
+share of them, so that the swarm itself keeps up. The latencies of slow
+readers are left out, since they include the trackers' own delays, and the
+partial writers' are reported apart from the rest.
+
+Example, against `./correlator.py -q -w 2`:
+
+    ./load_swarm.py -n 500 -r 2 -s 4096 --churn 30 --partial 0.1 --slow 0.1
+"""
+import os
+import sys
+import time
+import errno
+import random
+import select
+import socket
+import struct
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "server"))
+
+import protocol
+
+TOKEN = struct.Struct("!I")
+CLIENTS = 4             # clients on each simulated network
+RECV_SIZE = 64 * 1024
+SLOW_RECV_SIZE = 64     # what a slow reader reads at a time
+SEND_SIZE = 64 * 1024
+RETRY = 1               # seconds before reconnecting after a failure
+TICK = 0.05             # longest the event loop sleeps, in seconds
+
+LATENCY_CLASSES = ("normal", "partial")
+
+
+def random_mac(rng):
+    digits = "%012x" % rng.getrandbits(48)
+    return ':'.join([digits[i:i + 2] for i in xrange(0, 12, 2)])
+
+
+class Tracker(object):
+    """ The state of a single simulated tracker.
+    """
+    def __init__(self, index, args, partial, slow):
+        self.node = "swarm-%d" % index
+        self.rng = random.Random(args.seed + index)
+        self.args = args
+        self.partial = partial
+        self.slow = slow
+
+        self.sock = None
+        self.out = bytearray()      # frames not yet written
+        self.received = bytearray() # the start of echoes not yet complete
+        self.pending = {}           # dict -> { token: when its report was made }
+        self.token = 0
+
+        # What the tracker "sees", sized so that a snapshot is about as big
+        # as requested, and what it last reported.
+        networks = max(1, (args.payload - protocol.HEADER.size -
+            protocol.COUNT.size) // (protocol.MAC_SIZE * (CLIENTS + 1) +
+            protocol.COUNT.size))
+        self.report = dict([(random_mac(self.rng), set([random_mac(self.rng)
+            for _ in xrange(CLIENTS)])) for _ in xrange(networks)])
+        self.state = None
+        self.deltas = 0
+
+        now = time.time()
+        self.connect_at = now
+        self.disconnect_at = None
+        self.report_at = now + self.rng.random() / args.rate
+        self.write_at = now
+        self.read_at = now
+
+    @property
+    def latency_class(self):
+        return "partial" if self.partial else "normal"
+
+    def connect(self, stats, now):
+        try:
+            self.sock = socket.create_connection((self.args.host,
+                self.args.port), timeout=5)
+        except socket.error:
+            stats["failed"] += 1
+            self.connect_at = now + RETRY
+            return False
+
+        self.sock.setblocking(0)
+        stats["connects"] += 1
+        self.out = bytearray(protocol.hello(self.node))
+        self.state = None   # resync, as the tracker does on every connection
+        self.report_at = max(self.report_at, now)
+        if self.args.churn:
+            self.disconnect_at = now + self.rng.expovariate(1.0 / self.args.churn)
+        return True
+
+    def disconnect(self, stats, now, retry=0, reason="lost"):
+        """ Closes the connection; reports and echoes in flight are lost. """
+        self.sock.close()
+        self.sock = None
+        self.out = bytearray()
+        self.received = bytearray()
+        stats[reason] += len(self.pending)
+        self.pending.clear()
+        self.connect_at = now + retry
+
+    def make_report(self, stats, now):
+        """ Changes a few of the clients seen, and queues the next report. """
+        for bssid, macs in self.report.iteritems():
+            for mac in list(macs):
+                if self.rng.random() < self.args.change:
+                    macs.discard(mac)
+                    macs.add(random_mac(self.rng))
+
+        if self.state is None or self.deltas + 1 >= self.args.snapshot_every:
+            frame = protocol.encode(self.report.items())
+            self.deltas = 0
+            stats["snapshots"] += 1
+        else:
+            added, removed = protocol.diff(self.state, self.report)
+            frame = protocol.encode_delta(added, removed)
+            self.deltas += 1
+            stats["deltas"] += 1
+        self.state = dict([(bssid, set(macs))
+            for bssid, macs in self.report.iteritems()])
+
+        self.token += 1
+        self.pending[self.token] = now
+        self.out += frame
+        self.out += protocol.echo(TOKEN.pack(self.token))
+        stats["report_bytes"] += len(frame)
+        self.report_at += 1.0 / self.args.rate
+
+    def wants_write(self, now):
+        return self.out and (not self.partial or now >= self.write_at)
+
+    def wants_read(self, now):
+        return not self.slow or now >= self.read_at
+
+    def write(self, stats, now):
+        size = self.args.piece if self.partial else SEND_SIZE
+        try:
+            sent = self.sock.send(self.out[:size])
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            stats["dropped"] += 1
+            self.disconnect(stats, now, RETRY)
+            return
+
+        del self.out[:sent]
+        stats["bytes"] += sent
+        if self.partial:
+            self.write_at = now + self.args.piece_delay
+
+    def read(self, stats, latencies, now):
+        try:
+            data = self.sock.recv(SLOW_RECV_SIZE if self.slow else RECV_SIZE)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ""
+
+        if not data:
+            stats["dropped"] += 1
+            self.disconnect(stats, now, RETRY)
+            return
+        if self.slow:
+            self.read_at = now + self.args.slow_read
+
+        self.received += data
+        while True:
+            size = protocol.frame_size(self.received)
+            if size is None or len(self.received) < size:
+                break
+            frame = bytes(self.received[:size])
+            del self.received[:size]
+
+            token = TOKEN.unpack(protocol.decode_echo(frame))[0]
+            made = self.pending.pop(token, None)
+            if made is None:
+                continue
+            stats["echoes"] += 1
+            if not self.slow:
+                latencies[self.latency_class].append(now - made)
+
+    def next_event(self, generating):
+        """ Returns when this tracker next has something to do by itself. """
+        if self.sock is None:
+            return self.connect_at if generating else float("inf")
+
+        events = [float("inf")]
+        if generating:
+            events.extend([self.disconnect_at or float("inf"), self.report_at])
+        if self.partial and self.out:
+            events.append(self.write_at)
+        if self.slow:
+            events.append(self.read_at)
+        return min(events)
+
+
+def swarm(indices, args, results):
+    """ Runs some of the swarm's trackers, for a single process. """
+    rng = random.Random(args.seed - 1 - indices[0])
+    trackers = []
+    for index in indices:
+        kind = rng.random()
+        trackers.append(Tracker(index, args, partial=kind < args.partial,
+            slow=args.partial <= kind < args.partial + args.slow))
+
+    stats = dict.fromkeys(["connects", "failed", "dropped", "snapshots",
+        "deltas", "report_bytes", "bytes", "echoes", "lost", "unanswered"], 0)
+    latencies = dict([(name, []) for name in LATENCY_CLASSES])
+
+    started = time.time()
+    stop_at = started + args.duration
+    drain_until = stop_at + args.drain
+
+    while True:
+        now = time.time()
+        generating = now < stop_at
+        if not generating and (now >= drain_until or not any([t.pending or
+                t.out for t in trackers if t.sock is not None])):
+            break
+
+        for t in trackers:
+            if t.sock is None:
+                if generating and now >= t.connect_at:
+                    t.connect(stats, now)
+                continue
+            if generating and t.disconnect_at is not None and \
+                    now >= t.disconnect_at:
+                t.disconnect(stats, now)
+                continue
+            while generating and now >= t.report_at:
+                t.make_report(stats, now)
+
+        connected = [t for t in trackers if t.sock is not None]
+        readers = dict([(t.sock, t) for t in connected if t.wants_read(now)])
+        writers = dict([(t.sock, t) for t in connected if t.wants_write(now)])
+        timeout = min([t.next_event(generating) for t in trackers] +
+            [now + TICK]) - now
+        readable, writable, _ = select.select(readers.keys(),
+            writers.keys(), [], max(0, timeout))
+
+        now = time.time()
+        for sock in writable:
+            if writers[sock].sock is sock:
+                writers[sock].write(stats, now)
+        for sock in readable:
+            if readers[sock].sock is sock:
+                readers[sock].read(stats, latencies, now)
+
+    for t in trackers:
+        if t.sock is not None:
+            t.disconnect(stats, time.time(), reason="unanswered")
+
+    stats["elapsed"] = min(time.time(), stop_at) - started
+    results.put((stats, latencies))
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def print_latencies(name, latencies):
+    if not latencies:
+        return
+    ordered = sorted(latencies)
+    print "%-8s %8d %9.2f %9.2f %9.2f %9.2f %9.2f" % (name, len(ordered),
+        percentile(ordered, 0.5) * 1000, percentile(ordered, 0.9) * 1000,
+        percentile(ordered, 0.99) * 1000, percentile(ordered, 0.999) * 1000,
+        ordered[-1] * 1000)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Simulates many trackers sending reports to a running correlator.")
+    parser.add_argument("-a", "--host", default="localhost",
+        help="the correlator's address")
+    parser.add_argument("-p", "--port", type=int, default=0xC1A,
+        help="the correlator's port")
+    parser.add_argument("-n", "--trackers", type=int, default=100,
+        help="number of trackers to simulate")
+    parser.add_argument("-j", "--processes", type=int,
+        default=multiprocessing.cpu_count(),
+        help="processes to spread the trackers over")
+    parser.add_argument("-d", "--duration", type=float, default=30,
+        help="seconds to send reports for")
+    parser.add_argument("-r", "--rate", type=float, default=1,
+        help="reports per second from each tracker")
+    parser.add_argument("-s", "--payload", type=int, default=1024,
+        help="size of a snapshot report in bytes (deltas are smaller)")
+    parser.add_argument("--change", type=float, default=0.1,
+        help="fraction of clients that change between reports")
+    parser.add_argument("--snapshot-every", type=int, default=30,
+        help="every how many reports to send a full snapshot")
+    parser.add_argument("--churn", metavar="SEC", type=float, default=0,
+        help="reconnect after this many seconds on average, 0 to never")
+    parser.add_argument("--partial", metavar="FRACTION", type=float, default=0,
+        help="fraction of trackers that write their frames in small pieces")
+    parser.add_argument("--piece", metavar="BYTES", type=int, default=7,
+        help="bytes per write of a partial writer")
+    parser.add_argument("--piece-delay", metavar="SEC", type=float,
+        default=0.001, help="delay between a partial writer's writes")
+    parser.add_argument("--slow", metavar="FRACTION", type=float, default=0,
+        help="fraction of trackers that are slow to read their echoes")
+    parser.add_argument("--slow-read", metavar="SEC", type=float, default=5,
+        help="delay between a slow reader's reads")
+    parser.add_argument("--drain", metavar="SEC", type=float, default=5,
+        help="how long to wait for outstanding echoes at the end")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    processes = max(1, min(args.processes, args.trackers))
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=swarm, args=(
+        range(i, args.trackers, processes), args, results))
+        for i in xrange(processes)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        gathered = [results.get() for _ in workers]
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        sys.exit(1)
+    for worker in workers:
+        worker.join()
+
+    stats = dict([(key, sum([s[key] for s, _ in gathered]))
+        for key in gathered[0][0]])
+    elapsed = max([s["elapsed"] for s, _ in gathered])
+    reports = stats["snapshots"] + stats["deltas"]
+
+    print "%d trackers over %d processes for %.1fs, at %.1f reports/s each" % (
+        args.trackers, processes, elapsed, args.rate)
+    print "Connections:  %d made, %d failed, %d dropped by the server" % (
+        stats["connects"], stats["failed"], stats["dropped"])
+    print "Sent:         %d reports (%d snapshots), %.2f MiB of reports, " \
+        "%.2f MiB in all" % (reports, stats["snapshots"],
+        stats["report_bytes"] / 1048576.0, stats["bytes"] / 1048576.0)
+    print "Throughput:   %.1f reports/s sent, %.1f ingested, %.3f MiB/s" % (
+        reports / elapsed, stats["echoes"] / elapsed,
+        stats["bytes"] / 1048576.0 / elapsed)
+    print "Unanswered:   %d echoes lost to disconnects, %d never came back" % (
+        stats["lost"], stats["unanswered"])
+
+    print
+    print "%-8s %8s %9s %9s %9s %9s %9s" % ("latency", "reports", "p50 ms",
+        "p90 ms", "p99 ms", "p99.9 ms", "max ms")
+    for name in LATENCY_CLASSES:
+        print_latencies(name, sum([l[name] for _, l in gathered], []))
@@ -0,0 +1,74 @@
+#!/usr/bin/python2
+""" A soak test for long-running trackers: parses the same capture over and
+over, as `tracker.py -n 0` would, and checks that memory stays flat.
+
+Each cycle parses and filters the capture like `tracker.scan` does, then
+releases it. The resident set size and the number of live objects are sampled
+after every cycle; if either keeps growing past the warmup, the test fails.
+"""
+import os
+import gc
+import sys
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "tracker"))
+
+import synth
+import networkparser
+
+
+def rss():
+    """ Returns the current resident set size in KiB. """
+    with open("/proc/self/statm") as statm:
+        pages = int(statm.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+def cycle(filename):
+    with open(filename, "r") as csvf:
+        with networkparser.parse_csv(csvf) as (networks, clients):
+            networks = networkparser.filter_open_networks(networks)
+            networks = networkparser.filter_duplicate_names(networks)
+            return len(networks), len(clients)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Checks that repeatedly parsing captures doesn't grow memory.")
+    parser.add_argument("-n", "--cycles", type=int, default=200,
+        help="number of parse cycles to run")
+    parser.add_argument("-s", "--size", type=int, default=2000,
+        help="number of network rows in the capture (clients are 5x)")
+    parser.add_argument("-w", "--warmup", type=int, default=10,
+        help="cycles to run before taking the baseline measurement")
+    parser.add_argument("--tolerance", type=int, default=1024,
+        help="allowed RSS growth after warmup, in KiB")
+    args = parser.parse_args()
+
+    fd, filename = tempfile.mkstemp(suffix=".csv")
+    try:
+        with os.fdopen(fd, "w") as f:
+            synth.write_capture(f, args.size, args.size * 5)
+
+        baseline = None
+        for i in xrange(args.cycles):
+            cycle(filename)
+            if i + 1 == args.warmup:
+                gc.collect()
+                baseline = (rss(), len(gc.get_objects()))
+
+            if (i + 1) % max(1, args.cycles // 10) == 0:
+                print "cycle %5d: rss=%dKiB objects=%d" % (i + 1, rss(),
+                    len(gc.get_objects()))
+
+        gc.collect()
+        growth = (rss() - baseline[0], len(gc.get_objects()) - baseline[1])
+        print "growth after warmup: rss=%+dKiB objects=%+d" % growth
+
+        if growth[0] > args.tolerance or growth[1] > 0:
+            print "FAIL: memory grew across parse cycles."
+            sys.exit(1)
+        print "OK: memory is flat."
+
+    finally:
+        os.remove(filename)
@@ -0,0 +1,99 @@
+#!/usr/bin/python2
+""" Generates synthetic airodump-ng CSV captures for benchmarks.
+
+Captures have the same layout as airodump-ng's: a blank line, the network
+section (header and rows), a blank line, then the station section. The mix of
+networks can be tuned: how many are open, how many share a name, and how many
+hide their name. Generation is seeded, so a given set of options always makes
+the same capture.
+
+As a script, this writes a capture to a file (or stdout):
+
+    ./synth.py -n 500000 -c 500000 --open-ratio 0.1 --hidden-ratio 0.05 \\
+        -o captures/huge.csv
+"""
+import sys
+import random
+import argparse
+
+NETWORK_COLUMNS = ("BSSID, First time seen, Last time seen, channel, Speed, "
+    "Privacy, Cipher, Authentication, Power, # beacons, # IV, LAN IP, "
+    "ID-length, ESSID, Key")
+CLIENT_COLUMNS = ("Station MAC, First time seen, Last time seen, Power, "
+    "# packets, BSSID, Probed ESSIDs")
+
+SEEN = "2020-01-01 12:00:00, 2020-01-01 12:05:00"
+
+# Privacy -> what airodump-ng lists as the cipher and authentication.
+CIPHERS = { "OPN": ", ", "WPA2": "CCMP, PSK" }
+
+
+def random_mac(rng):
+    return ':'.join(["%02X" % rng.randint(0, 255) for _ in xrange(6)])
+
+def write_capture(f, networks, clients, open_ratio=0.25, seed=0, names=None,
+                  hidden_ratio=0.0, associated_ratio=0.7):
+    """ Writes a capture with the given number of network and client rows.
+
+    :f                          a file-like object to write to
+    :networks                   the number of network rows
+    :clients                    the number of client rows
+    :open_ratio[=0.25]          the fraction of networks without security
+    :seed[=0]                   seeds the generator, for reproducible captures
+    :names[=networks/4]         how many distinct ESSIDs the networks share;
+                                the fewer, the more duplicates
+    :hidden_ratio[=0]           the fraction of networks with a hidden SSID
+    :associated_ratio[=0.7]     the fraction of clients on a network
+    """
+    rng = random.Random(seed)
+    bssids = []
+    names = max(1, networks // 4) if names is None else max(0, names - 1)
+
+    f.write("\r\n%s\r\n" % NETWORK_COLUMNS)
+    for i in xrange(networks):
+        bssid = random_mac(rng)
+        bssids.append(bssid)
+
+        privacy = "OPN" if rng.random() < open_ratio else "WPA2"
+        name = "Network %d" % rng.randint(0, names)
+        if hidden_ratio and rng.random() < hidden_ratio:
+            name = ""
+        f.write("%s, %s, %2d, 54, %s, %s, %d, 10, 0, 0.  0.  0.  0, %d, %s, \r\n" % (
+            bssid, SEEN, rng.randint(1, 11), privacy, CIPHERS[privacy],
+            -rng.randint(20, 95), len(name), name))
+
+    f.write("\r\n%s\r\n" % CLIENT_COLUMNS)
+    for i in xrange(clients):
+        bssid = rng.choice(bssids) if bssids and rng.random() < associated_ratio \
+            else "(not associated)"
+        f.write("%s, %s, %d, 10, %s, \r\n" % (random_mac(rng), SEEN,
+            -rng.randint(20, 95), bssid))
+    f.write("\r\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Writes a synthetic airodump-ng capture.")
+    parser.add_argument("-n", "--networks", type=int, default=1000,
+        help="number of network rows")
+    parser.add_argument("-c", "--clients", type=int, default=1000,
+        help="number of client rows")
+    parser.add_argument("--open-ratio", type=float, default=0.25,
+        help="fraction of networks without security")
+    parser.add_argument("--names", type=int, default=None,
+        help="number of distinct ESSIDs, a quarter of the networks by default")
+    parser.add_argument("--hidden-ratio", type=float, default=0.0,
+        help="fraction of networks with a hidden SSID")
+    parser.add_argument("--associated-ratio", type=float, default=0.7,
+        help="fraction of clients associated with a network")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", metavar="FILE",
+        help="where to write the capture, stdout by default")
+    args = parser.parse_args()
+
+    out = open(args.output, "wb") if args.output else sys.stdout
+    try:
+        write_capture(out, args.networks, args.clients, args.open_ratio,
+            args.seed, args.names, args.hidden_ratio, args.associated_ratio)
+    finally:
+        if args.output:
+            out.close()
@@ -1,59 +1,201 @@
 #!/usr/bin/python2
 
-import os
-import sys
 import time
+import errno
+import signal
 import socket
 import select
 import argparse
 import threading
+import collections
+import multiprocessing
 
-VERBOSITY = 0
+import log
+import metrics
+import protocol
+import profiling
 
-def writeln(v, *args):
-    args = list(args) + [ "\n" ]
-    write(v, *args)
+from log import write, writeln, lazy
 
-def write(v, *args):
-    if VERBOSITY >= v:
-        sys.stdout.write(' '.join(args))
-        sys.stdout.flush()
+
+class FrameTooLarge(ValueError):
+    """ Raised when a peer exceeds the maximum frame size of a `ReadQueue`.
+    """
 
 
 class ReadQueue(object):
-    """ A queue that combines incoming packets until a complete one is found.
+    """ A queue that combines incoming packets until complete ones are found.
 
-    This is done by continually adding the result of a `socket.read` call until
-    the special byte sequence indicating the end of a packet (protocol-specific)
-    is found. This is then added to a queue to be processed, _if_ the
-    packet can be properly parsed.
+    This is done by continually adding the result of a `socket.read` call to a
+    single buffer and splitting complete packets off of its front: version 2
+    packets by their length prefix, and version 1 packets by scanning for the
+    special byte sequence indicating their end (see `protocol`). Only bytes
+    that arrived since the last scan are searched, and _every_ complete packet
+    in the buffer is moved to the queue in one go, so a burst of back-to-back
+    packets is split in a single linear pass rather than one packet per read.
     """
-    EOB = '\x00'
+    EOB = protocol.EOB
+    MAX_FRAME = 64 * 1024   # largest packet we're willing to buffer, in bytes
 
-    def __init__(self):
-        self.queue = []
-        self.pending = ""
+    def __init__(self, max_frame=MAX_FRAME):
+        self.queue = collections.deque()
+        self.queued = 0     # bytes in the complete packets of the queue
+        self.buffer = bytearray()
+        self.scanned = 0    # prefix of the buffer known not to contain an EOB
+        self.max_frame = max_frame
+
+        # After an oversized packet, how much of what follows is still a part
+        # of it: a number of bytes for version 2, up to the next EOB for 1.
+        self.discard = 0
+        self.resync = False
+
+        self.last_seen = time.time()    # when the peer last sent anything
 
     def read(self, data):
         """ Processes some data into the queue.
+
+        :data       the bytes returned by a `socket.recv` call
+        :returns    the number of complete packets this data made available
+
+        :raises     FrameTooLarge if a packet is larger than the maximum frame
+                    size; the oversized packet is discarded, but any complete
+                    packets around it are still queued.
         """
-        writeln(2, "Received data:", repr(data))
-        self.pending += data
-        index = self.pending.find(self.EOB)
-        if index == -1: return
+        if log.enabled(2):
+            writeln(2, "Received data:", lazy(repr, data))
+        self.last_seen = time.time()
+        buf = self.buffer
+
+        # Small reads mostly land in the middle of a packet; when this one
+        # can't complete one, there's nothing to scan for.
+        if data and not self.discard and not self.resync:
+            size = len(buf) + len(data)
+            if (buf[0] if buf else ord(data[0])) == protocol.VERSION_BINARY:
+                length = protocol.frame_size(buf)
+                if length is not None and size < length <= self.max_frame:
+                    buf.extend(data)
+                    return 0
+            elif size <= self.max_frame and data.find(self.EOB) == -1:
+                buf.extend(data)
+                self.scanned = max(0, size - len(self.EOB) + 1)
+                return 0
+
+        data = self._skip(data)
+        buf.extend(data)
+
+        spans, oversized = [], 0
+        start, size = 0, len(buf)
+        while start < size:
+            if buf[start] == protocol.VERSION_BINARY:
+                length = protocol.frame_size(buf, start)
+                if length is None:
+                    break
+
+                end = start + length
+                if length > self.max_frame:
+                    oversized += 1
+                    self.discard = max(0, end - size)
+                    start = min(end, size)
+                    continue
+
+                if end > size:
+                    break
+                spans.append((start, end))
+                start = end
+
+            else:
+                index = buf.find(self.EOB, max(start, self.scanned))
+                if index == -1:
+                    break
 
-        writeln(1, "Received full message:", repr(data))
-        self.queue.append(self.pending[:index])
-        self.pending = self.pending[index + len(ReadQueue.EOB):]
+                if index - start > self.max_frame:
+                    oversized += 1
+                else:
+                    spans.append((start, index))
+                start = index + len(self.EOB)
+
+        if len(spans) == 1:
+            packet = str(buf[spans[0][0]:spans[0][1]])
+            self.queue.append(packet)
+            self.queued += len(packet)
+        elif spans:
+            view = memoryview(buf)
+            for begin, end in spans:
+                packet = view[begin:end].tobytes()
+                self.queue.append(packet)
+                self.queued += len(packet)
+            del view    # the buffer can't be resized while a view is exported
+        if spans and log.enabled(1):
+            for packet in list(self.queue)[-len(spans):]:
+                writeln(1, "Received full message:", lazy(repr, packet))
+
+        # Trim everything that was consumed in a single move, then remember
+        # how far we've looked so the next read only scans the new bytes.
+        if start: del buf[:start]
+        self.scanned = 0
+        if buf and buf[0] != protocol.VERSION_BINARY:
+            self.scanned = max(0, len(buf) - len(self.EOB) + 1)
+
+            if len(buf) > self.max_frame:
+                oversized += 1
+                self.resync = True
+                del buf[:]
+                self.scanned = 0
+
+        if oversized:
+            raise FrameTooLarge("discarded %d packet(s) over %d bytes" % (
+                oversized, self.max_frame))
+        return len(spans)
+
+    def _skip(self, data):
+        """ Drops the remainder of an oversized packet from incoming data. """
+        if self.discard:
+            skipped = min(self.discard, len(data))
+            self.discard -= skipped
+            data = data[skipped:]
+
+        elif self.resync:
+            index = data.find(self.EOB)
+            if index == -1:
+                return ""
+            self.resync = False
+            data = data[index + len(self.EOB):]
+
+        return data
 
     @property
     def ready(self):
         """ Returns whether or not the queue is ready to be processed. """
         return bool(self.queue)
 
+    @property
+    def pending(self):
+        """ Returns the number of bytes buffered towards an incomplete packet. """
+        return len(self.buffer)
+
+    @property
+    def size(self):
+        """ Returns the number of bytes held, in complete packets or not. """
+        return self.queued + len(self.buffer)
+
+    def peek(self):
+        """ Returns the oldest packet in the queue without removing it. """
+        return self.queue[0]
+
     def pop(self):
         """ Removes the oldest packet from the queue. """
-        return self.queue.pop(0)
+        packet = self.queue.popleft()
+        self.queued -= len(packet)
+        return packet
+
+    def drain(self):
+        """ Removes every queued packet, returning them oldest-first. """
+        if not self.queue:
+            return []
+        packets = list(self.queue)
+        self.queue.clear()
+        self.queued = 0
+        return packets
 
 
 class InfiniteThread(threading.Thread):
@@ -66,6 +208,9 @@ class InfiniteThread(threading.Thread):
         self.setDaemon(True)
 
     def run(self):
+        profiling.call(self._run)
+
+    def _run(self):
         while self.running:
             self._loop_method()
             if self.sleep:
@@ -98,58 +243,631 @@ class ListenerThread(InfiniteThread):
         slist = [self.listener]
         rd, _, er = select.select(slist, [], slist, self.TIMEOUT)
         if rd:
-            client, addr = self.listener.accept()
-            writeln(0, "Established connection to tracker on %s:%d" % (addr[0], addr[1]))
-            self._on_accept(addr, client)
+            # Take every pending connection, rather than one per pause.
+            while rd:
+                with profiling.stage("accept"):
+                    client, addr = self.listener.accept()
+                    writeln(0, "Established connection to tracker on %s:%d" % (addr[0], addr[1]))
+                    self._on_accept(addr, client)
+                rd, _, _ = select.select(slist, [], [], 0)
 
         elif er:
             writeln(0, "An error occurred on the listener socket.")
             self.stop_running()
 
 
-class CorrelationServer(InfiniteThread):
+class Poller(object):
+    """ A level-triggered readiness poller over `epoll`, falling back to `poll`.
+
+    The two interfaces differ only in their flag names and timeout units, so
+    this hides both and reports events as (fileno, readable, writable,
+    errored) tuples.
     """
+    def __init__(self):
+        if hasattr(select, "epoll"):
+            self._poller = select.epoll()
+            self._read = select.EPOLLIN
+            self._write = select.EPOLLOUT
+            self._error = select.EPOLLERR | select.EPOLLHUP
+            self._scale = 1         # epoll takes seconds
+        else:
+            self._poller = select.poll()
+            self._read = select.POLLIN
+            self._write = select.POLLOUT
+            self._error = select.POLLERR | select.POLLHUP | select.POLLNVAL
+            self._scale = 1000      # poll takes milliseconds
+
+    def register(self, fd, readable=True, writable=False):
+        self._poller.register(fd, self._events(readable, writable))
+
+    def modify(self, fd, readable=True, writable=False):
+        self._poller.modify(fd, self._events(readable, writable))
+
+    def unregister(self, fd):
+        self._poller.unregister(fd)
+
+    def poll(self, timeout):
+        return [(fd, bool(ev & self._read), bool(ev & self._write),
+            bool(ev & self._error))
+            for fd, ev in self._poller.poll(timeout * self._scale)]
+
+    def _events(self, readable, writable):
+        return (self._read if readable else 0) | \
+            (self._write if writable else 0) | self._error
+
+    def close(self):
+        if hasattr(self._poller, "close"):
+            self._poller.close()
+
+
+class HandlerPool(object):
+    """ Hands messages from the I/O loop over to a pool of handler threads.
+
+    Each thread has its own bounded queue, and every message from a given
+    tracker goes to the same thread, so a tracker's messages are still
+    handled in the order they arrived. Threads take everything queued (up to
+    `BATCH` messages) in one go and pass it to the handler as a list of
+    (tracker, message) pairs.
+
+    When a thread's queue is full, `offer` refuses the message rather than
+    blocking, leaving it to the I/O loop to stop reading from that tracker.
+
+    A tracker's connection closing goes through the same queue, as a None
+    message (see `close`), so whatever it sent before is handled first.
     """
-    def __init__(self, addr, port):
-        super(CorrelationServer, self).__init__(name="ListenerThread",
-            pause_length=0.2)
+    DEPTH = 1024        # messages each thread may have queued
+    BATCH = 64          # most messages handed to the handler at once
+
+    def __init__(self, handler, threads, depth=DEPTH, batch=BATCH):
+        """ Creates the handler threads; call `start` to run them.
+
+        :handler        called with each batch, a list of (tracker, message),
+                        where a None message means the tracker is gone
+        :threads        the number of handler threads
+        :depth[=1024]   the most messages queued per thread
+        :batch[=64]     the most messages per batch
+        """
+        self.handler = handler
+        self.depth = depth
+        self.batch = batch
+        self.running = True
+
+        self.queues = [collections.deque() for _ in xrange(threads)]
+        self.ready = [threading.Condition() for _ in xrange(threads)]
+        self.threads = [threading.Thread(name="HandlerThread-%d" % i,
+            target=profiling.call, args=(self._work, i)) for i in xrange(threads)]
+        for thread in self.threads:
+            thread.setDaemon(True)
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """ Stops the threads once they've handled what's already queued. """
+        self.running = False
+        for ready in self.ready:
+            with ready:
+                ready.notify()
+        for thread in self.threads:
+            thread.join()
+
+    def offer(self, tracker, message):
+        """ Queues a message for handling.
+
+        :returns    False if the tracker's thread is already full, in which
+                    case the message was _not_ queued
+        """
+        index = hash(tracker) % len(self.queues)
+        queue, ready = self.queues[index], self.ready[index]
+        if len(queue) >= self.depth:
+            return False
+
+        with ready:
+            queue.append((tracker, message))
+            ready.notify()
+        return True
+
+    def close(self, tracker):
+        """ Queues the end of a tracker's connection, behind its messages.
+        Unlike `offer`, this never refuses, however full the queue is.
+        """
+        index = hash(tracker) % len(self.queues)
+        with self.ready[index]:
+            self.queues[index].append((tracker, None))
+            self.ready[index].notify()
+
+    @property
+    def queued(self):
+        """ Returns the number of messages waiting across all threads. """
+        return sum([len(queue) for queue in self.queues])
+
+    def _work(self, index):
+        queue, ready = self.queues[index], self.ready[index]
+        while True:
+            with ready:
+                while not queue and self.running:
+                    ready.wait()
+                if not queue:
+                    return
+
+                batch = [queue.popleft()
+                    for _ in xrange(min(self.batch, len(queue)))]
+
+            self.handler(batch)
+
+
+class ServerMetrics(metrics.Registry):
+    """ Everything a `CorrelationServer` counts about its trackers.
+    """
+    def __init__(self, server):
+        super(ServerMetrics, self).__init__("correlator")
+
+        self.accepts = self.counter("accepts_total",
+            "Tracker connections accepted.")
+        self.disconnects = self.counter("disconnects_total",
+            "Tracker connections closed.")
+        self.rejects = self.counter("rejects_total",
+            "Tracker connections refused for exceeding the connection limit.")
+        self.timeouts = self.counter("idle_timeouts_total",
+            "Tracker connections closed for sending nothing for too long.")
+        self.overflows = self.counter("buffer_overflows_total",
+            "Tracker connections closed for exceeding the buffer limit.")
+        self.bytes = self.counter("received_bytes_total",
+            "Bytes received from trackers.")
+        self.frames = self.counter("received_frames_total",
+            "Complete frames received from trackers.")
+        self.oversized = self.counter("oversized_frames_total",
+            "Frames discarded for exceeding the maximum frame size.")
+        self.parse_errors = self.counter("parse_errors_total",
+            "Frames that couldn't be decoded.")
+        self.snapshots = self.counter("snapshots_total",
+            "Full reports received from identified trackers.")
+        self.deltas = self.counter("deltas_total",
+            "Delta reports received from identified trackers.")
+        self.handle_time = self.histogram("handle_seconds",
+            "Time spent handling a single frame.")
+        self.throttles = self.counter("throttles_total",
+            "Times a tracker stopped being read because handlers fell behind.")
+        self.throttled_time = self.counter("throttled_seconds_total",
+            "Time trackers have spent not being read, summed over trackers.")
+        self.echoes = self.counter("echoes_total",
+            "Echo frames sent back to trackers.")
+        self.dropped_echoes = self.counter("dropped_echoes_total",
+            "Echo frames not sent back, because the tracker wasn't reading.")
+
+        # Handler threads share the metrics they update, unlike the I/O loop.
+        self.lock = threading.Lock()
+
+        # These are computed from the server's trackers whenever they're read.
+        self.gauge("connections", "Trackers currently connected.",
+            lambda: len(server.trackers))
+        self.gauge("pending_bytes", "Bytes buffered towards incomplete frames.",
+            lambda: sum([q.pending for q in server.trackers.values()]))
+        self.gauge("pending_bytes_max",
+            "Most bytes buffered towards a single tracker's incomplete frame.",
+            lambda: max([q.pending for q in server.trackers.values()] or [0]))
+        self.gauge("nodes", "Tracker nodes whose state is known.",
+            lambda: len(server.nodes))
+        self.gauge("handoff_depth",
+            "Messages waiting for a handler thread.",
+            lambda: server.pool.queued if server.pool else 0)
+        self.gauge("throttled_trackers",
+            "Trackers not being read because handlers fell behind.",
+            lambda: len(server.throttled))
+        self.gauge("idle_seconds_max",
+            "Longest time since any connected tracker last sent data.",
+            lambda: time.time() - min([q.last_seen
+                for q in server.trackers.values()] or [time.time()]))
+
+
+class CorrelationServer(InfiniteThread):
+    """ Collects the payloads of connected trackers with `select`.
+
+    New trackers are handed over by a separate `ListenerThread`, see
+    `_on_new_tracker`.
+
+    Complete messages are either handled inline, or handed over to a
+    `HandlerPool`. In the latter case, a tracker whose handler thread falls
+    behind is throttled: it isn't read from again until its backlog has been
+    handed over, so the kernel's buffers (and eventually TCP flow control)
+    hold the rest rather than our memory.
+
+    Echo frames (see `protocol.echo`) are sent back as they're handled, but
+    never at the cost of blocking: if a tracker isn't reading its replies,
+    and they no longer fit in its socket's send buffer, they're dropped.
+    What's left of a partly sent one goes out once the socket has room.
+
+    Trackers are disconnected when their connection closes or fails, when
+    they've sent nothing for `idle_timeout` seconds, or when they hold more
+    than `max_buffer` bytes. Beyond `max_connections` trackers, new ones are
+    disconnected as soon as they're accepted.
+    """
+    BACKLOG = socket.SOMAXCONN
+    THROTTLE_TIMEOUT = 0.01     # how long to wait for events while throttling
+    REAP_INTERVAL = 1           # how often to look for idle trackers, in seconds
+    RECV_SIZE = 64 * 1024       # bytes to read from a ready tracker at once
+
+    IDLE_TIMEOUT = 120
+    MAX_BUFFER = 1024 * 1024
+    MAX_CONNECTIONS = 1024
+
+    def __init__(self, addr, port, pause_length=0.2, reuse_port=False,
+                 handlers=0, handoff_depth=HandlerPool.DEPTH,
+                 idle_timeout=IDLE_TIMEOUT, max_buffer=MAX_BUFFER,
+                 max_connections=MAX_CONNECTIONS):
+        """ Creates a server; call `init` to bind it and `start` to run it.
+
+        :addr, port         where to listen for trackers
+        :pause_length[=0.2] seconds to sleep between passes of the loop
+        :reuse_port[=False] whether to set SO_REUSEPORT, letting several
+                            processes listen on the same port, with the
+                            kernel spreading new connections between them
+        :handlers[=0]       the number of threads handling messages, or 0 to
+                            handle them inline, in the I/O loop
+        :handoff_depth[=1024]
+                            the most messages queued for each handler thread
+        :idle_timeout[=120] seconds a tracker may send nothing (not even a
+                            keepalive) before it's disconnected, or 0 to
+                            wait forever
+        :max_buffer[=1MiB]  the most bytes buffered for a single tracker
+        :max_connections[=1024]
+                            the most trackers connected at once
+        """
+        super(CorrelationServer, self).__init__(name="CorrelationServer",
+            pause_length=pause_length)
 
         self.listener = (addr, port)
+        self.reuse_port = reuse_port
         self.trackers = {}  # dict -> { socket: ReadQueue }
 
+        # What each tracker node (see `protocol.hello`) last reported, which
+        # outlives its connections, and which node is on each connection.
+        self.nodes = {}         # dict -> { node id: { bssid: set(MACs) } }
+        self.identities = {}    # dict -> { socket: node id }
+        self.nodes_lock = threading.Lock()
+        self.throttled = {} # dict -> { socket: when it was throttled }
+        self.unsent = {}    # dict -> { socket: the rest of a partly sent reply }
+        self.unsent_lock = threading.Lock()
+        self.metrics = ServerMetrics(self)
+
+        self.idle_timeout = idle_timeout
+        self.max_buffer = max_buffer
+        self.max_connections = max_connections
+        self.last_reap = time.time()
+
+        self.pool = None
+        if handlers:
+            self.pool = HandlerPool(self._handle_batch, handlers, handoff_depth)
+
     def init(self):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.bind((args.address, args.port))
-        self.sock.listen(10)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            if not hasattr(socket, "SO_REUSEPORT"):
+                raise socket.error("SO_REUSEPORT isn't supported on this platform")
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind(self.listener)
+        self.sock.listen(self.BACKLOG)
+
+        if self.pool:
+            self.pool.start()
 
     def stop_running(self):
         self.sock.close()
         super(CorrelationServer, self).stop_running()
 
+    def run(self):
+        try:
+            super(CorrelationServer, self).run()
+        finally:
+            if self.pool:
+                self.pool.stop()
+            for sock in self.trackers.keys():
+                sock.close()
+
     def _loop_method(self):
-        slist = self.trackers
-        readers, _, errors = select.select(slist, [], slist, 1)
+        self._reap()
+        self._resume()
+
+        # The listener thread adds trackers as we go, so work on a copy.
+        slist = [sock for sock in self.trackers.keys()
+            if sock not in self.throttled]
+        wlist = [sock for sock in self.unsent.keys() if sock in self.trackers]
+        timeout = self.THROTTLE_TIMEOUT if self.throttled else 1
+        with profiling.stage("poll"):
+            readers, writers, errors = select.select(slist, wlist, slist,
+                timeout)
+
+        for sock in errors:
+            self._drop(sock, "failed")
+
+        for sock in writers:
+            if sock in self.trackers:
+                self._send_unsent(sock)
+
         for sock in readers:
-            data = sock.recv(64)
+            if sock not in self.trackers:
+                continue
+            with profiling.stage("read"):
+                try:
+                    data = sock.recv(self.RECV_SIZE)
+                except socket.error, e:
+                    self._drop(sock, "failed")
+                    continue
+
+                if not data:
+                    self._drop(sock, "disconnected")
+                else:
+                    self._receive(sock, data)
+
+    def _receive(self, sock, data):
+        """ Frames data read from a tracker and handles any complete messages. """
+        stats = self.metrics
+        stats.bytes.inc(len(data))
+
+        queue = self.trackers[sock]
+        try:
+            with profiling.stage("frame"):
+                stats.frames.inc(queue.read(data))
+        except FrameTooLarge, e:
+            stats.oversized.inc()
+            writeln(0, "Dropped data from tracker:", e)
+
+        self._dispatch(sock, queue)
+
+        if queue.size > self.max_buffer:
+            self.metrics.overflows.inc()
+            self._drop(sock, "exceeded its buffer")
+
+    def _reap(self):
+        """ Disconnects trackers that have been idle for too long.
+
+        Throttled trackers are left alone: they're only quiet because we
+        stopped reading them, and that time doesn't count (see `_resume`).
+        """
+        now = time.time()
+        if not self.idle_timeout or now - self.last_reap < self.REAP_INTERVAL:
+            return
+
+        self.last_reap = now
+        for sock, queue in self.trackers.items():
+            if sock in self.throttled:
+                continue
+            if now - queue.last_seen > self.idle_timeout:
+                self.metrics.timeouts.inc()
+                self._drop(sock, "timed out")
+
+    def _drop(self, sock, reason):
+        """ Forgets about a tracker, closing its connection. """
+        del self.trackers[sock]
+        if self.pool:
+            self.pool.close(sock)
+        else:
+            self._forget(sock)
+        since = self.throttled.pop(sock, None)
+        if since is not None:
+            self.metrics.throttled_time.inc(time.time() - since)
+
+        sock.close()
+        self.metrics.disconnects.inc()
+        writeln(1, "Tracker %s." % reason)
+
+    def _dispatch(self, sock, queue):
+        """ Handles, or hands over, a tracker's complete messages.
+
+        :returns    False if the tracker had to be throttled
+        """
+        if self.pool is None:
+            with profiling.stage("handle"):
+                for message in queue.drain():
+                    start = time.time()
+                    self._on_message(message, sock)
+                    self.metrics.handle_time.observe(time.time() - start)
+            return True
+
+        while queue.ready:
+            if not self.pool.offer(sock, queue.peek()):
+                self._throttle(sock)
+                return False
+            queue.pop()
+        return True
+
+    def _handle_batch(self, batch):
+        """ Handles messages on a handler thread, see `HandlerPool`. """
+        timings = []
+        with profiling.stage("handle"):
+            for sock, message in batch:
+                if message is None:
+                    self._forget(sock)
+                    continue
+                start = time.time()
+                self._on_message(message, sock)
+                timings.append(time.time() - start)
+
+        with self.metrics.lock:
+            for elapsed in timings:
+                self.metrics.handle_time.observe(elapsed)
+
+    def _forget(self, sock):
+        """ Forgets which node was on a closed connection, and any reply left
+        unsent to it. With a handler pool, this runs on the tracker's handler
+        thread, once its messages (and so its replies) are done.
+        """
+        self.identities.pop(sock, None)
+        with self.unsent_lock:
+            self.unsent.pop(sock, None)
+
+    def _throttle(self, sock):
+        """ Stops reading from a tracker until its backlog is handed over. """
+        if sock not in self.throttled:
+            self.throttled[sock] = time.time()
+            self.metrics.throttles.inc()
+            self._pause(sock)
+            writeln(2, "Throttling tracker, its handler has fallen behind.")
+
+    def _resume(self):
+        """ Retries handing over throttled trackers' backlogs. """
+        for sock in self.throttled.keys():
             queue = self.trackers[sock]
-            queue.read(data)
-            if queue.ready:
-                message = queue.pop()
-                self._on_message(message)
+            if self._dispatch(sock, queue):
+                throttled = time.time() - self.throttled.pop(sock)
+                self.metrics.throttled_time.inc(throttled)
+                queue.last_seen += throttled    # not the tracker's idleness
+                self._unpause(sock)
 
-    def _on_message(self, raw_message):
-        writeln(3, "Received message:", repr(raw_message))
+    def _pause(self, sock):
+        """ Stops watching a tracker for data. """
+        pass    # the select loop skips throttled trackers by itself
 
-        message = raw_message
-        name, macs = message.split('|')
-        writeln(0, "Payload from tracker:", name)
-        for mac in macs.split(';'):
-            writeln(0, "  - %s" % mac)
+    def _unpause(self, sock):
+        """ Resumes watching a tracker for data. """
+        pass
 
-    def _on_new_tracker(self, address, tracker_sock):
+    def _on_message(self, raw_message, tracker=None):
+        """ Handles a complete frame from a tracker.
+
+        :raw_message    the frame, see `protocol`
+        :tracker[=None] the socket it arrived on, which ties a hello to the
+                        snapshots and deltas that follow it
         """
+        writeln(3, "Received message:", lazy(repr, raw_message))
+
+        try:
+            kind = protocol.kind(raw_message)
+            if kind == protocol.HELLO:
+                self._on_hello(tracker, protocol.decode_hello(raw_message))
+            elif kind == protocol.DELTA:
+                with profiling.stage("decode"):
+                    added, removed = protocol.decode_delta(raw_message)
+                self._on_delta(tracker, added, removed)
+            elif kind == protocol.ECHO:
+                protocol.decode_echo(raw_message)   # just to validate it
+                self._reply(tracker, raw_message)
+            else:
+                with profiling.stage("decode"):
+                    networks = protocol.decode(raw_message)
+
+        except protocol.ProtocolError, e:
+            with self.metrics.lock:
+                self.metrics.parse_errors.inc()
+            writeln(0, "Malformed payload from tracker:", e)
+            return
+
+        if kind == protocol.KEEPALIVE or (kind == protocol.REPORT and
+                not networks and tracker not in self.identities):
+            writeln(2, "Keepalive from tracker.")
+
+        if kind != protocol.REPORT:
+            return
+
+        node = self.identities.get(tracker)
+        if node is not None:
+            with profiling.stage("apply"), self.nodes_lock:
+                self.nodes[node] = dict([(bssid, set(macs))
+                    for bssid, macs in networks])
+            with self.metrics.lock:
+                self.metrics.snapshots.inc()
+
+        with profiling.stage("output"):
+            for name, macs in networks:
+                writeln(0, "Payload from tracker:", name)
+                for mac in macs:
+                    writeln(0, "  -", mac)
+
+    def _reply(self, tracker, frame):
+        """ Sends a frame back to a tracker, or drops it if that would block.
+
+        A reply is never left half-sent, though: whatever didn't fit of one
+        goes out once the socket has room (see `_send_unsent`), and ahead of
+        the next, so the tracker can always frame them.
         """
+        if tracker is None:
+            return
+
+        with self.unsent_lock:
+            owed = self.unsent.pop(tracker, b'')
+            data = owed + bytes(frame)
+            sent = self._send(tracker, data)
+            if sent is None:
+                return  # anything but a full buffer is for the I/O loop
+
+            if sent < len(owed):
+                self.unsent[tracker] = owed[sent:]
+            elif len(owed) < sent < len(data):
+                self.unsent[tracker] = data[sent:]
+
+        with self.metrics.lock:
+            if sent > len(owed):
+                self.metrics.echoes.inc()
+            else:
+                self.metrics.dropped_echoes.inc()
+
+    def _send_unsent(self, sock):
+        """ Sends what's left of a partly sent reply, once the I/O loop finds
+        the tracker's socket writable. """
+        with self.unsent_lock:
+            owed = self.unsent.pop(sock, b'')
+            sent = self._send(sock, owed) if owed else None
+            if sent is not None and sent < len(owed):
+                self.unsent[sock] = owed[sent:]
+
+    def _send(self, sock, data):
+        """ Sends as much as fits without blocking.
+
+        :returns    the number of bytes sent, or None if the socket failed
+        """
+        try:
+            return sock.send(data, getattr(socket, "MSG_DONTWAIT", 0))
+        except socket.error, e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return None
+            return 0
+
+    def _on_hello(self, tracker, node):
+        writeln(1, "Tracker identified itself as node", lazy(repr, node))
+        self.identities[tracker] = node
+
+    def _on_delta(self, tracker, added, removed):
+        """ Applies a node's changes to what it reported before. """
+        node = self.identities.get(tracker)
+        if node is None:
+            raise protocol.ProtocolError("delta from a tracker that never "
+                "identified itself")
+
+        with profiling.stage("apply"), self.nodes_lock:
+            protocol.apply_delta(self.nodes.setdefault(node, {}), added, removed)
+        with self.metrics.lock:
+            self.metrics.deltas.inc()
+
+        writeln(2, "Changes from node %r: %d added, %d removed." % (
+            node, len(added), len(removed)))
+        with profiling.stage("output"):
+            for name, macs in added:
+                writeln(0, "Payload from tracker:", name)
+                for mac in macs:
+                    writeln(0, "  +", mac)
+            for name, macs in removed:
+                writeln(0, "Removed by tracker:", name)
+                for mac in macs:
+                    writeln(0, "  -", mac)
+
+    def _on_new_tracker(self, address, tracker_sock):
+        """ Starts reading from a newly accepted tracker.
+
+        :returns    False if the tracker was turned away (and its connection
+                    closed) because too many are connected already
+        """
+        self.metrics.accepts.inc()
+        if len(self.trackers) >= self.max_connections:
+            writeln(0, "Refused tracker on %s:%d, %d are connected already." % (
+                address[0], address[1], len(self.trackers)))
+            self.metrics.rejects.inc()
+            tracker_sock.close()
+            return False
+
         self.trackers[tracker_sock] = ReadQueue()
+        return True
 
     @property
     def address(self):
@@ -160,23 +878,286 @@ class CorrelationServer(InfiniteThread):
         return self.listener[1]
 
 
-def main(args):
-    server = CorrelationServer(args.address, args.port)
+class EventLoopServer(CorrelationServer):
+    """ Accepts, reads and dispatches tracker payloads from a single loop.
+
+    The listener and every tracker socket are non-blocking and registered with
+    one `Poller`, so there is no accept thread and no sleeping between passes:
+    the loop blocks in the poller until something is ready. Pending
+    connections are accepted in batches, and trackers are read in large
+    chunks, so a single wakeup can frame many payloads at once. Trackers are
+    also watched for room to write while a reply to them is left unsent.
+    """
+    ACCEPT_BATCH = 128      # connections to accept per listener wakeup
+    TIMEOUT = 1             # how long to block in the poller, in seconds
+
+    def __init__(self, addr, port, **kwargs):
+        super(EventLoopServer, self).__init__(addr, port, pause_length=0,
+            **kwargs)
+        self.sockets = {}   # dict -> { fileno: socket }
+        self.watched = {}   # dict -> { fileno: (readable, writable) }
+        self.writing = set()    # trackers watched for room to write
+
+    def init(self):
+        super(EventLoopServer, self).init()
+        self.sock.setblocking(0)
+        self.listen_fd = self.sock.fileno()
+
+        self.poller = Poller()
+        self.poller.register(self.listen_fd)
+
+    def run(self):
+        try:
+            super(EventLoopServer, self).run()
+        finally:
+            self.poller.close()
+
+    def _loop_method(self):
+        self._reap()
+        self._resume()
+
+        # Handler threads leave replies unsent as they go, and those that are
+        # caught up no longer need watching.
+        unsent = set([sock for sock in self.unsent.keys()
+            if sock in self.trackers])
+        for sock in unsent ^ self.writing:
+            self._watch(sock)
+
+        timeout = self.THROTTLE_TIMEOUT if self.throttled else self.TIMEOUT
+        with profiling.stage("poll"):
+            events = self.poller.poll(timeout)
+
+        for fd, readable, writable, errored in events:
+            if fd == self.listen_fd:
+                with profiling.stage("accept"):
+                    self._accept()
+            elif fd in self.sockets:
+                sock = self.sockets[fd]
+                if writable or (errored and sock in self.throttled):
+                    # A failed send gives up on the reply, so a throttled
+                    # tracker's errors don't keep waking us up.
+                    self._send_unsent(sock)
+                    self._watch(sock)
+                if (readable or errored) and sock not in self.throttled:
+                    # Errors are surfaced by the read itself (or an empty one).
+                    with profiling.stage("read"):
+                        self._read(sock)
+
+    def _accept(self):
+        for _ in xrange(self.ACCEPT_BATCH):
+            try:
+                client, addr = self.sock.accept()
+            except socket.error, e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    writeln(0, "Failed to accept a tracker:", e)
+                return
+
+            writeln(0, "Established connection to tracker on %s:%d" % (addr[0], addr[1]))
+            client.setblocking(0)
+            if not self._on_new_tracker(addr, client):
+                continue
+            self.sockets[client.fileno()] = client
+            self._watch(client)
+
+    def _read(self, sock):
+        try:
+            data = sock.recv(self.RECV_SIZE)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ""
+
+        if not data:
+            self._drop(sock, "disconnected")
+            return
+
+        self._receive(sock, data)
+
+    def _pause(self, sock):
+        self._watch(sock)
+
+    def _unpause(self, sock):
+        self._watch(sock)
+
+    def _watch(self, sock):
+        """ Waits for data from a tracker, unless it's throttled, and for room
+        to write to it, if a reply is left unsent. """
+        fd = sock.fileno()
+        events = (sock not in self.throttled, sock in self.unsent)
+        before = self.watched.get(fd, (False, False))
+        if events == before:
+            return
+
+        if events[1]:
+            self.writing.add(sock)
+        else:
+            self.writing.discard(sock)
+
+        if not any(events):
+            self.poller.unregister(fd)
+            del self.watched[fd]
+        else:
+            if any(before):
+                self.poller.modify(fd, *events)
+            else:
+                self.poller.register(fd, *events)
+            self.watched[fd] = events
+
+    def _drop(self, sock, reason):
+        fd = sock.fileno()
+        if self.watched.pop(fd, None):
+            self.poller.unregister(fd)
+        self.writing.discard(sock)
+        del self.sockets[fd]
+        super(EventLoopServer, self)._drop(sock, reason)
+
+
+ENGINES = {
+    "select": CorrelationServer,
+    "poll":   EventLoopServer,
+}
+
+SHUTDOWN_GRACE = 5     # seconds workers get to exit before being killed
+
+def serve(args, until, worker=None):
+    """ Runs a server, along with its metrics exporters, until told to stop.
+
+    :args           the parsed command line
+    :until          a callable that returns once the server should stop
+    :worker[=None]  this process's index when running as one of several
+                    workers sharing the port, see `run_workers`
+    """
+    server = ENGINES[args.engine](args.address, args.port,
+        reuse_port=worker is not None, handlers=args.handlers,
+        handoff_depth=args.handoff_depth, idle_timeout=args.idle_timeout,
+        max_buffer=args.max_buffer, max_connections=args.max_connections)
+    listen = exporter = dumper = profiler = None
 
     try:
+        if args.cprofile:
+            profiling.profile_calls()
+        if args.profile:
+            profiler = profiling.ReportThread(profiling.Report(args.profile),
+                args.profile_interval,
+                fields={ "worker": worker } if worker is not None else None)
+            profiler.start()
+
         server.init()
-        listen = ListenerThread(server.sock, server._on_new_tracker)
-        listen.start()
+        if args.metrics_port is not None:
+            # Every worker has its own registry, so each gets its own port.
+            exporter = metrics.MetricsServer(server.metrics,
+                args.metrics_address, args.metrics_port + (worker or 0))
+            exporter.start()
+            writeln(1, "Serving metrics on http://%s:%d/metrics" % exporter.address)
+        if args.metrics_dump:
+            dumper = metrics.SnapshotThread(server.metrics, args.metrics_dump,
+                args.metrics_interval,
+                fields={ "worker": worker } if worker is not None else None)
+            dumper.start()
+
+        if args.engine == "select":
+            listen = ListenerThread(server.sock, server._on_new_tracker)
+            listen.start()
         server.start()
-        for i in xrange(60):
-            write(0, "%d, " % i)
-            time.sleep(1)
+        until()
 
     finally:
-        listen.stop_running()
+        if listen:
+            listen.stop_running()
         server.stop_running()
-        listen.join(1000)
+        if listen:
+            listen.join(1000)
         server.join(1000)
+        if exporter:
+            exporter.stop()
+        if dumper:
+            dumper.stop()
+        if profiler:
+            profiler.stop()
+        if args.cprofile:
+            # Workers can't share a file, so each gets its own.
+            path = args.cprofile if worker is None else "%s.%d" % (
+                args.cprofile, worker)
+            if profiling.dump_calls(path):
+                writeln(1, "Wrote profiler stats to", path)
+
+def run_workers(args):
+    """ Runs `args.workers` server processes sharing one port.
+
+    Shutdown is coordinated through a shared event: SIGINT or SIGTERM to the
+    parent, SIGTERM to any worker, or any worker exiting on its own sets it,
+    and every worker then stops. Workers that don't exit within
+    `SHUTDOWN_GRACE` seconds are terminated.
+    """
+    stopped = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=_worker, name="Worker-%d" % i,
+        args=(args, i, stopped)) for i in xrange(args.workers)]
+
+    for worker in workers:
+        worker.start()
+    signals = _catch_signals(signal.SIGINT, signal.SIGTERM)
+    writeln(1, "Started %d workers on %s:%d" % (args.workers, args.address, args.port))
+
+    try:
+        while not signals and not stopped.is_set():
+            for worker in workers:
+                if not worker.is_alive():
+                    writeln(0, "%s exited (code %s), shutting down." % (
+                        worker.name, worker.exitcode))
+                    stopped.set()
+            time.sleep(0.5)
+
+    finally:
+        stopped.set()
+        deadline = time.time() + SHUTDOWN_GRACE
+        for worker in workers:
+            worker.join(max(0, deadline - time.time()))
+        for worker in workers:
+            if worker.is_alive():
+                writeln(0, "%s didn't stop in time, terminating it." % worker.name)
+                worker.terminate()
+                worker.join()
+
+def _worker(args, index, stopped):
+    # The terminal's Ctrl-C reaches the whole process group; leave it to the
+    # parent, which stops everyone through the event.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signals = _catch_signals(signal.SIGTERM)
+
+    def until():
+        while not signals and not stopped.wait(1):
+            pass
+        stopped.set()
+
+    # The parent's log writer thread didn't survive the fork, and children
+    # exit without running atexit handlers, so start a new one and close it.
+    log.configure(log.VERBOSITY, buffered=args.buffer_output)
+    try:
+        serve(args, until, worker=index)
+    finally:
+        log.close()
+
+def _catch_signals(*signums):
+    """ Records the given signals in the returned list as they arrive.
+
+    The handlers can't set a `multiprocessing.Event` themselves: they may run
+    while the interrupted thread holds the event's (non-reentrant) lock.
+    """
+    caught = []
+    for signum in signums:
+        signal.signal(signum, lambda signum, frame: caught.append(signum))
+    return caught
+
+def main(args):
+    if args.workers > 1:
+        return run_workers(args)
+
+    def countdown():
+        for i in xrange(60):
+            write(0, "%d, " % i)
+            time.sleep(1)
+
+    serve(args, countdown)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="")
@@ -184,12 +1165,55 @@ if __name__ == '__main__':
         help="specifies the address on which to bind the listener socket")
     parser.add_argument("-p", "--port", type=int, default=0xC1A,
         help="specifies the port on which to bind the listener socket")
+    parser.add_argument("-e", "--engine", choices=sorted(ENGINES), default="poll",
+        help="server engine: a single epoll/poll event loop (default), or "
+             "the original select loop paired with an accept thread")
+    parser.add_argument("-w", "--workers", metavar="N", type=int, default=1,
+        help="run N server processes sharing the port via SO_REUSEPORT, "
+             "until interrupted")
+    parser.add_argument("-H", "--handlers", metavar="N", type=int, default=2,
+        help="handle messages on N threads, apart from socket I/O; 0 handles "
+             "them inline")
+    parser.add_argument("--handoff-depth", metavar="N", type=int,
+        default=HandlerPool.DEPTH,
+        help="messages queued per handler thread before trackers are "
+             "throttled")
+    parser.add_argument("--idle-timeout", metavar="SEC", type=float,
+        default=CorrelationServer.IDLE_TIMEOUT,
+        help="disconnect trackers that send nothing for this long, 0 to never")
+    parser.add_argument("--max-buffer", metavar="BYTES", type=int,
+        default=CorrelationServer.MAX_BUFFER,
+        help="disconnect trackers that need more than this much buffered")
+    parser.add_argument("--max-connections", metavar="N", type=int,
+        default=CorrelationServer.MAX_CONNECTIONS,
+        help="refuse trackers beyond this many connected at once")
+    parser.add_argument("--metrics-port", metavar="PORT", type=int,
+        help="serve Prometheus-style metrics over HTTP on this port (worker "
+             "i uses PORT + i)")
+    parser.add_argument("--metrics-bind", metavar="ADDR", dest="metrics_address",
+        default="localhost", help="specifies the address of the metrics endpoint")
+    parser.add_argument("--metrics-dump", metavar="FILE",
+        help="periodically append a JSON snapshot of the metrics to FILE "
+             "(- for stdout)")
+    parser.add_argument("--metrics-interval", metavar="SEC", type=float, default=60,
+        help="specifies delay between metrics snapshots")
+    parser.add_argument("--profile", metavar="FILE",
+        help="periodically append the time spent in each stage of handling "
+             "trackers to FILE, as JSON lines (- for stdout)")
+    parser.add_argument("--profile-interval", metavar="SEC", type=float,
+        default=10, help="specifies how long each profile covers")
+    parser.add_argument("--cprofile", metavar="FILE",
+        help="run under cProfile, and write the combined stats to FILE (with "
+             "the worker's index appended, when running several)")
     parser.add_argument("-v", default=1, action="count",
         help="output level (1-3)")
     parser.add_argument("-q", "--quiet", action="store_true",
         help="stop all output, overriding -v")
+    parser.add_argument("-B", "--buffer-output", action="store_true",
+        help="write output from a background thread instead of inline")
 
     args = parser.parse_args()
-    VERBOSITY = args.v if not args.quiet else 0
+    log.configure(args.v if not args.quiet else log.QUIET,
+        buffered=args.buffer_output)
 
     main(args)
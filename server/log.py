@@ -0,0 +1 @@
+../tracker/log.py
\ No newline at end of file
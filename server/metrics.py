@@ -0,0 +1,277 @@
+""" Counters, gauges and histograms describing a running server.
+
+Metrics are grouped in a `Registry`, which renders them in the Prometheus
+text exposition format and as plain dictionaries:
+
+    registry = Registry("correlator")
+    frames = registry.counter("frames_total", "Frames received.")
+    frames.inc()
+
+    MetricsServer(registry, "localhost", 9101).start()    # GET /metrics
+    SnapshotThread(registry, "metrics.jsonl", 60).start()
+
+Updating a metric is a single unlocked attribute update (a histogram also
+does one bisection), so they are cheap enough to leave on permanently. The
+flip side is that each metric should only be updated from one thread at a
+time; reading it from another, like the endpoint does, is fine.
+"""
+import sys
+import json
+import time
+import bisect
+import threading
+import BaseHTTPServer
+
+
+class Counter(object):
+    """ A value that only ever goes up, like a number of bytes received.
+    """
+    TYPE = "counter"
+
+    def __init__(self, name, doc):
+        self.name = name
+        self.doc = doc
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [(self.name, self.value)]
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge(object):
+    """ A value that goes up and down, like a number of open connections.
+
+    Instead of being set, a gauge can be given a function that computes its
+    value whenever it's read.
+    """
+    TYPE = "gauge"
+
+    def __init__(self, name, doc, function=None):
+        self.name = name
+        self.doc = doc
+        self.function = function
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        self._value += amount
+
+    def dec(self, amount=1):
+        self._value -= amount
+
+    @property
+    def value(self):
+        return self.function() if self.function else self._value
+
+    def samples(self):
+        return [(self.name, self.value)]
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram(object):
+    """ Counts observations, like handling times, into buckets.
+
+    Each bucket counts the observations no larger than its upper bound; the
+    last one is unbounded.
+    """
+    TYPE = "histogram"
+
+    # Suited to durations in seconds, from 10us to 10s.
+    BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1, 10)
+
+    def __init__(self, name, doc, buckets=BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.bounds = sorted(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        """ Returns a context manager observing the duration of its block. """
+        return _Timer(self)
+
+    def cumulative(self):
+        """ Returns (upper bound, observations no larger than it) pairs. """
+        pairs, total = [], 0
+        for bound, count in zip(self.bounds + [float("inf")], self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def samples(self):
+        samples = [('%s_bucket{le="%s"}' % (self.name, _format(bound)), count)
+            for bound, count in self.cumulative()]
+        samples.append(("%s_sum" % self.name, self.sum))
+        samples.append(("%s_count" % self.name, self.count))
+        return samples
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": [[_format(bound), count]
+                for bound, count in self.cumulative()],
+        }
+
+
+class _Timer(object):
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.time() - self.start)
+
+
+class Registry(object):
+    """ A named collection of metrics.
+    """
+    def __init__(self, prefix=""):
+        """ Creates an empty registry.
+
+        :prefix[=""]    prepended (with an underscore) to every metric's name
+        """
+        self.prefix = prefix
+        self.metrics = []
+
+    def counter(self, name, doc):
+        return self._add(Counter(self._name(name), doc))
+
+    def gauge(self, name, doc, function=None):
+        return self._add(Gauge(self._name(name), doc, function))
+
+    def histogram(self, name, doc, buckets=Histogram.BUCKETS):
+        return self._add(Histogram(self._name(name), doc, buckets))
+
+    def render(self):
+        """ Returns every metric in the Prometheus text exposition format. """
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.doc))
+            lines.append("# TYPE %s %s" % (metric.name, metric.TYPE))
+            lines.extend(["%s %s" % (name, _format(value))
+                for name, value in metric.samples()])
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """ Returns the current value of every metric, keyed by name. """
+        return dict([(metric.name, metric.snapshot())
+            for metric in self.metrics])
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def _name(self, name):
+        return "%s_%s" % (self.prefix, name) if self.prefix else name
+
+
+def _format(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MetricsServer(threading.Thread):
+    """ Serves a registry over HTTP, for Prometheus (or curl) to scrape.
+
+    Any GET request is answered with the rendered registry.
+    """
+    CONTENT_TYPE = "text/plain; version=0.0.4"
+
+    def __init__(self, registry, addr, port):
+        super(MetricsServer, self).__init__(name="MetricsServer")
+        self.setDaemon(True)
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render()
+                self.send_response(200)
+                self.send_header("Content-Type", MetricsServer.CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass    # don't print a line per scrape
+
+        self.httpd = BaseHTTPServer.HTTPServer((addr, port), Handler)
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def run(self):
+        self.httpd.serve_forever(poll_interval=0.5)
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class SnapshotThread(threading.Thread):
+    """ Periodically appends a registry's snapshot to a file, as JSON lines.
+
+    Each line is a JSON object of every metric's value, along with the time
+    it was taken. A last snapshot is written when the thread is stopped.
+    """
+    def __init__(self, registry, path, interval=60, fields=None):
+        """ Prepares to dump snapshots; call `start` to begin.
+
+        :registry       the metrics to dump
+        :path           the file to append to, or "-" for stdout
+        :interval[=60]  seconds between snapshots
+        :fields[=None]  a dictionary of constant values to add to each
+                        snapshot, like which process it came from
+        """
+        super(SnapshotThread, self).__init__(name="SnapshotThread")
+        self.setDaemon(True)
+
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.fields = fields or {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+        self.dump()
+
+    def dump(self):
+        snapshot = self.registry.snapshot()
+        snapshot.update(self.fields)
+        snapshot["time"] = time.time()
+        line = json.dumps(snapshot, sort_keys=True) + "\n"
+
+        if self.path == "-":
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        else:
+            with open(self.path, "a") as f:
+                f.write(line)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
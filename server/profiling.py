@@ -0,0 +1 @@
+../tracker/profiling.py
\ No newline at end of file
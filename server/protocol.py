@@ -0,0 +1 @@
+../tracker/protocol.py
\ No newline at end of file
@@ -0,0 +1,324 @@
+#!/usr/bin/env python2
+""" Parses whole archives of airodump-ng captures across a process pool.
+
+Every capture is split into tasks: plain files into byte ranges of about
+`CHUNK_SIZE` of their network and client sections (found by scanning a
+memory map of the file for the section headers), and gzip-compressed ones,
+which can't be read from the middle, into a single task each. Tasks are
+spread over a `multiprocessing` pool, largest first, so one huge capture
+is worked on by every process rather than holding up the rest.
+
+Each task is summarized into the networks it saw (row filters applied) and
+the clients seen on each of them. Summaries are merged as they come in:
+networks are deduplicated by BSSID, keeping the strongest sighting, and
+their clients are combined. The result is written out as CSV:
+
+    BSSID, ESSID, Privacy, Signal, Clients
+    00:11:22:33:44:55, Home, OPN, 62, aa:bb:cc:dd:ee:ff;...
+"""
+import os
+import csv
+import sys
+import glob
+import gzip
+import mmap
+import time
+import argparse
+import multiprocessing
+
+import log
+import networkparser
+
+from log import write, writeln
+
+CHUNK_SIZE = 8 * 1024 * 1024    # bytes of a plain capture per task
+PROGRESS_INTERVAL = 0.5         # seconds between progress updates
+
+NETWORK_COLUMNS = ["BSSID", "ESSID", "Privacy", "Power"]
+CLIENT_COLUMNS = ["Station MAC", "BSSID"]
+
+
+class Filters(object):
+    """ The row filters applied while parsing, see `networkparser.filter_networks`.
+    """
+    def __init__(self, open_only=False, min_sig=None, max_sig=None, ignore=()):
+        self.open_only = open_only
+        self.min_sig = min_sig
+        self.max_sig = max_sig
+        self.ignore = frozenset(ignore) | frozenset(networkparser.IGNORE_SSIDS)
+
+    def keep(self, name, security, signal):
+        if self.open_only and security != "OPN": return False
+        if self.min_sig is not None and signal < self.min_sig: return False
+        if self.max_sig is not None and signal > self.max_sig: return False
+        return name not in self.ignore
+
+
+class Summary(object):
+    """ The networks and clients found in (a part of) some captures.
+    """
+    def __init__(self):
+        self.networks = {}  # dict -> { bssid: (signal, name, security) }
+        self.clients = {}   # dict -> { bssid: set([ client MACs ]) }
+        self.rows = 0
+        self.bytes = 0
+        self.malformed = 0
+
+    def add_network(self, bssid, sighting):
+        """ Records a network, keeping only its strongest sighting. """
+        seen = self.networks.get(bssid)
+        if seen is None or sighting > seen:
+            self.networks[bssid] = sighting
+
+    def merge(self, other):
+        for bssid, sighting in other.networks.iteritems():
+            self.add_network(bssid, sighting)
+        for bssid, macs in other.clients.iteritems():
+            self.clients.setdefault(bssid, set()).update(macs)
+
+        self.rows += other.rows
+        self.bytes += other.bytes
+        self.malformed += other.malformed
+
+    def results(self):
+        """ Returns every network as a Network(), clients included. """
+        networks = []
+        for bssid, (signal, name, security) in self.networks.iteritems():
+            nw = networkparser.Network(bssid.upper(), name, security, "0")
+            nw.signal = signal
+            nw.clients = sorted(self.clients.get(bssid, ()))
+            networks.append(nw)
+        return networks
+
+
+def find_captures(paths):
+    """ Expands directories and globs into a sorted list of capture files. """
+    found = set()
+    for path in paths:
+        path = os.path.expanduser(path)
+        if os.path.isdir(path):
+            matches = glob.glob(os.path.join(path, "*.csv")) + \
+                      glob.glob(os.path.join(path, "*.csv.gz"))
+        else:
+            matches = glob.glob(path)
+        found.update([os.path.abspath(match) for match in matches
+            if os.path.isfile(match)])
+    return sorted(found)
+
+def plan(path, chunk_size=CHUNK_SIZE):
+    """ Splits a capture into tasks for `parse_task`.
+
+    :returns    a list of (path, section, start, end, columns) tasks, where a
+                section of None means the whole (compressed) file
+    """
+    size = os.path.getsize(path)
+    if path.endswith(".gz"):
+        return [(path, None, 0, size, None)]
+    if size == 0:
+        return []
+
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            tasks = []
+            nw_header = mm.find("BSSID")
+            if nw_header == -1:
+                return []
+
+            cl_header = mm.find("Station MAC", nw_header)
+            nw_columns, nw_start = _header(mm, nw_header)
+            nw_end = cl_header if cl_header != -1 else size
+            tasks.extend([(path, "networks", start, end, nw_columns)
+                for start, end in _split(mm, nw_start, nw_end, chunk_size)])
+
+            if cl_header != -1:
+                cl_columns, cl_start = _header(mm, cl_header)
+                tasks.extend([(path, "clients", start, end, cl_columns)
+                    for start, end in _split(mm, cl_start, size, chunk_size)])
+            return tasks
+        finally:
+            mm.close()
+
+def _header(mm, offset):
+    """ Parses the header line at an offset into the indices of the columns
+    we need, returning them along with the offset of the next line. """
+    end = mm.find("\n", offset)
+    end = len(mm) if end == -1 else end + 1
+    columns = next(csv.reader([mm[offset:end].strip()], skipinitialspace=True))
+
+    wanted = NETWORK_COLUMNS if columns[0] == "BSSID" else CLIENT_COLUMNS
+    return [columns.index(c) for c in wanted], end
+
+def _split(mm, start, end, chunk_size):
+    """ Cuts [start, end) into ranges of about `chunk_size`, on line breaks. """
+    ranges = []
+    while start < end:
+        cut = min(end, start + chunk_size)
+        if cut < end:
+            newline = mm.find("\n", cut, end)
+            cut = end if newline == -1 else newline + 1
+        ranges.append((start, cut))
+        start = cut
+    return ranges
+
+def parse_task(task, filters):
+    """ Summarizes the part of a capture described by a task from `plan`. """
+    path, section, start, end, columns = task
+    summary = Summary()
+    summary.bytes = end - start
+
+    if section is None:
+        with gzip.open(path, "rb") as f:
+            _add_networks(summary, networkparser.iter_network_rows(f), filters,
+                range(len(NETWORK_COLUMNS)))
+            _add_clients(summary, networkparser.iter_client_rows(f),
+                [0, 1])
+        return summary
+
+    with open(path, "rb") as f:
+        f.seek(start)
+        lines = f.read(end - start).splitlines()
+    rows = csv.reader(lines, skipinitialspace=True)
+
+    if section == "networks":
+        _add_networks(summary, rows, filters, columns)
+    else:
+        _add_clients(summary, rows, columns)
+    return summary
+
+def _add_networks(summary, rows, filters, columns):
+    bssid_i, name_i, security_i, power_i = columns
+    for row in rows:
+        if not row: continue    # the blank line that ends the section
+        summary.rows += 1
+        try:
+            name = networkparser.parse_name(row[name_i])
+            security = networkparser.parse_security(row[security_i])
+            signal = networkparser.parse_signal(row[power_i].strip())
+            bssid = networkparser.normalize_mac(row[bssid_i])
+        except (IndexError, ValueError):
+            summary.malformed += 1
+            continue
+
+        if filters.keep(name, security, signal):
+            summary.add_network(bssid, (signal, name, security))
+
+def _add_clients(summary, rows, columns):
+    mac_i, bssid_i = columns
+    clients = summary.clients
+    for row in rows:
+        if not row: continue
+        summary.rows += 1
+        try:
+            mac = networkparser.normalize_mac(row[mac_i])
+            bssid = networkparser.normalize_mac(row[bssid_i])
+        except IndexError:
+            summary.malformed += 1
+            continue
+
+        if networkparser.mac_to_int(bssid) != networkparser.NO_MAC:
+            clients.setdefault(bssid, set()).add(mac)
+
+def _parse_task(args):
+    """ `parse_task` for `Pool.imap_unordered`, which passes one argument. """
+    return parse_task(*args)
+
+def ingest(paths, jobs=None, chunk_size=CHUNK_SIZE, filters=None):
+    """ Parses and merges captures across a process pool.
+
+    :paths              capture files, directories of them, or globs
+    :jobs[=CPUs]        the number of processes to parse with
+    :chunk_size[=8MiB]  roughly how many bytes of a plain capture each task
+                        covers
+    :filters[=None]     a Filters() for the networks to keep
+
+    :returns            the merged Summary()
+    """
+    filters = filters or Filters()
+    captures = find_captures(paths)
+    tasks = [task for path in captures for task in plan(path, chunk_size)]
+
+    # Largest first, so a big capture's tasks don't trail behind the rest.
+    tasks.sort(key=lambda task: task[3] - task[2], reverse=True)
+    total = sum([end - start for _, _, start, end, _ in tasks])
+    writeln(1, "Parsing %d captures (%.1f MiB) as %d tasks." % (
+        len(captures), total / 1048576.0, len(tasks)))
+
+    merged, started = Summary(), time.time()
+    reported = 0
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for done, summary in enumerate(pool.imap_unordered(_parse_task,
+                [(task, filters) for task in tasks]), 1):
+            merged.merge(summary)
+
+            now = time.time()
+            if now - reported < PROGRESS_INTERVAL and done < len(tasks):
+                continue
+            reported, elapsed = now, max(now - started, 1e-9)
+            write(1, "\r%d/%d tasks, %.1f/%.1f MiB, %d rows, %.1f MiB/s, "
+                "%d rows/s " % (done, len(tasks), merged.bytes / 1048576.0,
+                total / 1048576.0, merged.rows, merged.bytes / 1048576.0 / elapsed,
+                merged.rows / elapsed))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    writeln(1, "\nFound %d networks in %.2fs (%d malformed rows skipped)." % (
+        len(merged.networks), time.time() - started, merged.malformed))
+    return merged
+
+def write_csv(networks, out):
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(["BSSID", "ESSID", "Privacy", "Signal", "Clients"])
+    for nw in networks:
+        writer.writerow([nw.mac, nw.name, nw.security, nw.signal,
+            ';'.join(nw.clients)])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Parses and merges many airodump-ng captures in parallel.")
+    parser.add_argument("paths", metavar="PATH", nargs="+",
+        help="capture files (.csv or .csv.gz), directories of them, or globs")
+    parser.add_argument("-o", "--output", metavar="FILE",
+        help="where to write the merged networks, stdout by default")
+    parser.add_argument("-j", "--jobs", metavar="N", type=int, default=None,
+        help="processes to parse with, one per CPU by default")
+    parser.add_argument("--chunk-size", metavar="MiB", type=float,
+        default=CHUNK_SIZE / 1048576.0,
+        help="roughly how much of a plain capture each task covers")
+    parser.add_argument("--open", action="store_true",
+        help="only keep open networks")
+    parser.add_argument("--min-signal", type=int, default=None,
+        help="only keep networks at least this strong (0-100)")
+    parser.add_argument("--max-signal", type=int, default=None,
+        help="only keep networks at most this strong (0-100)")
+    parser.add_argument("--exclude", default=[], metavar="ESSID(s)", nargs="+",
+        help="network names to exclude, if found")
+    parser.add_argument("--max-dupes", metavar="N", type=int, default=None,
+        help="only keep the N strongest networks sharing a name")
+    parser.add_argument("-v", default=1, action="count",
+        help="output level (1-3)")
+    parser.add_argument("-q", "--quiet", action="store_true",
+        help="stop all progress output, overriding -v")
+    args = parser.parse_args()
+
+    # Progress goes to stderr, so that the results can go to stdout.
+    log.configure(args.v if not args.quiet else log.QUIET, stream=sys.stderr)
+
+    summary = ingest(args.paths, args.jobs, int(args.chunk_size * 1048576),
+        Filters(args.open, args.min_signal, args.max_signal, args.exclude))
+
+    networks = summary.results()
+    if args.max_dupes is not None:
+        networks = networkparser.filter_networks(networks,
+            max_dupes=args.max_dupes)
+    else:
+        networks.sort(key=lambda nw: (-nw.signal, nw.mac))
+
+    if args.output:
+        with open(args.output, "wb") as out:
+            write_csv(networks, out)
+    else:
+        write_csv(networks, sys.stdout)
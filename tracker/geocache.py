@@ -0,0 +1,145 @@
+""" A persistent cache of network geolocation lookups, keyed by BSSID.
+
+Lookups are stored in a local SQLite database, so access points that were
+already resolved don't cost another round-trip to the geolocation APIs on
+later runs. Both positive answers (a location) and negative ones (no location
+known) are remembered, each for a configurable amount of time, and the least
+recently used entries are evicted once the cache holds too many.
+"""
+import os
+import time
+import sqlite3
+import threading
+
+DEFAULT_PATH = "~/.cache/big-brother/locations.db"
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS locations (
+        bssid       TEXT PRIMARY KEY,
+        lat         REAL,
+        lng         REAL,
+        accuracy    REAL,
+        fetched     REAL NOT NULL,
+        used        REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS locations_used ON locations (used);
+"""
+
+
+class LocationCache(object):
+    """ Remembers the results of `Network.get_location` calls.
+
+    Example usage:
+
+        cache = LocationCache("locations.db")
+        network.get_location(cache=cache)   # asks the APIs
+        network.get_location(cache=cache)   # answered locally
+        cache.close()
+
+    The cache is safe to share between threads.
+    """
+    TTL = 30 * 24 * 60 * 60         # how long a location is remembered
+    NEGATIVE_TTL = 24 * 60 * 60     # how long a missing location is remembered
+    MAX_ENTRIES = 100000
+
+    def __init__(self, path, ttl=TTL, negative_ttl=NEGATIVE_TTL,
+                 max_entries=MAX_ENTRIES):
+        """ Opens (or creates) a cache database.
+
+        :path                   the database file, or ":memory:"
+        :ttl[=30 days]          seconds before a found location expires
+        :negative_ttl[=1 day]   seconds before a missing location expires
+        :max_entries[=100000]   the most entries kept before evicting the
+                                least recently used ones
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.size = self.db.execute("SELECT COUNT(*) FROM locations").fetchone()[0]
+
+    def get(self, bssid):
+        """ Looks up a network's location.
+
+        :returns    a dictionary with keys ["location", "accuracy"], just like
+                    `Network.get_location`, or None on a miss (including when
+                    the entry has expired)
+        """
+        bssid = bssid.strip().lower()
+        now = time.time()
+
+        with self.lock:
+            row = self.db.execute("SELECT lat, lng, accuracy, fetched "
+                "FROM locations WHERE bssid = ?", (bssid,)).fetchone()
+
+            if row is not None:
+                lat, lng, accuracy, fetched = row
+                ttl = self.negative_ttl if lat is None else self.ttl
+                if now - fetched > ttl:
+                    row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            with self.db:
+                self.db.execute("UPDATE locations SET used = ? WHERE bssid = ?",
+                    (now, bssid))
+
+        if lat is None:
+            return { "location": None, "accuracy": None }
+        return { "location": { "lat": lat, "lng": lng }, "accuracy": accuracy }
+
+    def put(self, bssid, result):
+        """ Remembers the result of a location lookup.
+
+        :bssid      the network's MAC address
+        :result     the dictionary returned by `Network.get_location`
+        """
+        bssid = bssid.strip().lower()
+        location = result.get("location")
+        lat, lng = (location["lat"], location["lng"]) if location else (None, None)
+        now = time.time()
+
+        with self.lock:
+            with self.db:
+                exists = self.db.execute("SELECT 1 FROM locations "
+                    "WHERE bssid = ?", (bssid,)).fetchone()
+                self.db.execute("INSERT OR REPLACE INTO locations "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (bssid, lat, lng, result.get("accuracy"), now, now))
+                if not exists:
+                    self.size += 1
+
+                excess = self.size - self.max_entries
+                if excess > 0:
+                    self.db.execute("DELETE FROM locations WHERE bssid IN ("
+                        "SELECT bssid FROM locations ORDER BY used LIMIT ?)",
+                        (excess,))
+                    self.size -= excess
+                    self.evictions += excess
+
+    def stats(self):
+        """ Returns the cache's counters as a dictionary. """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": self.size,
+        }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
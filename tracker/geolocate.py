@@ -0,0 +1,208 @@
+""" Geolocation of networks by BSSID, through web APIs.
+
+This pulls in `requests` (and the rest of the network stack), so it's kept
+apart from `networkparser` and only imported once a location is actually
+needed. The Google API key is likewise only read on first use.
+"""
+import json
+import time
+import Queue
+import requests
+import threading
+
+KEYS_FILE = ".keys"
+API_KEY = None      # read from KEYS_FILE on first use, see `api_key`
+
+# https://developers.google.com/maps/documentation/geolocation/
+API_URL = "https://www.googleapis.com/geolocation/v1/geolocate?key=%s"
+
+# https://www.mylnikov.org/archives/1170
+BKP_URL = "http://api.mylnikov.org/geolocation/wifi?v=1.1&data=open&bssid=%s"
+
+API_TIMEOUT = 10    # seconds to wait on either geolocation API
+
+
+def api_key():
+    """ Returns the Google API key, or an empty string if there isn't one.
+    """
+    global API_KEY
+    if API_KEY is None:
+        try:
+            with open(KEYS_FILE) as f: API_KEY = f.read().strip()
+        except IOError:
+            API_KEY = ""
+    return API_KEY
+
+def query(mac, fallback=False, write=None, http=None):
+    """ Asks the geolocation APIs where a network is.
+
+    If the Google API doesn't know the network, can't be reached or there is
+    no key to ask it with, the backup API is asked instead.
+
+    :mac                the network's BSSID
+    :fallback[=False]   see `networkparser.Network.get_location`
+    :write[=None]       a write(verbosity, *args) function for output
+    :http[=requests]    what to make requests with, like a `location_session`
+
+    :returns            a dictionary with keys ["location", "accuracy"]
+    """
+    write = write or (lambda v, *args: None)
+    http = http or requests
+
+    args = json.dumps({
+        "considerIp": "false" if not fallback else "true",
+        "wifiAccessPoints": [{ "macAddress": mac.lower()
+    }]})
+
+    response = None
+    if api_key():
+        url = API_URL % api_key()
+        write(3, "Request URL:", url)
+        write(3, "  Params:", args)
+
+        try:
+            response = http.post(url, data=args, timeout=API_TIMEOUT,
+                headers={"Content-Type": "application/json"})
+        except requests.RequestException, e:
+            write(2, "  Google API request failed:", e)
+    else:
+        write(2, "No Google API key in %s, only the backup API is used." % (
+            KEYS_FILE))
+
+    write(1, "For network:", mac)
+
+    result = {
+        "location": None,
+        "accuracy": None
+    }
+
+    if response is None or response.status_code != 200:
+        if response is not None:
+            write(2, "  No location found from Google API.")
+
+        url = BKP_URL % mac.upper()
+        write(2, "  Trying backup API.")
+        write(3, "    Request URL:", url)
+
+        response = http.get(url, timeout=API_TIMEOUT)
+        j = response.json()
+        write(3, "   ", j)
+
+        if j["result"] == 200:
+            result["location"] = {
+                "lat": j["data"]["lat"],
+                "lng": j["data"]["lon"]
+            }
+            result["accuracy"] = j["data"]["range"]
+
+    else:
+        j = response.json()
+        write(3, " ", j)
+        result.update([ pair for pair in j.items() if pair[0] in result ])
+
+    return result
+
+
+class TokenBucket(object):
+    """ A thread-safe rate limiter.
+
+    Tokens accumulate at `rate` per second, up to `burst` of them, and each
+    call to `acquire` takes one, waiting for it if necessary.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst,
+                    self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def location_session(pool_size=10, rate=None):
+    """ Creates an HTTP session for geolocation lookups.
+
+    Connections are kept alive and pooled (up to `pool_size` per host), and if
+    a `rate` is given, requests are limited to that many per second across
+    every thread using the session.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2,
+        pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    if rate:
+        bucket, request = TokenBucket(rate), session.request
+        def limited(*args, **kwargs):
+            bucket.acquire()
+            return request(*args, **kwargs)
+        session.request = limited
+
+    return session
+
+def resolve_locations(networks, workers=8, rate=None, fallback=False,
+                      verbosity=0, cache=None):
+    """ Looks up the locations of many networks concurrently.
+
+    The Google API answers a request listing several access points with a
+    single estimate of where the _requester_ is, rather than one location per
+    access point, so every network gets its own request. These are spread
+    over a pool of threads sharing one pooled, rate-limited session, and each
+    network independently falls back to the backup API.
+
+    :networks           an iterable of Network() objects
+    :workers[=8]        the number of concurrent requests
+    :rate[=None]        the most requests to make per second, if limited
+    :fallback[=False]   see `networkparser.Network.get_location`
+    :verbosity[=0]      specifies the detail of the output level
+    :cache[=None]       a geocache.LocationCache, see
+                        `networkparser.Network.get_location`
+
+    :returns            a list of (Network(), result) pairs, in the order the
+                        networks were given; a network whose lookup failed
+                        has None as its result
+    """
+    networks = list(networks)
+    results = [None] * len(networks)
+    session = location_session(workers, rate)
+    pending = Queue.Queue()
+    for item in enumerate(networks):
+        pending.put(item)
+
+    def work():
+        while True:
+            try:
+                i, nw = pending.get_nowait()
+            except Queue.Empty:
+                return
+
+            try:
+                results[i] = nw.get_location(fallback=fallback,
+                    verbosity=verbosity, cache=cache, session=session)
+            except Exception, e:
+                if verbosity >= 1:
+                    print "Failed to locate %s: %s" % (nw.mac, e)
+
+    threads = [threading.Thread(target=work)
+        for _ in xrange(max(1, min(workers, len(networks))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    session.close()
+    return zip(networks, results)
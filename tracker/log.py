@@ -0,0 +1,128 @@
+""" Leveled console output, shared by the tracker and the correlation server.
+
+Nothing about a message is computed unless its level is enabled: the check
+comes first, and only then are the arguments converted and joined. Arguments
+that are expensive to produce can be wrapped in `lazy`, so that they aren't
+even evaluated when the message is filtered out:
+
+    writeln(2, "Received data:", lazy(repr, data))
+
+Output goes to stdout directly by default. With `configure(buffered=True)`,
+messages are instead handed off to a background thread that writes them in
+batches, so that callers never wait on the terminal.
+"""
+import sys
+import atexit
+import threading
+import collections
+
+QUIET = -1      # a verbosity below every message level
+
+VERBOSITY = 0   # 1: normal, 2: extra, 3: all
+
+
+class lazy(object):
+    """ Defers a call until (and unless) its result is output.
+    """
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self):
+        return str(self.fn(*self.args))
+
+
+class StreamHandler(object):
+    """ Writes every message to a stream as soon as it's emitted.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def emit(self, message):
+        self.stream.write(message)
+        self.stream.flush()
+
+    def close(self):
+        self.stream.flush()
+
+
+class BufferedHandler(object):
+    """ Writes messages to a stream from a background thread.
+
+    Emitting a message only appends it to a queue. The writer thread wakes up
+    every `interval` seconds and writes whatever has piled up with a single
+    write and flush; `close` writes out anything still queued.
+    """
+    INTERVAL = 0.05     # how often queued messages are written, in seconds
+
+    def __init__(self, stream, interval=INTERVAL):
+        self.stream = stream
+        self.interval = interval
+        self.queue = collections.deque()
+        self.stopped = threading.Event()
+        self.writer = threading.Thread(name="LogWriter", target=self._drain)
+        self.writer.setDaemon(True)
+        self.writer.start()
+
+    def emit(self, message):
+        self.queue.append(message)  # atomic, so no lock is needed
+
+    def close(self):
+        self.stopped.set()
+        self.writer.join()
+
+    def _drain(self):
+        while not self.stopped.wait(self.interval):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        batch = []
+        try:
+            while True:
+                batch.append(self.queue.popleft())
+        except IndexError:
+            pass
+
+        if batch:
+            self.stream.write(''.join(batch))
+            self.stream.flush()
+
+
+_handler = StreamHandler(sys.stdout)
+
+
+def configure(verbosity, buffered=False, stream=None):
+    """ Sets the output level and where messages go.
+
+    :verbosity          the highest message level to output, or QUIET
+    :buffered[=False]   whether to write from a background thread
+    :stream[=stdout]    the stream to write messages to
+    """
+    global VERBOSITY, _handler
+
+    VERBOSITY = verbosity
+    _handler.close()
+
+    stream = stream or sys.stdout
+    _handler = BufferedHandler(stream) if buffered else StreamHandler(stream)
+
+def enabled(v):
+    """ Returns whether or not messages of a given level are output. """
+    return VERBOSITY >= v
+
+def writeln(v, *args):
+    if VERBOSITY < v: return
+    _handler.emit(' '.join([str(arg) for arg in args] + [ "\n" ]))
+
+def write(v, *args):
+    if VERBOSITY < v: return
+    _handler.emit(' '.join([str(arg) for arg in args]))
+
+@atexit.register
+def close():
+    """ Writes out whatever is still buffered. Runs at exit, but processes
+    that leave without running atexit handlers need to call it themselves. """
+    _handler.close()
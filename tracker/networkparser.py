@@ -1,53 +1,34 @@
 #!/usr/bin/env python2
 import os
 import sys
+import time
+import atexit
 
 import csv
-import json
-import pprint
-import requests
+import array
+import heapq
 import argparse
+import itertools
 import collections
 
 IGNORE_SSIDS = [
     "xfinitywifi",
 ]
 
-API_KEY = ""
-with open(".keys") as f: API_KEY = f.read().strip()
-
-# https://developers.google.com/maps/documentation/geolocation/
-API_URL = "https://www.googleapis.com/geolocation/v1/geolocate?key=%s" % API_KEY
-
-# https://www.mylnikov.org/archives/1170
-BKP_URL = "http://api.mylnikov.org/geolocation/wifi?v=1.1&data=open&bssid=%s"
+# MACs are 48 bits wide; if an unsigned long can't hold that (as on 32-bit
+# boards), a double represents them exactly.
+MAC_TYPECODE = 'L' if array.array('L').itemsize >= 8 else 'd'
+NO_MAC = 1 << 48    # stands in for a missing or malformed MAC address
 
 
 class Network(object):
-    networks = []
+    __slots__ = ("mac", "name", "security", "signal", "clients", "_location")
 
     def __init__(self, mac, name, security, signal):
         self.mac = mac
-        self.name = name.strip() if name else "n/a"
-        self.security = security.strip() if security else "???"
-
-        #
-        # As per the airodump specification, -1 has a special meaning for
-        # networks:
-        #
-        #   If the BSSID PWR is -1, then the driver doesn't support signal level
-        #   reporting. If the PWR is -1 for a limited number of stations then
-        #   this is for a packet which came from the AP to the client but the
-        #   client transmissions are out of range for your card.
-        #
-        # Note: as the signal gets higher you get closer to the AP or the
-        # station, but it's a negative number so we need to invert the value.
-        #
-        if signal != "-1":
-            self.signal = 100 - abs(int(signal))
-        else:
-            self.signal = 0
-
+        self.name = parse_name(name)
+        self.security = parse_security(security)
+        self.signal = parse_signal(signal)
         self.clients = []
         self._location = None
 
@@ -66,13 +47,19 @@ class Network(object):
     def accuracy(self):
         return self._location["accuracy"] if self._location else None
 
-    def get_location(self, fallback=False, verbosity=0):
+    def get_location(self, fallback=False, verbosity=0, cache=None, session=None):
         """ Retrieves the location of this WiFi network based on the BSSID.
 
         :fallback[=False]   specifies whether or not to use the IP address of
                             the outbound request as a fallback for geolocation
                             lookup, in case the WiFi address doesn't exist
         :verbosity[=0]      specifies the detail of the output level
+        :cache[=None]       a geocache.LocationCache to answer from, and to
+                            remember the answer in; lookups that fall back to
+                            the IP address aren't cached, since their answer
+                            depends on where the request came from
+        :session[=None]     a `requests.Session` to make the requests with,
+                            such as one from `geolocate.location_session`
 
         :returns            a dictionary with keys ["location", "accuracy"]
         """
@@ -80,74 +67,379 @@ class Network(object):
             if verbosity < v: return
             print ' '.join([str(x) for x in args])
 
-        args = json.dumps({
-            "considerIp": "false" if not fallback else "true",
-            "wifiAccessPoints": [{ "macAddress": self.mac.lower()
-        }]})
+        if fallback: cache = None
 
-        # import pdb; pdb.set_trace()
+        result = cache.get(self.mac) if cache is not None else None
+        if result is not None:
+            write(1, "For network:", self.mac, "(cached)")
+        else:
+            import geolocate    # only now, see its docstring
+            result = geolocate.query(self.mac, fallback, write, session)
+            if cache is not None:
+                cache.put(self.mac, result)
 
-        write(3, "Request URL:", API_URL)
-        write(3, "  Params:", args)
+        if result["location"] is None:
+            write(1, "  No location found.")
+        else:
+            write(1, "  Location: (%f, %f)" % (result["location"]["lat"],
+                result["location"]["lng"]))
+            write(1, "  Accuracy: %0.2fm" % (result["accuracy"]))
 
-        response = requests.post(API_URL, data=args,
-            headers={"Content-Type": "application/json"})
+        self._location = result
+        return result
 
-        write(1, "For network:", self.mac)
 
-        result = {
-            "location": None,
-            "accuracy": None
-        }
+class Client(object):
+    __slots__ = ("mac", "network_name", "_network")
 
-        if response.status_code == 404:
-            write(2, "  No location found from Google API.")
+    def __init__(self, mac, network, network_name, index=None):
+        """ Creates a client, associating it with the network it's joined to.
 
-            url = BKP_URL % self.mac.upper()
-            write(2, "  Trying backup API.")
-            write(3, "    Request URL:", url)
+        :mac            the MAC address of the client
+        :network        the BSSID of the network it's connected to, if any
+        :network_name   the names of the networks it has probed for
+        :index[=None]   a dictionary of { normalized BSSID: Network() } to
+                        look the network up in, see `normalize_mac`
+        """
+        self.mac = mac
+        self.network_name = parse_name(network_name)
+        self._network = index.get(normalize_mac(network)) if index else None
+        if self._network is not None:
+            self._network.clients.append(self)
 
-            response = requests.get(url)
-            j = response.json()
-            write(3, "   ", j)
+    @property
+    def network(self):
+        return self._network.mac if self._network else "n/a"
 
-            if j["result"] == 200:
-                result["location"] = {
-                    "lat": j["data"]["lat"],
-                    "lng": j["data"]["lon"]
-                }
-                result["accuracy"] = j["data"]["range"]
+    def __str__(self):
+        return "<%s => %s[%s]>" % (self.mac, self.network, self.network_name)
 
-        else:
-            j = response.json()
-            write(3, " ", j)
-            result = dict([ pair for pair in j.items() if pair[0] in result ])
+    def __repr__(self):
+        return str(self)
 
-        if result["location"] is None:
-            write(1, "  No location found.")
-        else:
-            write(1, "  Location: (%f, %f)" % tuple(result["location"].values()))
-            write(1, "  Accuracy: %0.2fm" % (result["accuracy"]))
 
+class ParseResult(tuple):
+    """ The networks and clients parsed from a single capture.
+
+    This unpacks just like a ([ Network() ], [ Client() ]) 2-tuple, and also
+    carries the index of every parsed network by its normalized BSSID.
+
+    A result is the only owner of the records parsed from its capture: nothing
+    is registered anywhere else, so everything is freed along with it. Use it
+    as a context manager (or call `release`) to free the records as soon as a
+    scan cycle is done with them:
+
+        with parse_csv(csvf) as (networks, clients):
+            pass
+    """
+    def __new__(cls, networks, clients, index):
+        result = super(ParseResult, cls).__new__(cls, (networks, clients))
+        result.index = index
         return result
 
+    @property
+    def networks(self):
+        return self[0]
 
-class Client(object):
-    clients = []
+    @property
+    def clients(self):
+        return self[1]
 
-    def __init__(self, mac, network, network_name):
-        self.mac = mac
-        self.network_name = network_name.strip() if network_name else "n/a"
-        self._network = None
-        for nw in Network.networks:
-            if nw.mac == network:
-                self._network = nw
-                nw.clients.append(self)
-        Client.clients.append(self)
+    def lookup(self, bssid):
+        """ Finds a parsed network by its BSSID, or None if it wasn't seen.
+        """
+        return self.index.get(normalize_mac(bssid))
+
+    def release(self):
+        """ Drops every record, unlinking networks from their clients.
+
+        Networks and clients refer to each other, so without this they are
+        only reclaimed by the cyclic garbage collector, whenever it next runs.
+        """
+        for nw in self.networks:
+            del nw.clients[:]
+        for cli in self.clients:
+            cli._network = None
+
+        del self.networks[:]
+        del self.clients[:]
+        self.index.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class CaptureWatcher(object):
+    """ Incrementally follows an airodump-ng capture while it's being written.
+
+    airodump-ng rewrites its CSV from scratch every few seconds. Each `poll`
+    checks the file's size and modification time to see whether it has been
+    rewritten, and if so, reads it again. Every rewrite touches the times
+    and packet counts of every active row, so rows are compared by the few
+    fields we keep instead: those are split out of each row (with a plain
+    `str.split` where the row is unambiguous), and records are only created
+    (or updated in place) for rows where one of them changed.
+
+    Example usage:
+
+        watcher = CaptureWatcher("captures/cap-01.csv")
+        while sniffing:
+            networks, clients = watcher.poll()  # only new or changed rows
+        networks, clients = watcher.snapshot()  # everything seen so far
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.stamp = None       # (size, mtime) of the last complete read
+
+        # The fields each row was last seen with, by its raw MAC address.
+        self.seen = { self._update_network: {}, self._update_client: {} }
+
+        # Records by normalized MAC address, in the order they first appeared.
+        self.networks = collections.OrderedDict()
+        self.clients = collections.OrderedDict()
+
+    def poll(self):
+        """ Reads whatever has changed in the capture since the last poll.
+
+        :returns    2-tuple of ([ Network() ], [ Client() ]) objects that are
+                    either new or whose fields have changed
+        """
+        try:
+            stat = os.stat(self.filename)
+            with open(self.filename, "r") as f:
+                data = f.read()
+        except (IOError, OSError):
+            return [], []
+
+        stamp = (stat.st_size, stat.st_mtime)
+        if stamp == self.stamp:
+            return [], []
+
+        # If we caught airodump-ng in the middle of a rewrite, the last line
+        # may be incomplete; skip it, and read the file again next time.
+        lines = data.split('\n')
+        complete = not lines[-1]
+        lines.pop()
+
+        networks, clients = [], []
+        update, idxs, width, seen = None, None, 0, None
+        for line in lines:
+            if line.startswith("BSSID"):
+                update = self._update_network
+                idxs, width = self._columns(line,
+                    ["BSSID", "ESSID", "Privacy", "Power"])
+            elif line.startswith("Station MAC"):
+                update = self._update_client
+                idxs, width = self._columns(line,
+                    ["Station MAC", "BSSID", "Probed ESSIDs"])
+            elif not line.strip():
+                update = None
+            elif update is not None:
+                # Rows without quotes or extra commas split like csv does.
+                row = line.rstrip('\r').split(',')
+                if len(row) != width or '"' in line:
+                    row = next(csv.reader([line], skipinitialspace=True))
+                fields = tuple([row[idx].lstrip(' ') for idx in idxs])
+
+                seen = self.seen[update]
+                if seen.get(fields[0]) == fields:
+                    continue
+                seen[fields[0]] = fields
+
+                record = update(list(fields))
+                if record is not None:
+                    (networks if update == self._update_network
+                        else clients).append(record)
+
+        self.stamp = stamp if complete else None
+        return networks, clients
+
+    def snapshot(self):
+        """ Returns every record seen so far as a ParseResult. """
+        return ParseResult(self.networks.values(), self.clients.values(),
+            dict(self.networks))
+
+    def _columns(self, header, names):
+        """ Returns the indices of some columns, and how many there are. """
+        columns = next(csv.reader([header], skipinitialspace=True))
+        return [columns.index(name) for name in names], len(columns)
+
+    def _update_network(self, fields):
+        name = parse_name(fields[1])
+        if name in IGNORE_SSIDS:
+            return None
+
+        key = normalize_mac(fields[0])
+        nw = self.networks.get(key)
+        if nw is None:
+            nw = self.networks[key] = Network(*fields)
+            return nw
+
+        security, signal = parse_security(fields[2]), parse_signal(fields[3])
+        if (nw.name, nw.security, nw.signal) == (name, security, signal):
+            return None
+
+        nw.name, nw.security, nw.signal = name, security, signal
+        return nw
+
+    def _update_client(self, fields):
+        key = normalize_mac(fields[0])
+        cli = self.clients.get(key)
+        if cli is None:
+            cli = self.clients[key] = Client(*fields, index=self.networks)
+            return cli
+
+        network = self.networks.get(normalize_mac(fields[1]))
+        name = parse_name(fields[2])
+        if (cli._network, cli.network_name) == (network, name):
+            return None
+
+        if cli._network is not None:
+            cli._network.clients.remove(cli)
+        if network is not None:
+            network.clients.append(cli)
+        cli._network, cli.network_name = network, name
+        return cli
+
+
+class CaptureTable(object):
+    """ A compact, column-oriented alternative to a list of records.
+
+    Rather than an object per row, every field of a capture is stored in a
+    packed `array` column: MAC addresses as 48-bit integers, signal strength
+    as a byte, and security and names as indices into tables of the distinct
+    strings seen (security has a table of its own, since it only takes a few
+    values, and so fits a byte too). Rows are read back through lightweight views that have the
+    same attributes as a Network() or Client():
+
+        table = parse_table(csvf)
+        for nw in table.networks:
+            print nw.mac, nw.name, nw.signal, nw.security
+    """
+    def __init__(self):
+        self.strings = []       # distinct names
+        self._codes = {}        # dict -> { string: index into self.strings }
+        self.levels = []        # distinct security levels
+        self._level_codes = {}  # dict -> { level: index into self.levels }
+
+        self.nw_macs = array.array(MAC_TYPECODE)
+        self.nw_names = array.array('I')
+        self.nw_security = array.array('B')
+        self.nw_signals = array.array('b')
+
+        self.cli_macs = array.array(MAC_TYPECODE)
+        self.cli_networks = array.array(MAC_TYPECODE)
+        self.cli_names = array.array('I')
+
+        self.networks = _TableView(self, NetworkRow, self.nw_macs)
+        self.clients = _TableView(self, ClientRow, self.cli_macs)
+
+    def add_network(self, mac, name, security, signal):
+        """ Appends a network row, taking the same fields as Network(). """
+        self.nw_macs.append(mac_to_int(mac))
+        self.nw_names.append(self._code(parse_name(name)))
+
+        level = self._level_code(parse_security(security))
+        if level > 0xFF and self.nw_security.typecode == 'B':
+            # Only a malformed capture has this many, but don't choke on it.
+            self.nw_security = array.array('I', self.nw_security)
+        self.nw_security.append(level)
+        self.nw_signals.append(parse_signal(signal))
+
+    def add_client(self, mac, network, network_name):
+        """ Appends a client row, taking the same fields as Client(). """
+        self.cli_macs.append(mac_to_int(mac))
+        self.cli_networks.append(mac_to_int(network))
+        self.cli_names.append(self._code(parse_name(network_name)))
+
+    def _code(self, string):
+        code = self._codes.get(string)
+        if code is None:
+            code = self._codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+    def _level_code(self, level):
+        code = self._level_codes.get(level)
+        if code is None:
+            code = self._level_codes[level] = len(self.levels)
+            self.levels.append(level)
+        return code
+
+
+class _TableView(object):
+    """ A read-only sequence of the rows of one section of a CaptureTable. """
+    __slots__ = ("table", "row", "column")
+
+    def __init__(self, table, row, column):
+        self.table, self.row, self.column = table, row, column
+
+    def __len__(self):
+        return len(self.column)
+
+    def __getitem__(self, i):
+        if i < 0: i += len(self.column)
+        if not 0 <= i < len(self.column):
+            raise IndexError("row index out of range")
+        return self.row(self.table, i)
+
+    def __iter__(self):
+        for i in xrange(len(self.column)):
+            yield self.row(self.table, i)
+
+
+class NetworkRow(object):
+    """ A view of a network stored in a CaptureTable. """
+    __slots__ = ("table", "i")
+
+    def __init__(self, table, i):
+        self.table, self.i = table, i
+
+    @property
+    def mac(self):
+        return int_to_mac(self.table.nw_macs[self.i])
+
+    @property
+    def name(self):
+        return self.table.strings[self.table.nw_names[self.i]]
+
+    @property
+    def security(self):
+        return self.table.levels[self.table.nw_security[self.i]]
+
+    @property
+    def signal(self):
+        return self.table.nw_signals[self.i]
+
+    def __str__(self):
+        return "<%s | %s[%s] | %s%%>" % (self.mac, self.name, self.security,
+            self.signal)
+
+    def __repr__(self):
+        return str(self)
+
+
+class ClientRow(object):
+    """ A view of a client stored in a CaptureTable. """
+    __slots__ = ("table", "i")
+
+    def __init__(self, table, i):
+        self.table, self.i = table, i
+
+    @property
+    def mac(self):
+        return int_to_mac(self.table.cli_macs[self.i])
 
     @property
     def network(self):
-        return self._network.mac if self._network else "n/a"
+        return int_to_mac(self.table.cli_networks[self.i])
+
+    @property
+    def network_name(self):
+        return self.table.strings[self.table.cli_names[self.i]]
 
     def __str__(self):
         return "<%s => %s[%s]>" % (self.mac, self.network, self.network_name)
@@ -156,18 +448,142 @@ class Client(object):
         return str(self)
 
 
+def normalize_mac(mac):
+    """ Puts a MAC address in the form used to key network indices.
+    """
+    return mac.strip().lower() if mac else ""
+
+def mac_to_int(mac):
+    """ Packs a MAC address into an integer, or NO_MAC if it isn't one.
+    """
+    try:
+        value = int(mac.strip().replace(':', ''), 16)
+    except (AttributeError, ValueError):
+        return NO_MAC
+    return value if 0 <= value < NO_MAC else NO_MAC
+
+def int_to_mac(value):
+    """ Unpacks an integer from `mac_to_int` back into a MAC address.
+    """
+    if value == NO_MAC:
+        return "n/a"
+    digits = "%012X" % value
+    return ':'.join([digits[i:i + 2] for i in xrange(0, 12, 2)])
+
+def parse_name(name):
+    return name.strip() if name else "n/a"
+
+def parse_security(security):
+    return security.strip() if security else "???"
+
+def parse_signal(signal):
+    """ Converts an airodump-ng power reading into a 0-100 signal strength.
+    """
+    #
+    # As per the airodump specification, -1 has a special meaning for
+    # networks:
+    #
+    #   If the BSSID PWR is -1, then the driver doesn't support signal level
+    #   reporting. If the PWR is -1 for a limited number of stations then
+    #   this is for a packet which came from the AP to the client but the
+    #   client transmissions are out of range for your card.
+    #
+    # Note: as the signal gets higher you get closer to the AP or the
+    # station, but it's a negative number so we need to invert the value.
+    #
+    if signal != "-1":
+        return 100 - abs(int(signal))
+    return 0
+
+def parse_table(csvf, verbosity=0):
+    """ Parses an airodump-ng capture file into a compact CaptureTable.
+
+    This is the low-memory alternative to `parse_csv`: no per-row objects are
+    kept, and clients aren't associated with network objects (but still carry
+    the BSSID of their network).
+
+    :csvf           the CSV file handle, assumed to be seeked to the line before
+                    the column headers.
+    :verbosity[=0]  determines the level of output when parsing.
+    :returns        a CaptureTable of the capture's networks and clients.
+    """
+    table = CaptureTable()
+    for fields in iter_network_rows(csvf, verbosity):
+        if parse_name(fields[1]) not in IGNORE_SSIDS:
+            table.add_network(*fields)
+
+    for fields in iter_client_rows(csvf, verbosity):
+        table.add_client(*fields)
+
+    return table
+
 def parse_csv(csvf, verbosity=0):
     """ Parses an airodump-ng capture file into a collection of networks.
 
     If there are any unassociated clients found, these are parsed as well.
+    This reads the whole capture up front; see `iter_networks` and
+    `iter_clients` to process it as it's being read.
 
     :csvf           the CSV file handle, assumed to be seeked to the line before
                     the column headers.
     :verbosity[=0]  determines the level of output when parsing.
-    :returns        2-tuple of ([ Network() ], [ Client() ]) objects.
+    :returns        a ParseResult, the 2-tuple of ([ Network() ], [ Client() ])
+                    objects, with clients associated to their networks.
+    """
+    index = {}
+    networks = list(iter_networks(csvf, verbosity, index))
+
+    if verbosity >= 2: print "Processing clients now."
+    clients = list(iter_clients(csvf, verbosity, index))
+
+    return ParseResult(networks, clients, index)
+
+def iter_networks(csvf, verbosity=0, index=None):
+    """ Lazily parses the network section of an airodump-ng capture file.
+
+    Networks are yielded as their rows are read, so nothing beyond the current
+    row is held in memory. Networks named in `IGNORE_SSIDS` are skipped.
+
+    :csvf           the CSV file handle, assumed to be seeked to the line before
+                    the column headers.
+    :verbosity[=0]  determines the level of output when parsing.
+    :index[=None]   a dictionary to record each yielded network in, keyed by
+                    its normalized BSSID, for use with `iter_clients`.
+    :returns        a generator of Network() objects; once exhausted, `csvf`
+                    is positioned at the start of the client section.
+    """
+    for fields in iter_network_rows(csvf, verbosity):
+        nw = Network(*fields)
+
+        if verbosity >= 1:
+            print "  -", nw
+
+        if nw.name not in IGNORE_SSIDS:
+            if index is not None:
+                index[normalize_mac(nw.mac)] = nw
+            yield nw
+
+def iter_clients(csvf, verbosity=0, index=None):
+    """ Lazily parses the client section of an airodump-ng capture file.
+
+    :csvf           the CSV file handle, positioned at the start of the client
+                    section (that is, after exhausting `iter_networks`).
+    :verbosity[=0]  determines the level of output when parsing.
+    :index[=None]   the network index filled in by `iter_networks`; if given,
+                    clients are associated with the networks they joined.
+    :returns        a generator of Client() objects.
     """
-    networks, clients = [], []
+    for fields in iter_client_rows(csvf, verbosity):
+        cli = Client(*fields, index=index)
+
+        if verbosity >= 1:
+            print "  -", cli
+
+        yield cli
 
+def iter_network_rows(csvf, verbosity=0):
+    """ Yields the raw [ BSSID, ESSID, Privacy, Power ] fields of each network.
+    """
     csvf.readline()     # first line is assumed to be blank
     reader = csv.reader(csvf, skipinitialspace=True)
     columns = next(reader)
@@ -187,70 +603,120 @@ def parse_csv(csvf, verbosity=0):
 
     for row in reader:
         if not row: break   # network section has ended
+        yield [row[idx] for idx in idxs]
 
-        fields = [row[idx] for idx in idxs]
-        nw = Network(*fields)
-        if nw.name not in IGNORE_SSIDS:
-            networks.append(nw)
-
-        if verbosity >= 1:
-            print "  -", nw
-
-    if verbosity >= 2: print "Processing clients now."
-
+def iter_client_rows(csvf, verbosity=0):
+    """ Yields the raw [ Station MAC, BSSID, Probed ESSIDs ] fields of clients.
+    """
     reader = csv.reader(csvf, skipinitialspace=True)
-    columns = next(reader)
+    columns = next(reader, None)
+    if not columns: return
 
     #
     # The client columns we are interested in are:
-    #   - BSSID:            the MAC address of the client
-    #   - Station MAC:      the MAC address of the network that the client is
+    #   - Station MAC:      the MAC address of the client
+    #   - BSSID:            the MAC address of the network that the client is
     #                       connected to, if any (non-disassociated).
     #   - Probed ESSIDs:    the readable name of the AP, if any.
     #
-    idxs = [columns.index(s) for s in ["BSSID", "Station MAC", "Probed ESSIDs"]]
+    idxs = [columns.index(s) for s in ["Station MAC", "BSSID", "Probed ESSIDs"]]
 
     for row in reader:
         if not row: break
-
-        fields = [row[idx] for idx in idxs]
-        cli = Client(*fields)
-        clients.append(cli)
-
-        if verbosity >= 1:
-            print "  -", cli
-
-    return networks, clients
+        yield [row[idx] for idx in idxs]
 
 
 def filter_open_networks(network_list):
     """ Finds all of the networks with no security.
     """
-    return filter(lambda x: x.security == "OPN", network_list)
+    return list(ifilter_open_networks(network_list))
 
 def filter_signal_threshold(network_list, min_sig, max_sig):
     """ Filters all networks outside of a certain signal strength.
     """
-    return filter(lambda x: x.signal >= min_sig and x.signal <= max_sig, network_list)
+    return list(ifilter_signal_threshold(network_list, min_sig, max_sig))
 
 def filter_duplicate_names(network_list, max_dupes=1):
-    filtered = collections.defaultdict(list)
-    for nw in network_list:
-        results = filtered[nw.name]
+    """ Keeps only the strongest few networks sharing each name.
+    """
+    return list(ifilter_duplicate_names(network_list, max_dupes))
+
+def ifilter_open_networks(networks):
+    """ Lazily finds all of the networks with no security.
+    """
+    return itertools.ifilter(lambda x: x.security == "OPN", networks)
+
+def ifilter_signal_threshold(networks, min_sig, max_sig):
+    """ Lazily filters all networks outside of a certain signal strength.
+    """
+    return itertools.ifilter(lambda x: x.signal >= min_sig and x.signal <= max_sig,
+        networks)
 
-        # We always add up to the maximum.
-        if len(results) < max_dupes:
-            results.append(nw)
+def ifilter_duplicate_names(networks, max_dupes=1):
+    """ Lazily keeps only the strongest few networks sharing each name.
 
-        # Otherwise, only add if it's a better network, replacing last.
-        elif nw.signal > max([n.signal for n in filtered[nw.name]]):
-            results[-1] = nw
+    The winners for a name can't be known until every network has been seen,
+    so nothing is yielded before the input is exhausted, but at most
+    `max_dupes` networks per name are ever held onto.
+    """
+    return _strongest_by_name(networks, max_dupes)
+
+def filter_networks(networks, open_only=False, min_sig=None, max_sig=None,
+                    ignore=(), max_dupes=1):
+    """ Applies any combination of the network filters in a single pass.
+
+    This is equivalent to chaining `filter_open_networks`,
+    `filter_signal_threshold` and `filter_duplicate_names` (and skipping
+    ignored names), but looks at every network exactly once and holds onto no
+    more than `max_dupes` networks per name while doing so.
+
+    :networks           an iterable of Network() objects
+    :open_only[=False]  only keep networks with no security
+    :min_sig[=None]     the minimum signal strength to keep, if any
+    :max_sig[=None]     the maximum signal strength to keep, if any
+    :ignore[=()]        network names to drop outright
+    :max_dupes[=1]      how many of the strongest networks to keep per name
+    :returns            a list of the surviving Network() objects, grouped by
+                        name, strongest first
+    """
+    ignore = frozenset(ignore)
 
-        filtered[nw.name] = sorted(results, key=lambda x: x.signal, reverse=True)
+    def keep(nw):
+        if open_only and nw.security != "OPN": return False
+        if min_sig is not None and nw.signal < min_sig: return False
+        if max_sig is not None and nw.signal > max_sig: return False
+        return nw.name not in ignore
 
-    return sum(filtered.values(), [])
+    return list(_strongest_by_name(itertools.ifilter(keep, networks), max_dupes))
+
+def _strongest_by_name(networks, max_dupes):
+    """ Selects the top `max_dupes` networks by signal for each name.
+
+    Each name gets a min-heap of its best networks so far, so each network
+    costs O(log max_dupes). Ties go to whichever network was seen first.
+    """
+    if max_dupes < 1: return
+
+    heaps = {}  # dict -> { name: [ (signal, -order, Network()) ] }
+    for order, nw in enumerate(networks):
+        heap = heaps.get(nw.name)
+        if heap is None:
+            heap = heaps[nw.name] = []
+
+        entry = (nw.signal, -order, nw)
+        if len(heap) < max_dupes:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    for heap in heaps.itervalues():
+        heap.sort(reverse=True)
+        for entry in heap:
+            yield entry[2]
 
 if __name__ == "__main__":
+    import geocache     # only here, since it loads sqlite3
+
     parser = argparse.ArgumentParser(description=
         "Extracts all open networks from an airodump-ng capture file.")
     parser.add_argument("-f", "--filename", metavar="FNAME", help="capture to extract from")
@@ -265,16 +731,44 @@ if __name__ == "__main__":
         help="include the location information for each network")
     parser.add_argument("--fallback", action="store_true",
         help="when combined with -l, specifies that geoip should also be used")
+    parser.add_argument("--cache", metavar="PATH", default=geocache.DEFAULT_PATH,
+        help="where to keep previously resolved locations (default: %(default)s)")
+    parser.add_argument("--no-cache", dest="cache", action="store_const", const=None,
+        help="always ask the geolocation APIs, without caching their answers")
+    parser.add_argument("--cache-ttl", metavar="SEC", type=int,
+        default=geocache.LocationCache.TTL,
+        help="how long a resolved location is remembered")
+    parser.add_argument("--negative-ttl", metavar="SEC", type=int,
+        default=geocache.LocationCache.NEGATIVE_TTL,
+        help="how long a network without a known location is remembered")
+    parser.add_argument("--cache-size", metavar="N", type=int,
+        default=geocache.LocationCache.MAX_ENTRIES,
+        help="the most locations to remember, evicting the least recently used")
+    parser.add_argument("-j", "--jobs", metavar="N", type=int, default=8,
+        help="with -l, how many locations to look up concurrently")
+    parser.add_argument("--rate", metavar="N", type=float, default=10,
+        help="with -l, the most geolocation requests to make per second")
     parser.add_argument("-v", dest="v", default=0,
         action="count", help="configures level of output")
 
     args = parser.parse_args()
 
+    cache = None
+    if args.cache and (args.address or args.loc):
+        cache = geocache.LocationCache(os.path.expanduser(args.cache),
+            ttl=args.cache_ttl, negative_ttl=args.negative_ttl,
+            max_entries=args.cache_size)
+        atexit.register(cache.close)
+        if args.v >= 2:
+            atexit.register(lambda: sys.stdout.write("Location cache: %s\n" % (
+                ", ".join(["%s=%d" % kv for kv in sorted(cache.stats().items())]))))
+
     if args.address:
         # 04:DA:D2:1E:B2:02
         loc = Network(args.address, "", "", 0).get_location(
             fallback=args.fallback,
-            verbosity=args.v)
+            verbosity=args.v,
+            cache=cache)
 
         sys.exit(os.EX_DATAERR if loc["location"] is None else 0)
 
@@ -291,17 +785,23 @@ if __name__ == "__main__":
             sys.exit(os.EX_NOINPUT)
 
         with open(fname, "r") as f:
-            nw, cli = parse_csv(f, args.v)
+            index = {}
+            nw = iter_networks(f, args.v, index)
             if args.open:
-                nw = get_open_networks(nw)
-
-            for n in nw:
-                if n.name in args.exclude:
-                    continue
-
+                nw = ifilter_open_networks(nw)
+
+            nw = itertools.ifilter(lambda n: n.name not in args.exclude, nw)
+            if args.loc:
+                import geolocate
+                nw = geolocate.resolve_locations(nw, workers=args.jobs,
+                    rate=args.rate, fallback=args.fallback, verbosity=args.v,
+                    cache=cache)
+            else:
+                nw = ((n, None) for n in nw)
+
+            for n, location in nw:
                 print "%s | %s[%s]" % (n.mac, n.name, n.security)
                 if args.loc:
-                    location = n.get_location(fallback=args.fallback, verbosity=args.v)
                     if not location or location["location"] is None:
                         print "  (no location found)"
                         continue
@@ -309,12 +809,12 @@ if __name__ == "__main__":
                     print "  (%f, %f) [accuracy=%f]" % (
                         location["location"]["lat"],
                         location["location"]["lng"],
-                        location["accuracy"]["lng"])
+                        location["accuracy"])
 
             if args.clients:
-                for c in cli:
+                for c in iter_clients(f, args.v, index):
                     print "%s [connected-to=%s|%s" % (
-                        c.mac, c.network.mac, c.network_name)
+                        c.mac, c.network, c.network_name)
 
     else:
         print "Must choose one of --filename or --address."
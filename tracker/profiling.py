@@ -0,0 +1,274 @@
+""" Opt-in timing of named stages, reported as JSON lines.
+
+Code marks out its stages with `stage`:
+
+    with profiling.stage("parse"):
+        ...
+
+which costs next to nothing unless there is a Profile() to record into:
+either the running thread's own (see `recording`), or one shared by the
+whole process (see `share`). A Profile() adds up the wall-clock and CPU
+time of each stage and how many times it ran, and a Report() appends it to
+a file as a line of JSON:
+
+    {"cycle": 3, "time": 1500000000.0, "wall": 21.43,
+     "stages": {"sniff": {"wall": 15.02, "cpu": 0.03, "calls": 1}, ...}}
+
+CPU time is that of the running thread where the platform can tell
+(Linux), and that of the whole process otherwise. Stages may be nested,
+and each is timed in full: an outer stage's time includes its inner ones'.
+
+Separately, once `profile_calls` has been called, `call` runs functions
+under cProfile, with one profiler per thread (cProfile only ever sees the
+thread it was started on); `dump_calls` merges them into one pstats file.
+"""
+import sys
+import time
+import threading
+import contextlib
+
+_local = threading.local()
+_shared = None          # the Profile() of threads without one of their own
+
+_profilers = []         # a cProfile.Profile() per thread that used `call`
+_profilers_lock = threading.Lock()
+_profile_calls = False
+
+cpu_time = None         # seconds of CPU used by the running thread
+
+
+class Profile(object):
+    """ The time spent in each stage over some stretch of work, such as one
+    scan. Stages may be recorded from any number of threads.
+    """
+    def __init__(self, **fields):
+        """ Starts an empty profile.
+
+        :fields     constant values to report along with the timings, such as
+                    which scan they are for
+        """
+        _init_cpu_time()
+        self.fields = fields
+        self.started = time.time()
+        self.stages = {}    # dict -> { stage: [ wall, cpu, calls ] }
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        """ Returns a context manager that times a stage into this profile. """
+        return _Stage(self, name)
+
+    def add(self, name, wall, cpu):
+        with self.lock:
+            totals = self.stages.get(name)
+            if totals is None:
+                totals = self.stages[name] = [0.0, 0.0, 0]
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += 1
+
+    def wall(self, name):
+        """ Returns the wall-clock seconds spent in a stage so far. """
+        with self.lock:
+            return self.stages.get(name, (0.0,))[0]
+
+    def report(self):
+        """ Returns the profile as a dictionary, ready to be dumped as JSON. """
+        report = dict(self.fields)
+        report["time"] = self.started
+        report["wall"] = round(time.time() - self.started, 6)
+        with self.lock:
+            report["stages"] = dict([(name, { "wall": round(wall, 6),
+                "cpu": round(cpu, 6), "calls": calls })
+                for name, (wall, cpu, calls) in self.stages.iteritems()])
+        return report
+
+
+class _Stage(object):
+    __slots__ = ("profile", "name", "wall", "cpu")
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.cpu = cpu_time()
+
+    def __exit__(self, *exc_info):
+        self.profile.add(self.name, time.time() - self.wall,
+            cpu_time() - self.cpu)
+
+
+class _NoStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """ Times a stage into the running thread's profile, if there is one.
+
+    Example usage:
+
+        with profiling.stage("filter"):
+            networks = filter_networks(networks)
+    """
+    profile = getattr(_local, "profile", None) or _shared
+    return profile.stage(name) if profile is not None else NO_STAGE
+
+@contextlib.contextmanager
+def recording(profile):
+    """ Makes stages on this thread go to a profile, for the duration. """
+    previous = getattr(_local, "profile", None)
+    _local.profile = profile
+    try:
+        yield profile
+    finally:
+        _local.profile = previous
+
+def share(profile):
+    """ Makes stages on threads without a profile of their own go to this
+    one (or nowhere, given None), returning the one shared before.
+    """
+    global _shared
+    previous, _shared = _shared, profile
+    return previous
+
+
+class Report(object):
+    """ Appends profiles to a file, one JSON object per line.
+    """
+    def __init__(self, path):
+        """ :path   the file to append to, or "-" for stdout """
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, profile):
+        import json     # only needed once profiling, see the tracker's imports
+        line = json.dumps(profile.report(), sort_keys=True) + "\n"
+
+        with self.lock:
+            if self.path == "-":
+                sys.stdout.write(line)
+                sys.stdout.flush()
+            else:
+                with open(self.path, "a") as f:
+                    f.write(line)
+
+
+class ReportThread(threading.Thread):
+    """ Profiles a long-running process in fixed intervals.
+
+    A fresh Profile() is shared with the whole process every `interval`
+    seconds, and the previous one written out. A last one is written when
+    the thread is stopped.
+    """
+    def __init__(self, report, interval=10, fields=None):
+        """ Prepares to profile; call `start` to begin.
+
+        :report         the Report() to write to
+        :interval[=10]  seconds covered by each profile
+        :fields[=None]  a dictionary of constant values to add to each
+                        profile, like which process it came from
+        """
+        super(ReportThread, self).__init__(name="ReportThread")
+        self.setDaemon(True)
+
+        self.report = report
+        self.interval = interval
+        self.fields = fields or {}
+        self.stopped = threading.Event()
+        self.cycle = 0
+        share(self._next())
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report.write(share(self._next()))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.report.write(share(None))
+
+    def _next(self):
+        self.cycle += 1
+        return Profile(cycle=self.cycle, **self.fields)
+
+
+def profile_calls():
+    """ Makes `call` run functions under cProfile from now on. """
+    global _profile_calls
+    _profile_calls = True
+
+def call(fn, *args, **kwargs):
+    """ Calls a function, under this thread's cProfile profiler if
+    `profile_calls` has been called.
+    """
+    if not _profile_calls or getattr(_local, "calling", False):
+        return fn(*args, **kwargs)
+
+    profiler = getattr(_local, "profiler", None)
+    if profiler is None:
+        import cProfile
+        profiler = _local.profiler = cProfile.Profile()
+        with _profilers_lock:
+            _profilers.append(profiler)
+
+    # A nested `runcall` would stop the profiler as it returned.
+    _local.calling = True
+    try:
+        return profiler.runcall(fn, *args, **kwargs)
+    finally:
+        _local.calling = False
+
+def dump_calls(path):
+    """ Writes what every thread's profiler has seen to a pstats file.
+
+    :returns    False if nothing was profiled
+    """
+    import pstats
+    with _profilers_lock:
+        if not _profilers:
+            return False
+
+        stats = pstats.Stats(_profilers[0])
+        for profiler in _profilers[1:]:
+            stats.add(profiler)
+    stats.dump_stats(path)
+    return True
+
+
+def _init_cpu_time():
+    """ Picks the best clock there is for `cpu_time`. """
+    global cpu_time
+    if cpu_time is not None:
+        return
+
+    cpu_time = time.clock   # the whole process's, on Unix
+    try:
+        import ctypes
+
+        class timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+        CLOCK_THREAD_CPUTIME_ID = 3     # from Linux's <time.h>
+        clock_gettime = ctypes.CDLL(None).clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        if clock_gettime(CLOCK_THREAD_CPUTIME_ID, ctypes.byref(timespec())):
+            return
+
+        def thread_time():
+            now = timespec()
+            clock_gettime(CLOCK_THREAD_CPUTIME_ID, ctypes.byref(now))
+            return now.tv_sec + now.tv_nsec * 1e-9
+        cpu_time = thread_time
+
+    except (ImportError, OSError, AttributeError):
+        pass
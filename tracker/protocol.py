@@ -0,0 +1,309 @@
+""" The wire format spoken between trackers and the correlation server.
+
+Version 1 is the original text format, one frame per network:
+
+    <bssid>|<mac>;<mac>;...\x00
+
+Version 2 frames are binary and length-prefixed, carrying any number of
+networks at once:
+
+    +-------------+-----------+------------------+--------------------+
+    | version (1) | flags (1) | length (4, u32)  | body (length)      |
+    +-------------+-----------+------------------+--------------------+
+
+The body of a report is a network count (u16), followed by each network's
+6-byte BSSID, its client count (u16) and that many 6-byte client MACs. All
+integers are big-endian. If `FLAG_ZLIB` is set, the body is zlib-compressed.
+
+Other kinds of version 2 frames are told apart by their flags:
+
+    FLAG_KEEPALIVE  an empty report, telling the server the tracker is alive
+    FLAG_HELLO      the body is the tracker's node id, identifying whoever is
+                    on the other end of the connection; once a tracker has
+                    said hello, each of its reports is a full snapshot that
+                    replaces whatever the server knew about that node
+    FLAG_DELTA      the body is two network lists, like a report's: what was
+                    added since the previous report, then what was removed;
+                    a removed network with no clients listed is gone entirely
+    FLAG_ECHO       the body is an opaque token, which the server sends back
+                    in an echo frame of its own once it has handled every
+                    frame sent before it on that connection; this measures
+                    how long a tracker's reports take to be ingested
+
+A version 1 frame always begins with a printable character, so the version
+byte alone tells the server how to frame and decode whatever comes next, and
+old trackers keep working against a new server.
+"""
+import zlib
+import struct
+import binascii
+
+VERSION_TEXT = 1
+VERSION_BINARY = 2
+
+EOB = b'\x00'           # terminates a version 1 frame
+
+FLAG_ZLIB = 0x01        # the body is zlib-compressed
+FLAG_HELLO = 0x02       # the body is the sender's node id
+FLAG_DELTA = 0x04       # the body is a report's changes, see `diff`
+FLAG_KEEPALIVE = 0x08   # the (empty) report only proves the sender is alive
+FLAG_ECHO = 0x10        # the body is a token for the server to send back
+
+REPORT, HELLO, DELTA, KEEPALIVE, ECHO = "report", "hello", "delta", \
+    "keepalive", "echo"
+
+HEADER = struct.Struct("!BBI")
+COUNT = struct.Struct("!H")
+MAC_SIZE = 6
+
+COMPRESS_THRESHOLD = 512    # bodies smaller than this are never compressed
+
+
+class ProtocolError(ValueError):
+    """ Raised when a frame can't be encoded or decoded.
+    """
+
+
+def pack_mac(mac):
+    """ Packs a textual MAC address ("aa:bb:cc:dd:ee:ff") into 6 bytes.
+    """
+    digits = mac.strip().replace(':', '').replace('-', '')
+    if len(digits) != MAC_SIZE * 2:
+        raise ProtocolError("invalid MAC address: %r" % mac)
+
+    try:
+        return binascii.unhexlify(digits)
+    except (TypeError, binascii.Error):
+        raise ProtocolError("invalid MAC address: %r" % mac)
+
+def unpack_mac(raw):
+    """ Unpacks 6 bytes into a lowercase, colon-separated MAC address.
+    """
+    digits = binascii.hexlify(raw)
+    return ':'.join([digits[i:i + 2] for i in xrange(0, len(digits), 2)])
+
+def is_binary(frame):
+    """ Returns whether or not a frame (or buffer) starts a version 2 frame.
+    """
+    return bool(frame) and bytearray(frame[:1])[0] == VERSION_BINARY
+
+def encode(networks, version=VERSION_BINARY, compress=True):
+    """ Serializes the clients seen on each network for transmission.
+
+    :networks           an iterable of (bssid, [ client MACs ]) pairs
+    :version[=2]        the protocol version to speak
+    :compress[=True]    whether or not large version 2 bodies may be
+                        zlib-compressed
+
+    :returns            the bytes to write to the server; for version 1 this
+                        is one frame per network, for version 2 one frame
+    """
+    if version == VERSION_TEXT:
+        return ''.join(["%s|%s%s" % (bssid.replace(':', ''), ';'.join(macs), EOB)
+            for bssid, macs in networks])
+
+    elif version != VERSION_BINARY:
+        raise ProtocolError("unsupported protocol version: %r" % version)
+
+    return _frame(_pack_networks(networks), 0, compress)
+
+def encode_delta(added, removed, compress=True):
+    """ Serializes the changes between two reports, see `diff`.
+
+    :added              (bssid, [ client MACs ]) pairs that appeared
+    :removed            (bssid, [ client MACs ]) pairs that went away, where
+                        no MACs at all means the whole network is gone
+    :compress[=True]    whether or not a large body may be compressed
+
+    :returns            a single version 2 frame
+    """
+    return _frame(_pack_networks(added) + _pack_networks(removed),
+        FLAG_DELTA, compress)
+
+def hello(node_id):
+    """ Returns a frame identifying the sender as a (persistent) node.
+    """
+    if isinstance(node_id, unicode):
+        node_id = node_id.encode("utf-8")
+    if not node_id:
+        raise ProtocolError("empty node id")
+    return _frame(node_id, FLAG_HELLO, compress=False)
+
+def keepalive():
+    """ Returns an empty version 2 frame, telling the server we're still here.
+    """
+    return _frame(_pack_networks([]), FLAG_KEEPALIVE, compress=False)
+
+def echo(token):
+    """ Returns a frame asking the server to send a token back once it has
+    handled everything before it. Servers answer with the frame itself.
+    """
+    return _frame(token, FLAG_ECHO, compress=False)
+
+def diff(old, new):
+    """ Determines what changed between two reports.
+
+    :old, new   dictionaries of { bssid: set([ client MACs ]) }
+    :returns    an (added, removed) pair, suitable for `encode_delta`
+    """
+    added, removed = [], []
+    for bssid, macs in new.iteritems():
+        before = old.get(bssid)
+        if before is None:
+            added.append((bssid, sorted(macs)))
+            continue
+
+        if macs - before:
+            added.append((bssid, sorted(macs - before)))
+        if before - macs:
+            removed.append((bssid, sorted(before - macs)))
+
+    removed.extend([(bssid, []) for bssid in old if bssid not in new])
+    return added, removed
+
+def apply_delta(state, added, removed):
+    """ Updates a report in place with changes from `diff` (or `decode_delta`).
+
+    :state      a dictionary of { bssid: set([ client MACs ]) }
+    """
+    for bssid, macs in removed:
+        if not macs:
+            state.pop(bssid, None)
+        elif bssid in state:
+            state[bssid].difference_update(macs)
+
+    for bssid, macs in added:
+        state.setdefault(bssid, set()).update(macs)
+
+def _pack_networks(networks):
+    parts, count = [], 0
+    for bssid, macs in networks:
+        macs = list(macs)
+        if len(macs) > 0xFFFF:
+            raise ProtocolError("too many clients on %s" % bssid)
+
+        parts.append(pack_mac(bssid))
+        parts.append(COUNT.pack(len(macs)))
+        parts.extend([pack_mac(mac) for mac in macs])
+        count += 1
+
+    if count > 0xFFFF:
+        raise ProtocolError("too many networks in one frame")
+    return COUNT.pack(count) + ''.join(parts)
+
+def _frame(body, flags, compress):
+    if compress and len(body) >= COMPRESS_THRESHOLD:
+        packed = zlib.compress(body)
+        if len(packed) < len(body):
+            body, flags = packed, flags | FLAG_ZLIB
+
+    return HEADER.pack(VERSION_BINARY, flags, len(body)) + body
+
+def frame_size(buf, start=0):
+    """ Determines the full size of the version 2 frame starting in a buffer.
+
+    :buf        a buffer whose byte at `start` is a version 2 version byte
+    :start[=0]  the offset of the frame within the buffer
+
+    :returns    the total size of the frame (header included), or None if
+                the header hasn't been completely received yet
+    """
+    if len(buf) - start < HEADER.size:
+        return None
+    return HEADER.size + HEADER.unpack_from(buf, start)[2]
+
+def kind(frame):
+    """ Returns what a complete frame is: REPORT, HELLO, DELTA, KEEPALIVE or
+    ECHO.
+    """
+    if not is_binary(frame):
+        return REPORT
+    if len(frame) < HEADER.size:
+        raise ProtocolError("truncated frame header")
+
+    flags = HEADER.unpack_from(frame)[1]
+    if flags & FLAG_HELLO:
+        return HELLO
+    if flags & FLAG_DELTA:
+        return DELTA
+    if flags & FLAG_KEEPALIVE:
+        return KEEPALIVE
+    if flags & FLAG_ECHO:
+        return ECHO
+    return REPORT
+
+def decode(frame):
+    """ Parses a complete report (or keepalive) frame of either version.
+
+    :frame      a version 1 frame without its terminator, or a full version 2
+                frame (header included)
+
+    :returns    a list of (bssid, [ client MACs ]) pairs
+    """
+    if not is_binary(frame):
+        try:
+            bssid, macs = frame.split('|')
+        except ValueError:
+            raise ProtocolError("malformed text frame: %r" % frame[:64])
+        return [(bssid, [mac for mac in macs.split(';') if mac])]
+
+    body = _body(frame)
+    networks, offset = _unpack_networks(body, 0)
+    return networks
+
+def decode_delta(frame):
+    """ Parses a complete delta frame into its (added, removed) networks.
+    """
+    body = _body(frame)
+    added, offset = _unpack_networks(body, 0)
+    removed, offset = _unpack_networks(body, offset)
+    return added, removed
+
+def decode_hello(frame):
+    """ Parses a complete hello frame into the sender's node id.
+    """
+    return _body(frame)
+
+def decode_echo(frame):
+    """ Parses a complete echo frame into its token.
+    """
+    return _body(frame)
+
+def _body(frame):
+    if len(frame) < HEADER.size:
+        raise ProtocolError("truncated frame header")
+
+    _, flags, length = HEADER.unpack_from(frame)
+    body = frame[HEADER.size:]
+    if len(body) != length:
+        raise ProtocolError("expected %d body bytes, got %d" % (length, len(body)))
+
+    if flags & FLAG_ZLIB:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error, e:
+            raise ProtocolError("corrupt compressed body: %s" % e)
+    return body
+
+def _unpack_networks(body, offset):
+    try:
+        networks = []
+        count = COUNT.unpack_from(body, offset)[0]
+        offset += COUNT.size
+        for _ in xrange(count):
+            bssid = unpack_mac(body[offset:offset + MAC_SIZE])
+            count = COUNT.unpack_from(body, offset + MAC_SIZE)[0]
+            offset += MAC_SIZE + COUNT.size
+
+            end = offset + count * MAC_SIZE
+            if end > len(body):
+                raise ProtocolError("truncated client list for %s" % bssid)
+
+            networks.append((bssid, [unpack_mac(body[i:i + MAC_SIZE])
+                for i in xrange(offset, end, MAC_SIZE)]))
+            offset = end
+
+    except struct.error, e:
+        raise ProtocolError("truncated frame body: %s" % e)
+
+    return networks, offset
@@ -1,16 +1,26 @@
 #!/usr/bin/python2
 import subprocess as sub
+import threading
+import Queue
 import argparse
+import socket
+import struct
 import time
 import sys
 import os
 
+import log
+import protocol
+import profiling
 import networkparser
 
+from log import write, writeln, lazy
 
+
+MASTER = ("localhost", 0xC1A)
 CAPTURE_PREFIX = "captures/cap"
+SPOOL_DIR = "spool"
 SNIFFER_TIME = 15
-VERBOSITY = 1   # 0: nothing, 1: normal, 2: extra, 3: all
 
 
 class PromiscuousAdapter(object):
@@ -22,12 +32,14 @@ class PromiscuousAdapter(object):
 
     def __enter__(self):
         writeln(3, "Configuring", self.iface, "for monitor mode.")
-        run("./monitor.sh %s start" % self.iface)
+        with profiling.stage("monitor_start"):
+            run("./monitor.sh %s start" % self.iface)
         return self.ifacemon
 
     def __exit__(self, type, value, traceback):
         writeln(3, "Configuring", self.ifacemon, "out of monitor mode.")
-        run("./monitor.sh %s stop" % self.ifacemon)
+        with profiling.stage("monitor_stop"):
+            run("./monitor.sh %s stop" % self.ifacemon)
 
 
 class Progress(object):
@@ -51,14 +63,550 @@ class Progress(object):
         writeln(self.v, "done.")
 
 
-def writeln(v, *args):
-    args = list(args) + [ "\n" ]
-    write(v, *args)
+class Spool(object):
+    """ An append-only queue of frames on disk, for when the server is away.
+
+    Frames are appended to numbered segment files in a directory. Once a
+    segment grows past `segment_size` it is sealed and a new one started, and
+    sealed segments are deleted as soon as everything in them has been read
+    and handed to the server. If the spool outgrows `max_size`, the oldest
+    segments are evicted (whether or not they've been sent) to make room.
+
+    Segments left behind by a previous run are sent first, from the start,
+    so a segment that was partly sent before a restart is sent again. The
+    same goes for the segment being read when `rewind` is called.
+
+    Example usage:
+
+        spool = Spool("spool")
+        spool.append(frame)
+
+        data, cursor = spool.read(65536)
+        if data and send(data):
+            spool.consume(cursor)
+    """
+    SEGMENT_SIZE = 1024 * 1024      # bytes per segment before a new one starts
+    MAX_SIZE = 64 * 1024 * 1024     # bytes on disk before segments are evicted
+    RECORD = struct.Struct("!I")    # each frame is prefixed by its length
+
+    def __init__(self, path, segment_size=SEGMENT_SIZE, max_size=MAX_SIZE):
+        """ Opens the spool in a directory, creating it if necessary.
+
+        :path                   the directory to keep segments in
+        :segment_size[=1MiB]    size at which a segment is sealed
+        :max_size[=64MiB]       total size at which the oldest segments are
+                                evicted
+        """
+        if not os.path.exists(path): os.makedirs(path)
+        self.path = path
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+        # dict -> { segment number: size in bytes }
+        self.sizes = dict([(int(fn[:-4]), os.path.getsize(os.path.join(path, fn)))
+            for fn in os.listdir(path) if fn.endswith(".seg") and fn[:-4].isdigit()])
+        self.segments = sorted(self.sizes)
+        self.total = sum(self.sizes.values())
+        self.evicted = 0
+
+        self.writer = None
+        self._open(self.segments[-1] + 1 if self.segments else 0)
+        self.read_seq, self.read_pos = self.segments[0], 0
+        if len(self.segments) > 1:
+            writeln(1, "Found %d bytes spooled by a previous run." % self.total)
+
+    @property
+    def backlog(self):
+        """ The number of bytes spooled but not yet read. """
+        with self.lock:
+            return self.total - self.read_pos
+
+    def append(self, frame):
+        """ Adds a frame to the end of the spool.
+
+        :returns    whether the frame filled its segment, so that the next
+                    one goes to a fresh segment
+        """
+        record = self.RECORD.pack(len(frame)) + frame
+        with self.lock:
+            seq = self.segments[-1]
+            try:
+                self.writer.write(record)
+                self.writer.flush()
+            except (IOError, OSError):
+                # Don't leave a partial record behind (e.g. on a full disk).
+                self.writer.truncate(self.sizes[seq])
+                self.writer.seek(self.sizes[seq])
+                raise
+
+            self.sizes[seq] += len(record)
+            self.total += len(record)
+
+            sealed = self.sizes[seq] >= self.segment_size
+            if sealed:
+                self._open(seq + 1)
+            self._evict()
+            return sealed
+
+    def read(self, max_bytes):
+        """ Reads whole frames from the front of the spool, without removing
+        them.
+
+        :max_bytes  how much to read at most, unless the first frame alone is
+                    larger
+        :returns    a (data, cursor) pair, where data is the frames run
+                    together ("" if there's nothing left) and the cursor is
+                    for `consume`
+        """
+        with self.lock:
+            while True:
+                seq, pos = self.read_seq, self.read_pos
+                if pos >= self.sizes[seq]:
+                    if seq == self.segments[-1]:
+                        return "", None
+                    self._remove_head()
+                    continue
+
+                frames, size = self._read_frames(seq, pos, max_bytes)
+                if frames:
+                    return ''.join(frames), (seq, pos + size)
+
+    def _read_frames(self, seq, pos, max_bytes):
+        """ Reads frames from a segment, returning them and the bytes they
+        took up there. """
+        frames, size, end = [], 0, self.sizes[seq]
+        with open(self._path(seq), "rb") as f:
+            f.seek(pos)
+            while pos + size < end and (not frames or size < max_bytes):
+                header = f.read(self.RECORD.size)
+                length = self.RECORD.unpack(header)[0] \
+                    if len(header) == self.RECORD.size else -1
+                frame = f.read(length) if length >= 0 else ""
+                if len(frame) != length:
+                    # Cut short by a crash while being written; the rest of
+                    # this segment can't be read.
+                    writeln(1, "Skipping the damaged end of a spool segment.")
+                    self.total -= end - (pos + size)
+                    self.sizes[seq] = pos + size
+                    break
+
+                frames.append(frame)
+                size += self.RECORD.size + length
+        return frames, size
+
+    def consume(self, cursor):
+        """ Removes what a `read` returned, once it has been sent. """
+        with self.lock:
+            seq, pos = cursor
+            if seq != self.read_seq:
+                return  # evicted in the meantime
+            self.read_pos = pos
+            if pos >= self.sizes[seq] and seq != self.segments[-1]:
+                self._remove_head()
+
+    def rewind(self):
+        """ Starts reading the current segment over, from its first frame. """
+        with self.lock:
+            self.read_pos = 0
+
+    def close(self):
+        with self.lock:
+            self.writer.close()
+
+    def _path(self, seq):
+        return os.path.join(self.path, "%012d.seg" % seq)
+
+    def _open(self, seq):
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = open(self._path(seq), "ab")
+        self.segments.append(seq)
+        self.sizes[seq] = 0
+
+    def _remove_head(self):
+        seq = self.segments.pop(0)
+        self.total -= self.sizes.pop(seq)
+        os.remove(self._path(seq))
+        self.read_seq, self.read_pos = self.segments[0], 0
+
+    def _evict(self):
+        while self.total > self.max_size and len(self.segments) > 1:
+            unread = self.sizes[self.segments[0]]
+            if self.segments[0] == self.read_seq:
+                unread -= self.read_pos
+            self._remove_head()
+            self.evicted += 1
+            writeln(1, "Spool is full, dropped %d unsent bytes." % unread)
+
+
+class Uplink(object):
+    """ A long-lived connection to the master server, reused across scans.
+
+    Every scan's results are coalesced into a single write. If the server
+    can't be reached, reconnection is attempted on subsequent writes, backing
+    off exponentially between attempts. While idle, keepalives are sent so
+    that the server can tell a dead tracker from a quiet one.
+
+    Given a node id, the uplink introduces itself on every connection and
+    then only sends what changed since the previous scan, with a full
+    snapshot every `snapshot_every` scans. A snapshot is also sent first on
+    every new connection, since the server may have lost track of us.
+
+    Given a Spool(), reports are appended to it instead of being written
+    directly, and a background thread drains it to the server in large
+    writes whenever the server can be reached. Sending a report then never
+    waits on the network, and reports from an outage are caught up on at
+    full speed once it ends. Each segment of the spool starts with a
+    snapshot, so that evicting the oldest ones can't leave the server
+    applying changes to a state it never received. For the same reason, a
+    new connection sends the segment being read over from its snapshot,
+    rather than picking up in the middle of its deltas.
+
+    Example usage:
+
+        uplink = Uplink(("localhost", 0xC1A), node_id="roof")
+        while scanning:
+            uplink.send(network_dump)
+        uplink.close()
+    """
+    TIMEOUT = 10        # how long to wait on connects and writes
+    BACKOFF_MIN = 1     # first delay after a failed connection, in seconds
+    BACKOFF_MAX = 300   # longest delay between reconnection attempts
+    KEEPALIVE = 15      # idle seconds before a keepalive is sent, 0 disables
+    SNAPSHOT_EVERY = 30 # every how many scans a full snapshot is sent
+    FLUSH_BATCH = 256 * 1024    # bytes of spooled frames per write
+    FLUSH_POLL = 1      # seconds between attempts to drain the spool
+
+    def __init__(self, master, version=protocol.VERSION_BINARY,
+                 keepalive=KEEPALIVE, node_id=None,
+                 snapshot_every=SNAPSHOT_EVERY, spool=None):
+        """ Prepares an uplink; nothing is connected until the first write.
+
+        :master                 the server's (address, port)
+        :version[=2]            the protocol version to speak
+        :keepalive[=15]         idle seconds before a keepalive is sent
+        :node_id[=None]         this tracker's identity, which enables delta
+                                reports (version 2 only)
+        :snapshot_every[=30]    every how many scans to send a snapshot
+        :spool[=None]           a Spool() to queue reports in, if any
+        """
+        self.master = master
+        self.version = version
+        self.sock = None
+        self.backoff = 0
+        self.retry_at = 0
+        self.last_write = time.time()
+        self.lock = threading.Lock()
+
+        self.node_id = node_id if version != protocol.VERSION_TEXT else None
+        self.snapshot_every = snapshot_every
+        self.state = None       # the last report handed to the server
+        self.deltas = 0         # deltas sent since the last snapshot
+        self.stale = False      # whether the next report must be a snapshot
+
+        # Version 1 has no way to express an empty report.
+        self.keepalive = keepalive if version != protocol.VERSION_TEXT else 0
+        self.stopped = threading.Event()
+        self.pinger = None
+        if self.keepalive:
+            self.pinger = threading.Thread(name="Keepalive", target=self._ping)
+            self.pinger.setDaemon(True)
+            self.pinger.start()
+
+        self.spool = spool
+        self.pending = threading.Event()
+        self.report_lock = threading.Lock()
+        self.flusher = None
+        if self.spool is not None:
+            self.pending.set()  # whatever a previous run left, right away
+            self.flusher = threading.Thread(name="Flusher", target=self._drain)
+            self.flusher.setDaemon(True)
+            self.flusher.start()
+
+    def send(self, network_dump):
+        """ Sends the clients found on each network in one write.
+
+        :network_dump   a dictionary of { Network(): [ client MACs ] }
+        :returns        whether or not the data was handed to the server (or
+                        the spool)
+        """
+        if not self.node_id:
+            payload = protocol.encode([(nw.mac, network_dump[nw])
+                for nw in network_dump], self.version)
+            return self._submit(lambda: (payload, None))
+
+        report = dict([(nw.mac.lower(), set([mac.lower()
+            for mac in network_dump[nw]])) for nw in network_dump])
+
+        # Whether to send a delta can only be decided once connected, since
+        # connecting may have reset what the server knows.
+        def encode():
+            if self.state is None or self.stale or \
+                    self.deltas + 1 >= self.snapshot_every:
+                self.stale = False
+                writeln(3, "Sending a full snapshot.")
+                return protocol.encode(report.items()), 0
+
+            added, removed = protocol.diff(self.state, report)
+            writeln(3, "Sending %d additions and %d removals." % (
+                len(added), len(removed)))
+            return protocol.encode_delta(added, removed), self.deltas + 1
+
+        def sent(deltas):
+            self.state, self.deltas = report, deltas
+
+        return self._submit(encode, sent)
+
+    def write(self, payload):
+        """ Writes raw bytes to the server, (re)connecting if necessary.
+        """
+        return self._write(lambda: (payload, None))
+
+    def resync(self):
+        """ Makes the next report a full snapshot. """
+        self.stale = True
+
+    def _submit(self, encode, sent=None):
+        """ Appends a report to the spool, or writes it if there's none.
+
+        Takes the same arguments as `_write`.
+        """
+        if self.spool is None:
+            with self.report_lock:
+                return self._write(encode, sent)
+
+        with self.report_lock:
+            with profiling.stage("encode"):
+                payload, result = encode()
+            try:
+                with profiling.stage("spool"):
+                    sealed = self.spool.append(payload)
+            except (IOError, OSError), e:
+                writeln(0, "Couldn't spool report:", str(e))
+                return False
+
+            if sent:
+                sent(result)
+            if sealed:
+                self.resync()   # start the next segment with a snapshot
+
+        self.pending.set()
+        return True
+
+    def _write(self, encode, sent=None):
+        """ Writes to the server, (re)connecting if necessary.
+
+        :encode     called once connected, returning the payload to write and
+                    a value to pass to `sent`
+        :sent       called with that value once the payload is written; both
+                    are called with the lock held
+        """
+        with self.lock:
+            # A connection that has been idle may have died in the meantime,
+            # so a failure on an existing one gets a fresh connection.
+            for attempt in xrange(2):
+                reused = self.sock is not None
+                if not self._connect():
+                    return False
+
+                try:
+                    payload, result = encode()
+                    self.sock.sendall(payload)
+                    self.last_write = time.time()
+                    if sent:
+                        sent(result)
+                    return True
+
+                except socket.error, e:
+                    writeln(1, "Lost connection to master server:", str(e))
+                    self._disconnect()
+                    if not reused:
+                        self._schedule_retry()
+                        return False
+
+            return False
+
+    def close(self):
+        self.stopped.set()
+        self.pending.set()
+        if self.pinger:
+            self.pinger.join(self.TIMEOUT)
+        if self.flusher:
+            self.flusher.join(self.TIMEOUT)
+
+            # One last attempt, so that a single scan still gets sent; what
+            # can't be sent now is left in the spool for the next run.
+            self._flush()
+            self.spool.close()
+        with self.lock:
+            self._disconnect()
+
+    def _drain(self):
+        while not self.stopped.isSet():
+            self.pending.wait(self.FLUSH_POLL)
+            self.pending.clear()
+            if not self.stopped.isSet():
+                self._flush()
+
+    def _flush(self):
+        """ Sends spooled frames until the spool is empty or a write fails.
+        """
+        # Frames are only read once connected, since connecting rewinds the
+        # spool (see `_connect`).
+        def encode():
+            data, cursor = self.spool.read(self.FLUSH_BATCH)
+            return data, (cursor, len(data))
+
+        def sent(result):
+            cursor, size = result
+            if cursor is not None:
+                writeln(3, "Flushed %d spooled bytes." % size)
+                self.spool.consume(cursor)
+
+        while self.spool.backlog:
+            if not self._write(encode, sent):
+                return False
+        return True
+
+    def _connect(self):
+        if self.sock is not None:
+            return True
+        if time.time() < self.retry_at:
+            return False
+
+        writeln(2, "Connecting to master server, %s:%d" % self.master)
+        try:
+            self.sock = socket.create_connection(self.master, self.TIMEOUT)
+            if self.node_id:
+                self.sock.sendall(protocol.hello(self.node_id))
+        except socket.error, e:
+            writeln(1, "Couldn't reach master server:", str(e))
+            self._disconnect()
+            self._schedule_retry()
+            return False
+
+        self.backoff = 0
+        if self.spool is not None and self.node_id:
+            # Spooled reports were encoded before this connection existed,
+            # so start over from the snapshot that leads their segment.
+            self.spool.rewind()
+            self.pending.set()
+        else:
+            self.resync()   # a new connection always starts with a snapshot
+        return True
+
+    def _disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _schedule_retry(self):
+        self.backoff = min(self.BACKOFF_MAX, self.backoff * 2 or self.BACKOFF_MIN)
+        self.retry_at = time.time() + self.backoff
+        writeln(2, "Retrying the master server in %ds." % self.backoff)
+
+    def _ping(self):
+        while not self.stopped.wait(self.keepalive / 3.0):
+            if time.time() - self.last_write >= self.keepalive:
+                writeln(3, "Sending keepalive to master server.")
+                self.write(protocol.keepalive())
+
+
+class Pipeline(object):
+    """ Runs each step of a scan on its own thread, so that steps of
+    consecutive scans overlap.
+
+    Every stage takes what the previous one returned, and hands its result
+    on through a bounded queue: once `depth` results are waiting on a slow
+    stage, the stage before it (and eventually `put`) blocks, rather than
+    piling up scans. Each stage is a single thread, so results come out of
+    the last stage in the order they were put in.
+
+    The time spent in each stage is recorded per scan, in a
+    `profiling.Profile()` (as are any stages marked out within them), and
+    reported once the scan is through the last stage. A scan that fails in
+    some stage is reported and dropped; later scans carry on.
+
+    Example usage:
+
+        pipeline = Pipeline([("parse", parse), ("transmit", send)])
+        for capture in captures:
+            pipeline.put(capture)
+        pipeline.close()
+    """
+    DONE = object()     # tells a stage to pass it on, then stop
+
+    def __init__(self, stages, depth=1, report=None):
+        """ Starts a thread for each stage.
+
+        :stages         a list of (name, function) pairs, in order
+        :depth[=1]      how many results may wait between two stages
+        :report[=None]  called with each scan's Profile() once it's through
+        """
+        self.names = [name for name, _ in stages]
+        self.upstream = []  # stages done before the pipeline, for reporting
+        self.report = report
+        self.queues = [Queue.Queue(depth) for _ in stages]
+        self.threads = []
+        self.count = 0
+        for i, (name, fn) in enumerate(stages):
+            thread = threading.Thread(name=name.capitalize(), target=self._run,
+                args=(name, fn, self.queues[i], self.queues[i + 1]
+                    if i + 1 < len(stages) else None))
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, item, profile=None):
+        """ Feeds an item to the first stage, blocking while it's backed up.
+
+        :profile[=None] a Profile() with the work already done on the item,
+                        to record the pipeline's own stages into
+        """
+        self.count += 1
+        profile = profile or profiling.Profile(cycle=self.count)
+        self.queues[0].put((self.count, time.time(), profile, item))
+        self.upstream = sorted(profile.stages)
+
+    def close(self):
+        """ Waits for every item put so far to make it through. """
+        self.queues[0].put(self.DONE)
+        for thread in self.threads:
+            while thread.isAlive():
+                thread.join(1)  # without a timeout, ^C would be ignored
+
+    def _run(self, name, fn, inbox, outbox):
+        while True:
+            job = inbox.get()
+            if job is self.DONE:
+                if outbox is not None:
+                    outbox.put(job)
+                return
+
+            n, started, profile, item = job
+            try:
+                with profiling.recording(profile), profile.stage(name):
+                    item = profiling.call(fn, item)
+            except Exception, e:
+                writeln(0, "Scan %d failed while in the %s stage: %s" % (
+                    n, name, e))
+                continue
+
+            if outbox is not None:
+                outbox.put((n, started, profile, item))
+            else:
+                self._finish(n, started, profile)
+
+    def _finish(self, n, started, profile):
+        latency = time.time() - started
+        waiting = latency - sum([profile.wall(name) for name in self.names])
+        writeln(2, "Scan %d took %s (%.2fs from capture to sent, %.2fs of it "
+            "queued)." % (n, ", ".join(["%s %.2fs" % (name, profile.wall(name))
+                for name in self.upstream + self.names]), latency, waiting))
+        if self.report:
+            self.report(profile)
 
-def write(v, *args):
-    if VERBOSITY >= v:
-        sys.stdout.write(' '.join(args))
-        sys.stdout.flush()
 
 def run(cmd):
     writeln(3, cmd)
@@ -68,85 +616,167 @@ def run(cmd):
     writeln(3, "stderr:", out[1])
     return out
 
-def scan(operation):
+def latest_capture():
+    """ Finds the latest capture file (by name), or None if there isn't one.
+    """
+    path = os.path.dirname(CAPTURE_PREFIX)
+    if not path: path = os.getcwd()
+    if not os.path.exists(path): os.makedirs(path)
+    name = os.path.basename(CAPTURE_PREFIX)
+
+    writeln(3, "Looking for %s/%s*.csv" % (path, name))
+    with profiling.stage("list_captures"):
+        files = sorted([fn for fn in os.listdir(path) \
+            if fn.startswith(name) and fn.endswith(".csv")])
+    writeln(3, "Available files:", lazy(repr, files))
+    return os.path.join(path, files[-1]) if files else None
+
+def follow_capture(watcher, previous):
+    """ Parses whatever airodump-ng has written since the last call.
+
+    :watcher    the CaptureWatcher returned by the last call, or None
+    :previous   the latest capture file from before airodump-ng was started,
+                so that we don't mistake it for the one being written
+    :returns    a CaptureWatcher, or None if the capture hasn't appeared yet
+    """
+    if watcher is None:
+        filename = latest_capture()
+        if filename is None or filename == previous:
+            return None
+
+        writeln(2, "Parsing network traffic from", filename)
+        watcher = networkparser.CaptureWatcher(filename)
+
+    with profiling.stage("parse_csv"):
+        networks, clients = watcher.poll()
+    if networks or clients:
+        writeln(3, "Found %d new or changed networks and %d clients." % (
+            len(networks), len(clients)))
+    return watcher
+
+def sniff(operation):
+    """ Captures traffic in the vicinity, for `parse`.
+
+    :operation  an interface to sniff on, or the capture file to read
+    :returns    what was captured: the file name, or a snapshot of the
+                capture (None if the sniffer didn't write one)
+    """
     if os.path.exists(operation):
-        filename = operation
+        return operation
+
+    iface = operation
+    writeln(2, iface, "isn't a file, treating it as an interface.")
 
-    else:
-        iface = operation
-        writeln(2, iface, "isn't a file, treating it as an interface.")
+    # The capture is parsed while it's being written, so that there's
+    # little left to do once the sniffer is done.
+    previous, watcher = latest_capture(), None
 
-        with PromiscuousAdapter(iface) as mon:
-            run("screen -dmS dump sudo airodump-ng -o csv -w %s %s" % (
-                CAPTURE_PREFIX, mon))
+    with PromiscuousAdapter(iface) as mon:
+        run("screen -dmS dump sudo airodump-ng -o csv -w %s %s" % (
+            CAPTURE_PREFIX, mon))
 
-            msg = "Running network sniffer for %d more seconds..."
-            write(1, msg % SNIFFER_TIME, "\r")
-            for i in xrange(SNIFFER_TIME):
-                write(1, msg % (SNIFFER_TIME - i), "\t\r")
+        msg = "Running network sniffer for %d more seconds..."
+        write(1, msg % SNIFFER_TIME, "\r")
+        for i in xrange(SNIFFER_TIME):
+            write(1, msg % (SNIFFER_TIME - i), "\t\r")
+            with profiling.stage("sniff_wait"):
                 time.sleep(1)
-            writeln(1, msg % 0, "done.")
+            watcher = follow_capture(watcher, previous)
+        writeln(1, msg % 0, "done.")
 
-            run("screen -XS dump quit")
+        run("screen -XS dump quit")
 
+    with profiling.stage("settle"):
         time.sleep(5)   # wait for connectivity to restore
 
-        # Grab the latest capture file (by name) for processing.
-        path = os.path.dirname(CAPTURE_PREFIX)
-        if not path: path = os.getcwd()
-        if not os.path.exists(path): os.makedirs(path)
-        name = os.path.basename(CAPTURE_PREFIX)
+    watcher = follow_capture(watcher, previous)
+    if watcher is None:
+        writeln(0, "The network sniffer didn't write a capture file.")
+        return None
+    return watcher.snapshot()
 
-        writeln(3, "Looking for %s/%s*.csv" % (path, name))
-        files = sorted([fn for fn in os.listdir(path) \
-            if fn.startswith(name) and fn.endswith(".csv")])
-        writeln(2, "Available files: %s" % repr(files))
-        filename = os.path.join(path, files[-1])
+def parse(capture):
+    """ Finds the open networks, and the unassociated clients, in a capture.
 
-    writeln(2, "Parsing network traffic from", filename)
+    :capture    what `sniff` returned
+    :returns    a ([ Network() ], set([ client MACs ])) pair
+    """
+    if capture is None:
+        return [], set()
+
+    if isinstance(capture, basestring):
+        writeln(2, "Parsing network traffic from", capture)
+
+        # Networks are parsed as they're filtered, so both count as parsing.
+        with open(capture, "r") as csv, profiling.stage("parse_csv"):
+            networks = networkparser.filter_networks(
+                networkparser.iter_networks(csv), open_only=True)
+            unassoc_macs = set([c.mac for c in networkparser.iter_clients(csv)])
+        return networks, unassoc_macs
+
+    with profiling.stage("filter"):
+        networks = networkparser.filter_networks(capture.networks,
+            open_only=True)
+    return networks, set([c.mac for c in capture.clients])
+
+def probe(found, radio=None):
+    """ Connects to each open network to find the clients on it.
+
+    :found          what `parse` returned
+    :radio[=None]   a lock to hold while the adapter is in use, so that
+                    probing doesn't overlap with sniffing
+    :returns        a ({ Network(): set([ client MACs ]) }, unassociated
+                    client MACs) pair
+    """
+    networks, unassoc_macs = found
 
-    networks, clients = [], []
-    with open(filename, "r") as csv:
-        networks, clients = networkparser.parse_csv(csv)
-        networks = networkparser.filter_open_networks(networks)
-        networks = networkparser.filter_duplicate_names(networks)
+    radio = radio or threading.Lock()
+    with profiling.stage("radio_wait"):
+        radio.acquire()
 
     macdump = {}    # dict -> { network: [ users ]}
-    for nw in networks:
-        if nw.name == "n/a":
-            writeln(2, "Skipping hidden SSID network:", nw.mac)
-            continue
-
-        writeln(1, "Connecting to open network:", nw.name)
-        writeln(2, "  BSSID: %s" % nw.mac.upper())
-        writeln(2, "  Signal strength: %d%%" % nw.signal)
-
-        stdout, _ = run("./connect.sh %s --forget | %s" % (nw.mac.upper(),
-            'grep -iP \'^\s*([A-Fa-f\d]{2}:?){6}\''))
-
-        found_macs = set([x.strip() for x in stdout.split('\n') if x.strip()])
-        if not found_macs:
-            writeln(1, "  No clients on this network.")
-        else:
-            writeln(1, "  Found clients:")
-            writeln(1, "   ", "\n    ".join(found_macs))
-            macdump[nw] = found_macs
-        writeln(1)
+    try:
+        for nw in networks:
+            if nw.name == "n/a":
+                writeln(2, "Skipping hidden SSID network:", nw.mac)
+                continue
+
+            writeln(1, "Connecting to open network:", nw.name)
+            writeln(2, "  BSSID: %s" % nw.mac.upper())
+            writeln(2, "  Signal strength: %d%%" % nw.signal)
+
+            with profiling.stage("connect"):
+                stdout, _ = run("./connect.sh %s --forget | %s" % (
+                    nw.mac.upper(), 'grep -iP \'^\s*([A-Fa-f\d]{2}:?){6}\''))
+
+            found_macs = set([x.strip() for x in stdout.split('\n') if x.strip()])
+            if not found_macs:
+                writeln(1, "  No clients on this network.")
+            else:
+                writeln(1, "  Found clients:")
+                writeln(1, "   ", "\n    ".join(found_macs))
+                macdump[nw] = found_macs
+            writeln(1)
+    finally:
+        radio.release()
 
-    return macdump, set([c.mac for c in clients])
+    return macdump, unassoc_macs
 
-def transmit(master, network_dump, clients):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    with Progress("Connecting to master server, %s:%d", 2):
-        s.connect(master)
+def scan(operation):
+    """ Sniffs, parses and probes one scan's worth, one step after another.
+    """
+    return probe(parse(sniff(operation)))
 
+def transmit(uplink, network_dump, clients):
     with Progress("Transmitting data from %d networks" % len(network_dump), 2):
-        for nw in network_dump:
-            payload = "%s|%s\x00" % (nw.bssid.replace(':', ''),
-                ';'.join(network_dump[nw]))
-            s.sendall(payload)
+        sent = uplink.send(network_dump)
 
-    s.close()
+    if not sent:
+        writeln(1, "Master server unavailable, dropped data from %d networks." % (
+            len(network_dump)))
+    elif uplink.spool is not None:
+        writeln(2, "%d bytes waiting to be sent." % uplink.spool.backlog)
+    return sent
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=""
@@ -156,23 +786,52 @@ if __name__ == "__main__":
     parser.add_argument("op", metavar="IFACE|FILENAME",
         help="either an interface to scan, or a capture file to process")
     parser.add_argument("-i", "--interval", metavar="SEC", type=int, default=30,
-        help="specifies delay between vicinity scans")
+        help="specifies delay between the end of one capture and the start of "
+             "the next")
     parser.add_argument("-n", "--count", type=int, default=1,
         help="specifies number of scan sequences to perform, 0 means infinite")
     parser.add_argument("-t", "--timeout", type=int, default=SNIFFER_TIME,
         help="specifies the amount of time to perform packet sniffing")
+    parser.add_argument("-P", "--protocol", type=int, default=protocol.VERSION_BINARY,
+        choices=[protocol.VERSION_TEXT, protocol.VERSION_BINARY],
+        help="wire protocol version to speak to the master server; use 1 for "
+             "servers that predate the binary format")
+    parser.add_argument("-N", "--node-id", default=socket.gethostname(),
+        help="identifies this tracker to the master server, defaults to the "
+             "host name")
+    parser.add_argument("-S", "--snapshot-every", metavar="N", type=int,
+        default=Uplink.SNAPSHOT_EVERY,
+        help="send a full snapshot every N scans, and only changes otherwise")
+    parser.add_argument("--full-reports", action="store_true",
+        help="send every scan in full, for servers that predate delta reports")
+    parser.add_argument("--spool", metavar="DIR", default=SPOOL_DIR,
+        help="directory to queue reports in while the master server is "
+             "unreachable")
+    parser.add_argument("--spool-size", metavar="MiB", type=float,
+        default=Spool.MAX_SIZE / 1048576.0,
+        help="how much to queue before dropping the oldest reports")
+    parser.add_argument("--no-spool", action="store_true",
+        help="write reports directly, dropping them if the master server is "
+             "unreachable")
+    parser.add_argument("--queue-depth", metavar="N", type=int, default=1,
+        help="how many scans may wait on a slow step (parsing, probing or "
+             "transmitting) before capturing pauses")
+    parser.add_argument("--profile", metavar="FILE",
+        help="append the time spent in each step of every scan to FILE, as "
+             "JSON lines (- for stdout)")
+    parser.add_argument("--cprofile", metavar="FILE",
+        help="run under cProfile, and write the combined stats to FILE")
     parser.add_argument("-v", default=1, action="count",
         help="output level (1-3)")
     parser.add_argument("-q", "--quiet", action="store_true",
         help="stop all output, overriding -v")
     args = parser.parse_args()
 
-    VERBOSITY = args.v if not args.quiet else 0
+    log.configure(args.v if not args.quiet else log.QUIET)
     SNIFFER_TIME = args.timeout
 
     # Check for root permissions by binding a socket to a protected port.
     try:
-        import socket
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.bind(("localhost", 1023))
     except socket.error, e:
@@ -184,14 +843,44 @@ if __name__ == "__main__":
         s.close()
         del s
 
-    n = 0
-    while args.count == 0 or n < args.count:
-        joined_macs, unassoc_macs = scan(args.op)
-        n += 1
-
-        transmit(("localhost", 0XC1A), joined_macs, unassoc_macs)
+    spool = None
+    if not args.no_spool:
+        spool = Spool(args.spool, max_size=int(args.spool_size * 1048576))
+
+    uplink = Uplink(MASTER, args.protocol,
+        node_id=None if args.full_reports else args.node_id,
+        snapshot_every=args.snapshot_every, spool=spool)
+
+    # Captures are taken here, while the previous one is still being
+    # processed; only probing has to wait, as it needs the adapter too.
+    if args.cprofile:
+        profiling.profile_calls()
+
+    radio = threading.Lock()
+    pipeline = Pipeline([
+        ("parse", parse),
+        ("probe", lambda found: probe(found, radio)),
+        ("transmit", lambda result: transmit(uplink, *result)),
+    ], args.queue_depth,
+        report=profiling.Report(args.profile).write if args.profile else None)
+    try:
+        n = 0
+        while args.count == 0 or n < args.count:
+            n += 1
+            profile = profiling.Profile(cycle=n)
+            with profiling.recording(profile), profile.stage("sniff"), radio:
+                capture = profiling.call(sniff, args.op)
+            pipeline.put(capture, profile)
+
+            # Don't needlessly sleep on the last run
+            if args.count == 0 or n < args.count:
+                writeln(1, "Completed capture, %ds until the next one...\n" % (
+                    args.interval))
+                time.sleep(args.interval)
+
+        pipeline.close()
 
-        # Don't needlessly sleep on the last run
-        if n < args.count:
-            writeln(1, "Completed scan, %ds until the next one...\n" % args.interval)
-            time.sleep(args.interval)
+    finally:
+        uplink.close()
+        if args.cprofile and profiling.dump_calls(args.cprofile):
+            writeln(1, "Wrote profiler stats to", args.cprofile)